@@ -0,0 +1,65 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class AsyncLRUCache(Generic[T]):
+    """按键缓存异步计算结果的 LRU 缓存
+
+    键通常包含文件版本，文件变化后自然失效；条目在 ttl 秒后过期，超过 max_entries 时淘汰最久未使用的条目。
+    同一个键的并发请求只计算一次，其余请求等待同一个结果；计算失败的结果不缓存。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> (值, 写入时间)
+        self._pending: Dict[Hashable, asyncio.Future] = {}   # 进行中的计算任务
+
+    def get(self, key: Hashable) -> Optional[T]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, stored = entry
+        if time.monotonic() - stored > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: T):
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_create(self, key: Hashable, create: Callable[[], Awaitable[T]]) -> T:
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        task = self._pending.get(key)
+        if task is None:
+            self.misses += 1
+            # 计算在独立任务中运行，发起请求的客户端断开不会影响其他等待者
+            task = self._pending[key] = asyncio.ensure_future(create())
+            task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Future):
+        self._pending.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "pending": len(self._pending),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,461 @@
+"""Noediv 流式播放基准测试
+
+在临时目录中生成测试媒体，用本地 WebDAV 服务器（wsgidav）代替 NAS，
+以子进程启动后端，然后模拟多个并发观众：
+
+  listing     GET  /api/files                 目录列表
+  head        HEAD /api/raw/{file}            文件信息
+  sequential  GET  /api/stream-direct/{file}  从头顺序播放，按服务端裁剪后的范围连续请求到文件末尾
+  seek        GET  /api/stream-direct/{file}  随机跳转，每次只读开头一段后断开
+  converted   GET  /api/converted/{file}      MKV 转换播放
+
+报告吞吐量（顺序播放另有每个范围请求的吞吐量）、首字节时间和跳转延迟的 p50/p99，以及后端进程（含已退出的 ffmpeg 子进程）
+的 CPU 时间和峰值内存。每个场景开始前清空块缓存和元数据缓存，测量的是经过上游的路径。
+
+    python bench.py                      # 运行并与基线比较
+    python bench.py --save-baseline      # 把本次结果保存为基线
+
+需要额外安装 wsgidav 和 cheroot，并且 PATH 中有 ffmpeg。
+基线与机器相关，默认保存在 bench_baseline.json（不纳入版本库）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+import httpx
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+DAV_USERNAME = "bench"
+DAV_PASSWORD = "bench"
+
+# 跳转后读取这么多数据才算可以继续播放
+SEEK_READ_BYTES = 256 * 1024
+
+# 以下指标越大越好，其余（延迟、CPU、内存）越小越好
+HIGHER_IS_BETTER = ("throughput_mbps", "requests_per_second", "range_mbps_p50", "range_mbps_p10")
+
+SCENARIOS = ("listing", "head", "sequential", "seek", "converted")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+# ---- 测试数据 ----
+
+def generate_media(directory: str, duration: int, bitrate: str, listing_files: int):
+    """生成 H.264/AAC 的 MP4（直接播放）和同内容的 MKV（转换播放），以及用于目录列表的小文件"""
+    mp4 = os.path.join(directory, "sample.mp4")
+    subprocess.run(
+        [
+            "ffmpeg", "-v", "error", "-y",
+            "-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate=24:duration={duration}",
+            "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+            "-c:v", "libx264", "-preset", "ultrafast", "-b:v", bitrate, "-g", "48",
+            "-c:a", "aac", "-b:a", "128k", "-shortest", mp4,
+        ],
+        check=True,
+    )
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-i", mp4, "-c", "copy", os.path.join(directory, "sample.mkv")],
+        check=True,
+    )
+    for i in range(listing_files):
+        with open(os.path.join(directory, f"episode_{i:04d}.mkv"), "wb") as f:
+            f.write(os.urandom(1024))
+
+
+# ---- 服务器 ----
+
+class DavServer:
+    """本地 WebDAV 服务器，在后台线程中运行"""
+
+    def __init__(self, directory: str):
+        try:
+            from cheroot import wsgi
+            from wsgidav.wsgidav_app import WsgiDAVApp
+        except ImportError:
+            sys.exit("基准测试需要 wsgidav 和 cheroot: pip install wsgidav cheroot")
+        self.port = free_port()
+        app = WsgiDAVApp({
+            "host": "127.0.0.1",
+            "port": self.port,
+            "provider_mapping": {"/": directory},
+            "simple_dc": {"user_mapping": {"*": {DAV_USERNAME: {"password": DAV_PASSWORD}}}},
+            "verbose": 0,
+            "logging": {"enable": False},
+        })
+        self.server = wsgi.Server(("127.0.0.1", self.port), app, numthreads=32)
+        self._thread = threading.Thread(target=self.server.start, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.server.stop()
+
+
+class AppServer:
+    """以子进程运行的后端，缓存与数据库都放在临时目录中"""
+
+    def __init__(self, workdir: str, dav: DavServer, extra_env: Dict[str, str]):
+        self.port = free_port()
+        self.log_path = os.path.join(workdir, "server.log")
+        self.env = dict(
+            os.environ,
+            WEBDAV_SERVER=dav.url,
+            WEBDAV_USERNAME=DAV_USERNAME,
+            WEBDAV_PASSWORD=DAV_PASSWORD,
+            MEDIA_ROOT="/",
+            INTERNAL_BASE_URL=self.url,
+            BLOCK_CACHE_DIR=os.path.join(workdir, "blocks"),
+            TRANSCODE_CACHE_DIR=os.path.join(workdir, "transcode"),
+            THUMBNAIL_CACHE_DIR=os.path.join(workdir, "thumbnails"),
+            METADATA_DB=os.path.join(workdir, "metadata.db"),
+            CATALOG_DB=os.path.join(workdir, "catalog.db"),
+            CATALOG_REFRESH_INTERVAL="0",
+            LOCAL_MEDIA_ROOT="",
+            **extra_env,
+        )
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout: float = 30):
+        self._log = open(self.log_path, "wb")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(self.port),
+             "--log-level", "warning"],
+            cwd=ROOT, env=self.env, stdout=self._log, stderr=subprocess.STDOUT,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                if httpx.get(f"{self.url}/api/metrics", timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        sys.exit(f"后端启动失败，日志见 {self.log_path}")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self._log.close()
+
+
+class ProcessSampler:
+    """从 /proc 读取进程的 CPU 时间和峰值常驻内存（仅 Linux，其他平台返回 None）"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self._ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def cpu_seconds(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                # comm 可能含空格，从最后一个 ')' 之后开始按字段解析
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            return None
+        # utime, stime, cutime, cstime：包含已被回收的 ffmpeg 子进程
+        return sum(int(value) for value in fields[11:15]) / self._ticks
+
+    def peak_rss_mb(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return None
+
+
+# ---- 场景 ----
+
+@dataclass
+class Samples:
+    requests: int = 0
+    errors: int = 0
+    bytes: int = 0
+    latencies: List[float] = field(default_factory=list)    # 整个请求
+    ttfb: List[float] = field(default_factory=list)         # 首字节
+    seeks: List[float] = field(default_factory=list)        # 跳转后读到 SEEK_READ_BYTES
+    ranges: List[float] = field(default_factory=list)       # 顺序播放中每个范围请求的吞吐量（Mbps）
+
+
+class Bench:
+    def __init__(self, base_url: str, args):
+        self.base_url = base_url
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(120, connect=10),
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=64),
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def reset_caches(self):
+        await self.client.delete("/api/cache/blocks")
+        await self.client.delete("/api/cache/metadata")
+        await self.client.delete("/api/cache/transcode")
+
+    async def _timed(self, samples: Samples, method: str, url: str, headers: Optional[dict] = None,
+                     limit: Optional[int] = None):
+        """发送一个请求并读取响应体（最多 limit 字节），记录首字节时间和总耗时"""
+        started = time.perf_counter()
+        samples.requests += 1
+        received = 0
+        try:
+            async with self.client.stream(method, url, headers=headers) as response:
+                if response.status_code >= 400:
+                    samples.errors += 1
+                    return
+                async for chunk in response.aiter_raw():
+                    if not received:
+                        samples.ttfb.append(time.perf_counter() - started)
+                    received += len(chunk)
+                    if limit is not None and received >= limit:
+                        break
+        except httpx.HTTPError:
+            samples.errors += 1
+            return
+        finally:
+            samples.bytes += received
+        if method == "HEAD" or not received:
+            samples.ttfb.append(time.perf_counter() - started)
+        samples.latencies.append(time.perf_counter() - started)
+        return received
+
+    async def listing(self, samples: Samples):
+        for _ in range(self.args.requests):
+            await self._timed(samples, "GET", "/api/files")
+
+    async def head(self, samples: Samples):
+        for _ in range(self.args.requests):
+            await self._timed(samples, "HEAD", "/api/raw/sample.mp4")
+
+    async def sequential(self, samples: Samples):
+        # 浏览器的 <video> 以 "bytes=0-" 开始播放；服务端会裁剪开放范围，
+        # 像播放器一样从上一段的末尾继续请求，直到文件末尾或达到字节预算
+        size = self.args.media_size
+        if self.args.sequential_bytes:
+            size = min(size, self.args.sequential_bytes)
+        offset = 0
+        while offset < size:
+            started = time.perf_counter()
+            received = await self._timed(samples, "GET", "/api/stream-direct/sample.mp4",
+                                         {"Range": f"bytes={offset}-"})
+            if not received:
+                break
+            elapsed = time.perf_counter() - started
+            if elapsed > 0:
+                samples.ranges.append(received * 8 / elapsed / 1e6)
+            offset += received
+
+    async def seek(self, samples: Samples):
+        size = self.args.media_size
+        offsets = [self.rng.randrange(0, max(size - SEEK_READ_BYTES, 1)) for _ in range(self.args.seeks)]
+        for offset in offsets:
+            started = time.perf_counter()
+            received = await self._timed(samples, "GET", "/api/stream-direct/sample.mp4",
+                                         {"Range": f"bytes={offset}-"}, limit=SEEK_READ_BYTES)
+            if received:
+                samples.seeks.append(time.perf_counter() - started)
+
+    async def converted(self, samples: Samples):
+        await self._timed(samples, "GET", f"/api/converted/{quote('sample.mkv')}")
+
+    async def run(self, name: str, viewers: int, sampler: ProcessSampler) -> dict:
+        await self.reset_caches()
+        samples = Samples()
+        worker = getattr(self, name)
+        cpu_before = sampler.cpu_seconds()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(samples) for _ in range(viewers)))
+        elapsed = time.perf_counter() - started
+        cpu_after = sampler.cpu_seconds()
+
+        result = {
+            "viewers": viewers,
+            "requests": samples.requests,
+            "errors": samples.errors,
+            "seconds": elapsed,
+            "throughput_mbps": samples.bytes * 8 / elapsed / 1e6 if elapsed else 0.0,
+            "requests_per_second": samples.requests / elapsed if elapsed else 0.0,
+            "ttfb_p50_ms": percentile(samples.ttfb, 50) * 1000,
+            "ttfb_p99_ms": percentile(samples.ttfb, 99) * 1000,
+            "latency_p50_ms": percentile(samples.latencies, 50) * 1000,
+            "latency_p99_ms": percentile(samples.latencies, 99) * 1000,
+        }
+        if samples.ranges:
+            result["ranges"] = len(samples.ranges)
+            result["range_mbps_p50"] = percentile(samples.ranges, 50)
+            result["range_mbps_p10"] = percentile(samples.ranges, 10)
+        if samples.seeks:
+            result["seek_p50_ms"] = percentile(samples.seeks, 50) * 1000
+            result["seek_p99_ms"] = percentile(samples.seeks, 99) * 1000
+        if cpu_before is not None and cpu_after is not None:
+            result["cpu_seconds"] = cpu_after - cpu_before
+        return result
+
+
+# ---- 报告与基线 ----
+
+# 与基线比较的指标；其余只作参考
+COMPARED = ("throughput_mbps", "requests_per_second", "range_mbps_p50", "range_mbps_p10", "ttfb_p50_ms",
+            "ttfb_p99_ms", "seek_p50_ms", "seek_p99_ms", "cpu_seconds", "peak_rss_mb")
+
+# 低于此值的基线只是噪声，不参与比较
+NOISE_FLOOR = {"cpu_seconds": 0.5}
+
+
+def format_report(results: Dict[str, dict]) -> str:
+    lines = []
+    for name, result in results.items():
+        lines.append(f"[{name}]")
+        for key, value in result.items():
+            lines.append(f"  {key:<22} {value:.2f}" if isinstance(value, float) else f"  {key:<22} {value}")
+    return "\n".join(lines)
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """返回超出容差的退化项"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name) or {}
+        for key in COMPARED:
+            if key not in result or not base.get(key) or base[key] < NOISE_FLOOR.get(key, 0):
+                continue
+            change = (result[key] - base[key]) / base[key]
+            worse = -change if key in HIGHER_IS_BETTER else change
+            marker = "  << 退化" if worse > tolerance else ""
+            print(f"  {name}.{key:<22} {base[key]:>10.2f} -> {result[key]:>10.2f} ({change:+.0%}){marker}")
+            if marker:
+                regressions.append(f"{name}.{key}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Noediv 流式播放基准测试")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="逗号分隔的场景列表")
+    parser.add_argument("--viewers", type=int, default=8, help="并发观众数")
+    parser.add_argument("--converted-viewers", type=int, default=2, help="转换播放的并发观众数")
+    parser.add_argument("--requests", type=int, default=50, help="listing/head 每个观众的请求数")
+    parser.add_argument("--sequential-bytes", type=int, default=0,
+                        help="sequential 每个观众读取的字节预算，0 表示读到文件末尾")
+    parser.add_argument("--seeks", type=int, default=20, help="每个观众的跳转次数")
+    parser.add_argument("--duration", type=int, default=60, help="测试视频时长（秒）")
+    parser.add_argument("--bitrate", default="4M", help="测试视频码率")
+    parser.add_argument("--listing-files", type=int, default=200, help="目录中额外的文件数")
+    parser.add_argument("--seed", type=int, default=1, help="跳转位置的随机种子")
+    parser.add_argument("--baseline", default=os.path.join(ROOT, "bench_baseline.json"), help="基线文件")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的退化比例")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="传给后端的环境变量，可重复")
+    return parser.parse_args(argv)
+
+
+async def run_scenarios(app: AppServer, args) -> Dict[str, dict]:
+    sampler = ProcessSampler(app.process.pid)
+    bench = Bench(app.url, args)
+    results = {}
+    try:
+        for name in args.scenarios.split(","):
+            name = name.strip()
+            if name not in SCENARIOS:
+                sys.exit(f"未知场景: {name}")
+            viewers = args.converted_viewers if name == "converted" else args.viewers
+            print(f"运行 {name}（{viewers} 个观众）...", flush=True)
+            results[name] = await bench.run(name, viewers, sampler)
+    finally:
+        await bench.aclose()
+    peak = sampler.peak_rss_mb()
+    if peak is not None:
+        results["process"] = {"peak_rss_mb": peak, "cpu_seconds": sampler.cpu_seconds()}
+    return results
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    with tempfile.TemporaryDirectory(prefix="noediv_bench_") as workdir:
+        media = os.path.join(workdir, "media")
+        os.makedirs(media)
+        print("生成测试媒体...", flush=True)
+        generate_media(media, args.duration, args.bitrate, args.listing_files)
+        args.media_size = os.path.getsize(os.path.join(media, "sample.mp4"))
+
+        dav = DavServer(media)
+        dav.start()
+        app = AppServer(workdir, dav, extra_env)
+        app.start()
+        try:
+            results = asyncio.run(run_scenarios(app, args))
+        finally:
+            app.stop()
+            dav.stop()
+
+    print(format_report(results))
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"已保存基线: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("没有基线，使用 --save-baseline 保存本次结果")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    print(f"与基线比较（容差 {args.tolerance:.0%}）:")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"退化: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,515 @@
+import asyncio
+import json
+import logging
+import mmap
+import os
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:     # Windows：没有 flock，只使用一个 slab
+    fcntl = None
+
+from metacache import FileMeta
+from metrics import REGISTRY
+from shaping import CLASSES, BandwidthScheduler, Flow
+
+INDEX_VERSION = 1
+
+# 多个 worker 进程各自独占一个 slab（blocks.slab、blocks.1.slab……），最多尝试的数量
+MAX_SLABS = 64
+
+
+def file_version(meta: FileMeta) -> str:
+    """文件版本标识：优先使用 ETag，没有时退化为大小+修改时间"""
+    return meta.etag or f"{meta.size}-{meta.last_modified}"
+
+
+class BlockCache:
+    """定长对齐块的磁盘缓存
+
+    所有块存放在一个预分配（稀疏）的 slab 文件中，通过 mmap 读写；
+    块按 (路径, 版本, 块序号) 索引，容量不足时按 LRU 淘汰。
+    索引在关闭时写入磁盘，重启后可继续使用已缓存的数据；打开时读取后即删除，
+    未正常关闭（崩溃、被杀死）时不会留下与 slab 内容不一致的索引。
+    每个进程用 flock 独占一个 slab，多个 worker 不会互相覆盖槽位。
+    """
+
+    def __init__(self, directory: str, max_bytes: int, block_size: int = 1024 * 1024):
+        self.directory = directory
+        self.block_size = block_size
+        self.slots = max(max_bytes // block_size, 0)
+        self.hits = 0
+        self.misses = 0
+        self._index = OrderedDict()   # key -> (slot, length)
+        self._free: List[int] = []
+        self._mm: Optional[mmap.mmap] = None
+        self._fd: Optional[int] = None
+        self._name = "blocks"
+        # 正在从上游读取、尚未写完的块：(路径, 版本) -> [InflightFetch]
+        self.inflight: Dict[Tuple[str, str], list] = {}
+        if self.slots:
+            self._open()
+
+    @property
+    def enabled(self) -> bool:
+        return self._mm is not None
+
+    def _slab_path(self) -> str:
+        return os.path.join(self.directory, f"{self._name}.slab")
+
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, f"{self._name}.index.json")
+
+    def _lock_slab(self) -> Optional[int]:
+        """打开并独占一个未被其他进程使用的 slab，全部被占用时返回 None"""
+        for n in range(MAX_SLABS if fcntl is not None else 1):
+            self._name = "blocks" if n == 0 else f"blocks.{n}"
+            fd = os.open(self._slab_path(), os.O_RDWR | os.O_CREAT, 0o600)
+            if fcntl is None:
+                return fd
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            return fd
+        return None
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        capacity = self.slots * self.block_size
+        self._fd = self._lock_slab()
+        if self._fd is None:
+            logging.warning(f"块缓存的 slab 均被其他进程占用，本进程不使用块缓存: {self.directory}")
+            return
+        if os.fstat(self._fd).st_size != capacity:
+            os.ftruncate(self._fd, capacity)
+        self._mm = mmap.mmap(self._fd, capacity)
+        self._load_index()
+        used = {slot for slot, _ in self._index.values()}
+        self._free = [slot for slot in range(self.slots - 1, -1, -1) if slot not in used]
+        logging.info(f"块缓存已就绪: {self.directory}, {self.slots} 个块, 已缓存 {len(self._index)} 个")
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        finally:
+            # 索引只在正常关闭时写入；此后槽位会被复用，旧索引不能留到下一次启动
+            try:
+                os.remove(self._index_path())
+            except OSError:
+                pass
+        if data.get("version") != INDEX_VERSION or data.get("block_size") != self.block_size:
+            return
+        for key, slot, length in data.get("entries", []):
+            if 0 <= slot < self.slots:
+                self._index[key] = (slot, length)
+        # 索引损坏或容量变化导致的重复槽位，只保留最近使用的一个
+        seen = set()
+        for key in reversed(list(self._index)):
+            slot = self._index[key][0]
+            if slot in seen:
+                del self._index[key]
+            seen.add(slot)
+
+    def _save_index(self):
+        data = {
+            "version": INDEX_VERSION,
+            "block_size": self.block_size,
+            "entries": [[key, slot, length] for key, (slot, length) in self._index.items()],
+        }
+        tmp_path = self._index_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._index_path())
+
+    @staticmethod
+    def key(path: str, version: str, block: int) -> str:
+        return f"{path}\0{version}\0{block}"
+
+    def contains(self, key: str) -> bool:
+        return key in self._index
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        self._index.move_to_end(key)
+        slot, length = entry
+        offset = slot * self.block_size
+        return self._mm[offset:offset + length]
+
+    def put(self, key: str, data: bytes):
+        if not self.enabled or len(data) > self.block_size:
+            return
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            slot = entry[0]
+        elif self._free:
+            slot = self._free.pop()
+        else:
+            # 淘汰最久未使用的块，复用其槽位
+            _, (slot, _) = self._index.popitem(last=False)
+        offset = slot * self.block_size
+        self._mm[offset:offset + len(data)] = data
+        self._index[key] = (slot, len(data))
+
+    def clear(self) -> int:
+        count = len(self._index)
+        self._index.clear()
+        self._free = list(range(self.slots - 1, -1, -1))
+        return count
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "block_size": self.block_size,
+            "blocks": len(self._index),
+            "max_blocks": self.slots,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def close(self):
+        if self._mm is None:
+            return
+        try:
+            self._mm.flush()
+            self._save_index()
+        except OSError as e:
+            logging.warning(f"保存块缓存索引失败: {str(e)}")
+        self._mm.close()
+        os.close(self._fd)
+        self._mm = None
+        self._fd = None
+
+
+# fetch(remote_path, start, end, etag) -> 字节流
+Fetcher = Callable[..., AsyncIterator[bytes]]
+
+COALESCED = REGISTRY.counter(
+    "noediv_upstream_coalesced_total",
+    "Block reads served by joining an upstream fetch already in flight",
+)
+DETACHED = REGISTRY.counter(
+    "noediv_upstream_detached_total",
+    "Readers detached from a shared upstream fetch because they fell behind",
+)
+
+
+class _Subscriber:
+    """共享读取的一个订阅者：有上限的缓冲队列"""
+
+    def __init__(self, flow: Optional[Flow], max_bytes: int):
+        self.flow = flow
+        self.max_bytes = max_bytes
+        self.chunks = deque()       # (文件偏移, 数据)
+        self.buffered = 0
+        self.closed = False         # 读取结束或已被分离
+        self.error: Optional[BaseException] = None
+        self._event = asyncio.Event()
+
+    def push(self, offset: int, chunk: bytes) -> bool:
+        """放入一块数据；缓冲已满时返回 False（至少总能放入一块）"""
+        if self.buffered and self.buffered + len(chunk) > self.max_bytes:
+            return False
+        self.chunks.append((offset, chunk))
+        self.buffered += len(chunk)
+        self._event.set()
+        return True
+
+    def close(self, error: Optional[BaseException] = None):
+        self.closed = True
+        self.error = error
+        self._event.set()
+
+    async def __aiter__(self) -> AsyncIterator[Tuple[int, bytes]]:
+        while True:
+            while self.chunks:
+                offset, chunk = self.chunks.popleft()
+                self.buffered -= len(chunk)
+                yield offset, chunk
+            if self.closed:
+                if self.error is not None:
+                    raise self.error
+                return
+            self._event.clear()
+            await self._event.wait()
+
+
+class InflightFetch:
+    """一次进行中的上游块读取 [first, last]
+
+    读到的数据写入块缓存，同时分发给所有订阅者：同一文件同一版本的其他读取者
+    需要的块正在读取时直接订阅，不再向上游发起相同的请求。
+    每个订阅者的缓冲有上限，跟不上的订阅者被分离（之后从缓存或新的上游请求继续），
+    不会拖慢其他订阅者；所有订阅者都离开后读取停止。
+    上游带宽按订阅者中优先级最高的流申请，订阅者变化时正在等待的申请随之重新排队。
+    """
+
+    def __init__(self, reader: "CachedReader", path: str, meta: FileMeta, first: int, last: int):
+        self.reader = reader
+        self.path = path
+        self.meta = meta
+        self.first = first
+        self.last = last
+        self.block = first              # 正在拼装的块，之前的块已写入缓存
+        self.buffer = bytearray()       # 当前块已读到的部分
+        self.subscribers: List[_Subscriber] = []
+        self.finished = False
+        self.task: Optional[asyncio.Task] = None
+        self._waiting_flow: Optional[Flow] = None
+        self._flow_changed: Optional[asyncio.Future] = None
+
+    @property
+    def flow(self) -> Optional[Flow]:
+        """计入带宽调度的流：订阅者中优先级最高的（播放 > 批量 > 后台）"""
+        flows = [subscriber.flow for subscriber in self.subscribers if subscriber.flow is not None]
+        return min(flows, key=lambda flow: CLASSES.index(flow.kind), default=None)
+
+    def _reevaluate(self):
+        """订阅者变化后，正在等待带宽的申请若已不是最高优先级的流则重新排队"""
+        if self._flow_changed is not None and not self._flow_changed.done() and self.flow is not self._waiting_flow:
+            self._flow_changed.set_result(None)
+
+    async def _acquire(self, nbytes: int):
+        shaper = self.reader.shaper
+        while True:
+            flow = self.flow
+            if flow is None or shaper.rate <= 0:
+                await shaper.acquire(flow, nbytes)
+                return
+            self._waiting_flow = flow
+            self._flow_changed = asyncio.get_running_loop().create_future()
+            waiting = asyncio.ensure_future(shaper.acquire(flow, nbytes))
+            try:
+                await asyncio.wait((waiting, self._flow_changed), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                self._flow_changed.cancel()
+                if not waiting.done():
+                    waiting.cancel()
+                    await asyncio.gather(waiting, return_exceptions=True)
+            if not waiting.cancelled():
+                return waiting.result()
+
+    def covers(self, block: int) -> bool:
+        return not self.finished and self.block <= block <= self.last
+
+    def subscribe(self, flow: Optional[Flow], max_bytes: int) -> _Subscriber:
+        subscriber = _Subscriber(flow, max_bytes)
+        # 当前块已读到的部分尚未写入缓存，先补给新订阅者
+        if self.buffer:
+            subscriber.push(self.block * self.reader.cache.block_size, bytes(self.buffer))
+        if self.finished:
+            subscriber.close()
+        else:
+            self.subscribers.append(subscriber)
+            self._reevaluate()
+        return subscriber
+
+    def unsubscribe(self, subscriber: _Subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+            self._reevaluate()
+        # 所有订阅者都离开后停止读取；最后一个块照常读完，让紧接着的顺序请求命中缓存
+        if not self.subscribers and self.block < self.last and self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    def _publish(self, offset: int, chunk: bytes):
+        for subscriber in list(self.subscribers):
+            if not subscriber.push(offset, chunk):
+                self.subscribers.remove(subscriber)
+                subscriber.close()
+                DETACHED.inc()
+                self._reevaluate()
+
+    async def run(self):
+        cache = self.reader.cache
+        bs = cache.block_size
+        version = file_version(self.meta)
+        pos = self.first * bs
+        error = None
+        try:
+            async for chunk in self.reader.fetch(self.path, pos, min((self.last + 1) * bs, self.meta.size) - 1,
+                                                 etag=self.meta.etag):
+                await self._acquire(len(chunk))
+                self._publish(pos, chunk)
+                pos += len(chunk)
+                self.buffer += chunk
+                while len(self.buffer) >= bs:
+                    cache.put(BlockCache.key(self.path, version, self.block), bytes(self.buffer[:bs]))
+                    del self.buffer[:bs]
+                    self.block += 1
+            # 只有完整读到文件末尾的短块才缓存，避免缓存被截断的数据
+            if self.buffer and pos == self.meta.size:
+                cache.put(BlockCache.key(self.path, version, self.block), bytes(self.buffer))
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            error = e
+        finally:
+            self.finished = True
+            self.reader._forget(self)
+            for subscriber in self.subscribers:
+                subscriber.close(error)
+            self.subscribers.clear()
+
+
+class CachedReader:
+    """在上游之上读取字节范围：命中的块从本地读取，缺失的连续块合并为一次上游请求
+
+    从上游读到的数据按 flow 向带宽调度器申请额度，缓存命中的块不占用上游带宽。
+    缓存开启时，同一文件的并发读取共享进行中的上游请求（登记在块缓存上，
+    WebDAV 与 FTP 的读取器共用），每个读取者最多缓冲 subscriber_buffer 字节。
+    """
+
+    def __init__(self, cache: BlockCache, fetch: Fetcher, shaper: Optional[BandwidthScheduler] = None,
+                 subscriber_buffer: int = 8 * 1024 * 1024):
+        self.cache = cache
+        self.fetch = fetch
+        self.shaper = shaper or BandwidthScheduler()
+        self.subscriber_buffer = subscriber_buffer
+
+    def _missing_runs(self, path: str, version: str, first: int, last: int) -> List[Tuple[int, int]]:
+        runs = []
+        run_start = None
+        for block in range(first, last + 1):
+            missing = not self.cache.contains(BlockCache.key(path, version, block))
+            if missing and run_start is None:
+                run_start = block
+            elif not missing and run_start is not None:
+                runs.append((run_start, block - 1))
+                run_start = None
+        if run_start is not None:
+            runs.append((run_start, last))
+        return runs
+
+    def _find(self, path: str, version: str, block: int) -> Optional[InflightFetch]:
+        for fetch in self.cache.inflight.get((path, version), ()):
+            if fetch.covers(block):
+                return fetch
+        return None
+
+    def _start(self, path: str, meta: FileMeta, first: int, last: int) -> InflightFetch:
+        """为 [first, last] 中缺失的连续块发起上游读取，到已在读取中的块为止"""
+        version = file_version(meta)
+        for other in self.cache.inflight.get((path, version), ()):
+            if not other.finished and first < other.block <= last:
+                last = other.block - 1
+        while last > first and self.cache.contains(BlockCache.key(path, version, last)):
+            last -= 1
+        fetch = InflightFetch(self, path, meta, first, last)
+        self.cache.inflight.setdefault((path, version), []).append(fetch)
+        fetch.task = asyncio.get_running_loop().create_task(fetch.run())
+        return fetch
+
+    def _forget(self, fetch: InflightFetch):
+        key = (fetch.path, file_version(fetch.meta))
+        fetches = self.cache.inflight.get(key)
+        if fetches and fetch in fetches:
+            fetches.remove(fetch)
+            if not fetches:
+                del self.cache.inflight[key]
+
+    def _fetch_for(self, path: str, meta: FileMeta, block: int, last: int, join: bool = True):
+        """返回 (读取, 是否为加入已有读取)"""
+        version = file_version(meta)
+        fetch = self._find(path, version, block) if join else None
+        if fetch is not None:
+            COALESCED.inc()
+            return fetch, True
+        run_last = block
+        while run_last < last and not self.cache.contains(BlockCache.key(path, version, run_last + 1)):
+            run_last += 1
+        return self._start(path, meta, block, run_last), False
+
+    async def warm(self, path: str, meta: FileMeta, first: int, last: int, flow: Optional[Flow] = None) -> int:
+        """把 [first, last] 块中缺失的部分读入缓存，返回新缓存的块数"""
+        if not self.cache.enabled:
+            return 0
+        last = min(last, (meta.size - 1) // self.cache.block_size)
+        version = file_version(meta)
+        runs = self._missing_runs(path, version, first, last)
+        before = sum(run_last - run_first + 1 for run_first, run_last in runs)
+        for run_first, run_last in runs:
+            block = run_first
+            while block <= run_last:
+                fetch, _ = self._fetch_for(path, meta, block, run_last)
+                subscriber = fetch.subscribe(flow, self.subscriber_buffer)
+                try:
+                    async for _ in subscriber:
+                        pass
+                finally:
+                    fetch.unsubscribe(subscriber)
+                # 加入的读取可能在 run_last 之前结束，从它停下的位置继续
+                if fetch.block <= block:
+                    break
+                block = fetch.block
+        after = sum(run_last - run_first + 1 for run_first, run_last in self._missing_runs(path, version, first, last))
+        return before - after
+
+    async def read(self, path: str, meta: FileMeta, start: int, end: int,
+                   flow: Optional[Flow] = None) -> AsyncIterator[bytes]:
+        """读取文件的 [start, end] 字节（闭区间）"""
+        if not self.cache.enabled:
+            async for chunk in self.fetch(path, start, end, etag=meta.etag):
+                await self.shaper.acquire(flow, len(chunk))
+                yield chunk
+            return
+
+        bs = self.cache.block_size
+        version = file_version(meta)
+        first, last = start // bs, end // bs
+        missing = sum(run_last - run_first + 1 for run_first, run_last in self._missing_runs(path, version, first, last))
+        self.cache.misses += missing
+        self.cache.hits += last - first + 1 - missing
+
+        cursor = start
+        join = True
+        while cursor <= end:
+            block = cursor // bs
+            data = self.cache.get(BlockCache.key(path, version, block))
+            if data is not None:
+                piece = _slice_block(data, block, bs, cursor, end)
+                if not piece:
+                    return
+                yield piece
+                cursor += len(piece)
+                join = True
+                continue
+
+            # 缺失的块：加入正在读取它的上游请求，没有时发起新的请求
+            fetch, joined = self._fetch_for(path, meta, block, last, join)
+            subscriber = fetch.subscribe(flow, self.subscriber_buffer)
+            before = cursor
+            try:
+                async for offset, chunk in subscriber:
+                    lo = cursor - offset
+                    hi = min(end - offset + 1, len(chunk))
+                    if lo < 0:
+                        break
+                    if lo < hi:
+                        yield chunk[lo:hi]
+                        cursor = offset + hi
+                    if cursor > end:
+                        break
+            finally:
+                fetch.unsubscribe(subscriber)
+            if cursor == before:
+                # 自己发起的读取没有返回数据（上游提前结束）；加入的读取则改为自己读取
+                if not joined:
+                    return
+                join = False
+
+
+def _slice_block(data: bytes, block: int, block_size: int, start: int, end: int) -> bytes:
+    """截取块中落在 [start, end] 内的部分"""
+    block_start = block * block_size
+    lo = max(start - block_start, 0)
+    hi = min(end - block_start + 1, len(data))
+    return data[lo:hi]
@@ -0,0 +1,363 @@
+import asyncio
+import logging
+import os
+import posixpath
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import List, Optional, Tuple
+
+import anyio
+
+from metacache import FileMeta
+from upstream import DAVEntry, WebDAVUpstream
+
+MEDIA_EXTENSIONS = frozenset((
+    '.mp4', '.mkv', '.avi', '.mov', '.webm', '.mp3', '.flac', '.wav', '.aac',
+    '.m4v', '.ts', '.vob', '.mts', '.3gp',
+))
+AUDIO_EXTENSIONS = frozenset(('.mp3', '.flac', '.wav', '.aac'))
+
+# 列表接口允许的排序字段
+SORT_COLUMNS = {
+    "name": "f.name COLLATE NOCASE",
+    "path": "f.path COLLATE NOCASE",
+    "size": "f.size",
+    "mtime": "f.mtime",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,          -- 相对 MEDIA_ROOT 的路径，根目录为 ''
+    parent TEXT,
+    name TEXT NOT NULL,
+    etag TEXT NOT NULL DEFAULT '',
+    last_modified TEXT NOT NULL DEFAULT '',
+    crawled REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    content_type TEXT NOT NULL DEFAULT '',
+    etag TEXT NOT NULL DEFAULT '',
+    last_modified TEXT NOT NULL DEFAULT '',
+    mtime REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS files_dir_name ON files (dir, name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS files_name ON files (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+"""
+
+
+def media_type(name: str) -> Optional[str]:
+    """根据扩展名判断媒体类型，非媒体文件返回 None"""
+    ext = os.path.splitext(name)[1].lower()
+    if ext not in MEDIA_EXTENSIONS:
+        return None
+    return "audio" if ext in AUDIO_EXTENSIONS else "video"
+
+
+def parse_http_date(value: str) -> float:
+    """把 getlastmodified（RFC 1123）转换为时间戳，无法解析时返回 0"""
+    if not value:
+        return 0.0
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _like_pattern(text: str) -> str:
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _subtree(column: str) -> str:
+    # 匹配目录本身及其所有下级（? 依次为目录路径和 LIKE 前缀）
+    return f"({column} = ? OR {column} LIKE ? ESCAPE '\\')"
+
+
+def _subtree_args(path: str) -> Tuple[str, str]:
+    prefix = path.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return path, f"{prefix}/%" if path else "%"
+
+
+class Catalog:
+    """媒体库索引（SQLite）
+
+    目录和文件由后台爬虫写入，列表、排序和搜索完全在本地完成，不访问上游。
+    标题和标签来自 MetadataStore 的数据库，以 ATTACH 方式关联查询。
+    所有方法都是同步的，由调用方放到工作线程中执行。
+    """
+
+    def __init__(self, db_path: str, metadata_db: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.execute("ATTACH DATABASE ? AS meta", (metadata_db,))
+
+    # ---- 爬虫写入 ----
+
+    def get_dir(self, path: str) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute("SELECT * FROM dirs WHERE path = ?", (path,)).fetchone()
+
+    def child_dirs(self, path: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT path FROM dirs WHERE parent = ?", (path,)).fetchall()
+        return [row["path"] for row in rows]
+
+    def replace_dir(self, path: str, meta: FileMeta, entries: List[DAVEntry]):
+        """用一次 Depth 1 列表的结果替换目录内容，删除已不存在的文件和子目录"""
+        parent = posixpath.dirname(path) if path else None
+        files = []
+        subdirs = set()
+        for entry in entries:
+            child = posixpath.join(path, entry.name) if path else entry.name
+            if entry.is_dir:
+                subdirs.add(child)
+                continue
+            kind = media_type(entry.name)
+            if kind is None:
+                continue
+            files.append((
+                child, path, entry.name, kind, entry.meta.size, entry.meta.content_type,
+                entry.meta.etag, entry.meta.last_modified, parse_http_date(entry.meta.last_modified),
+            ))
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO dirs (path, parent, name, etag, last_modified, crawled) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified, "
+                "crawled = excluded.crawled",
+                (path, parent, posixpath.basename(path), meta.etag, meta.last_modified, time.time()),
+            )
+            stale = [row["path"] for row in self._conn.execute(
+                "SELECT path FROM dirs WHERE parent = ?", (path,)
+            ) if row["path"] not in subdirs]
+            for sub in stale:
+                self._remove_subtree(sub)
+            listed = {f[0] for f in files}
+            removed = [(row["path"],) for row in self._conn.execute(
+                "SELECT path FROM files WHERE dir = ?", (path,)
+            ) if row["path"] not in listed]
+            self._conn.executemany("DELETE FROM files WHERE path = ?", removed)
+            self._conn.executemany(
+                "INSERT INTO files (path, dir, name, type, size, content_type, etag, last_modified, mtime) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET type = excluded.type, size = excluded.size, "
+                "content_type = excluded.content_type, etag = excluded.etag, "
+                "last_modified = excluded.last_modified, mtime = excluded.mtime",
+                files,
+            )
+
+    def remove_dir(self, path: str):
+        with self._lock, self._conn:
+            self._remove_subtree(path)
+
+    def _remove_subtree(self, path: str):
+        self._conn.execute(f"DELETE FROM files WHERE {_subtree('dir')}", _subtree_args(path))
+        self._conn.execute(f"DELETE FROM dirs WHERE {_subtree('path')}", _subtree_args(path))
+
+    # ---- 查询 ----
+
+    def has_dir(self, path: str) -> bool:
+        return self.get_dir(path) is not None
+
+    def list_dirs(self, path: str) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, name, last_modified FROM dirs WHERE parent = ? ORDER BY name COLLATE NOCASE",
+                (path,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def query(self, path: Optional[str] = None, recursive: bool = False, q: str = "",
+              tags: Optional[List[str]] = None, kind: Optional[str] = None,
+              sort: str = "name", descending: bool = False,
+              offset: int = 0, limit: int = 100) -> Tuple[int, List[dict]]:
+        """分页查询文件，返回 (总数, 当前页)
+
+        path 为空表示整个媒体库；q 按文件名或标题模糊匹配；tags 要求同时包含所有标签。
+        """
+        where = []
+        args = []
+        if path is not None:
+            if recursive:
+                where.append(_subtree("f.dir"))
+                args.extend(_subtree_args(path))
+            else:
+                where.append("f.dir = ?")
+                args.append(path)
+        if q:
+            where.append("(f.name LIKE ? ESCAPE '\\' OR a.title LIKE ? ESCAPE '\\')")
+            args.extend([_like_pattern(q)] * 2)
+        for tag in tags or []:
+            where.append("EXISTS (SELECT 1 FROM meta.metadata_tags t WHERE t.path = f.path AND t.tag = ?)")
+            args.append(tag)
+        if kind:
+            where.append("f.type = ?")
+            args.append(kind)
+        clause = f"WHERE {' AND '.join(where)}" if where else ""
+        order = f"{SORT_COLUMNS.get(sort, SORT_COLUMNS['name'])} {'DESC' if descending else 'ASC'}, f.path"
+
+        with self._lock:
+            total = self._conn.execute(
+                f"SELECT COUNT(*) FROM files f LEFT JOIN meta.metadata a ON a.path = f.path {clause}", args
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT f.path, f.dir, f.name, f.type, f.size, f.content_type, f.last_modified, a.title "
+                f"FROM files f LEFT JOIN meta.metadata a ON a.path = f.path {clause} "
+                f"ORDER BY {order} LIMIT ? OFFSET ?",
+                (*args, limit, offset),
+            ).fetchall()
+            items = [dict(row) for row in rows]
+            tag_rows = self._conn.execute(
+                f"SELECT path, tag FROM meta.metadata_tags WHERE path IN ({','.join('?' * len(items))}) ORDER BY tag",
+                [item["path"] for item in items],
+            ).fetchall()
+        tags_by_path = {}
+        for row in tag_rows:
+            tags_by_path.setdefault(row["path"], []).append(row["tag"])
+        for item in items:
+            item["tags"] = tags_by_path.get(item["path"], [])
+        return total, items
+
+    def stats(self) -> dict:
+        with self._lock:
+            files = self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            dirs = self._conn.execute("SELECT COUNT(*) FROM dirs").fetchone()[0]
+        return {"files": files, "dirs": dirs}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CatalogCrawler:
+    """后台爬虫：逐层 Depth 1 PROPFIND 遍历媒体库并写入 Catalog
+
+    目录的 ETag / getlastmodified 未变化时不重新列出其内容；
+    子目录的变化不一定反映到上级目录，因此未变化目录的已知子目录仍会用 Depth 0 逐个检查。
+    """
+
+    def __init__(self, catalog: Catalog, upstream: WebDAVUpstream, max_depth: int = 8,
+                 concurrency: int = 4, interval: float = 300):
+        self.catalog = catalog
+        self.upstream = upstream
+        self.max_depth = max_depth
+        self.interval = interval
+        self._semaphore = asyncio.Semaphore(max(concurrency, 1))
+        self._task: Optional[asyncio.Task] = None
+        self._crawl: Optional[asyncio.Task] = None
+        self.last_started: Optional[float] = None
+        self.last_finished: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.listed = 0
+        self.skipped = 0
+
+    @property
+    def running(self) -> bool:
+        return self._crawl is not None and not self._crawl.done()
+
+    def start(self):
+        """启动定时刷新；interval 为 0 时只在启动时爬取一次"""
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logging.exception(f"媒体库索引刷新失败: {str(e)}")
+            if self.interval <= 0:
+                return
+            await asyncio.sleep(self.interval)
+
+    def trigger(self, full: bool = False) -> bool:
+        """在后台开始一次刷新，已有刷新在进行时返回 False"""
+        if self.running:
+            return False
+        self._crawl = asyncio.get_running_loop().create_task(self.crawl(full))
+        self._crawl.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return True
+
+    async def refresh(self, full: bool = False):
+        """执行一次刷新；已有刷新在进行时等待它完成"""
+        if not self.running:
+            self._crawl = asyncio.get_running_loop().create_task(self.crawl(full))
+        await asyncio.shield(self._crawl)
+
+    async def crawl(self, full: bool = False):
+        """遍历媒体库；full 为 True 时忽略目录版本，重新列出所有目录"""
+        started = time.monotonic()
+        self.last_started = time.time()
+        self.listed = self.skipped = 0
+        self.last_error = None
+        level = [("", None, 0)]
+        try:
+            while level:
+                results = await asyncio.gather(*[self._visit(path, meta, depth, full) for path, meta, depth in level])
+                level = [child for children in results for child in children]
+        except Exception as e:
+            self.last_error = str(e)
+            raise
+        finally:
+            self.last_finished = time.time()
+        logging.info(f"媒体库索引刷新完成: 列出 {self.listed} 个目录, 跳过 {self.skipped} 个未变化目录, "
+                     f"耗时 {time.monotonic() - started:.1f}s")
+
+    async def _visit(self, path: str, meta: Optional[FileMeta], depth: int, full: bool) -> list:
+        """处理一个目录，返回需要继续访问的子目录 (路径, 元数据, 深度)"""
+        remote_path = self.upstream.remote_path(path)
+        try:
+            async with self._semaphore:
+                if meta is None:
+                    meta = await self.upstream.stat(remote_path)
+                    if meta is None:
+                        logging.info(f"目录已删除, 移出索引: {path or '/'}")
+                        await anyio.to_thread.run_sync(self.catalog.remove_dir, path)
+                        return []
+                stored = await anyio.to_thread.run_sync(self.catalog.get_dir, path)
+                versioned = bool(meta.etag or meta.last_modified)
+                unchanged = (not full and stored is not None and versioned
+                             and (stored["etag"], stored["last_modified"]) == (meta.etag, meta.last_modified))
+                if unchanged:
+                    self.skipped += 1
+                    if depth >= self.max_depth:
+                        return []
+                    children = await anyio.to_thread.run_sync(self.catalog.child_dirs, path)
+                    return [(child, None, depth + 1) for child in children]
+
+                entries = await self.upstream.list(remote_path)
+                await anyio.to_thread.run_sync(self.catalog.replace_dir, path, meta, entries)
+                self.listed += 1
+        except Exception as e:
+            # 单个目录失败时保留旧索引，继续处理其他目录
+            logging.warning(f"索引目录失败: {path or '/'}: {str(e)}")
+            self.last_error = f"{path or '/'}: {str(e)}"
+            return []
+        if depth >= self.max_depth:
+            return []
+        return [(posixpath.join(path, e.name) if path else e.name, e.meta, depth + 1)
+                for e in entries if e.is_dir]
+
+    async def aclose(self):
+        for task in (self._task, self._crawl):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*[t for t in (self._task, self._crawl) if t is not None], return_exceptions=True)
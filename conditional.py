@@ -0,0 +1,119 @@
+import re
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional
+
+from fastapi import Response
+
+from metacache import FileMeta
+
+# If-Match / If-None-Match 中的实体标签列表
+_ETAG_PATTERN = re.compile(r'\s*(W/)?"([^"]*)"\s*(?:,|$)')
+
+
+def http_timestamp(value: str) -> Optional[int]:
+    """解析 HTTP 日期，返回整秒时间戳；无法识别时返回 None"""
+    if not value:
+        return None
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def entity_tag(meta: FileMeta) -> str:
+    """带引号的 ETag
+
+    优先使用上游 PROPFIND 返回的 ETag，上游的弱标签保留 W/ 前缀；上游没有时由修改时间和大小生成，
+    文件被替换后二者至少有一个变化。
+    """
+    if meta.etag:
+        return f'W/"{meta.etag}"' if meta.weak_etag else f'"{meta.etag}"'
+    modified = http_timestamp(meta.last_modified)
+    if modified is None:
+        return ""
+    return f'"{modified:x}-{meta.size:x}"'
+
+
+def validator_headers(meta: FileMeta, cache_control: str = "") -> dict:
+    """响应中的 ETag、Last-Modified 和 Cache-Control"""
+    headers = {}
+    etag = entity_tag(meta)
+    if etag:
+        headers["ETag"] = etag
+    if meta.last_modified:
+        headers["Last-Modified"] = meta.last_modified
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    return headers
+
+
+def _etag_matches(header: str, etag: str, weak: bool) -> bool:
+    """header 为 "*" 或逗号分隔的实体标签列表；weak=False 时任一方为弱标签都不匹配"""
+    if header.strip() == "*":
+        return True
+    if not etag:
+        return False
+    etag_is_weak = etag.startswith('W/')
+    opaque = etag[2:] if etag_is_weak else etag
+    for match in _ETAG_PATTERN.finditer(header):
+        is_weak, value = match.group(1), match.group(2)
+        if (weak or not (is_weak or etag_is_weak)) and f'"{value}"' == opaque:
+            return True
+    return False
+
+
+def evaluate_preconditions(headers: Mapping[str, str], meta: FileMeta, method: str = "GET") -> Optional[int]:
+    """按 RFC 9110 13.2.2 的顺序检查条件请求头
+
+    返回 304（未修改）、412（前提条件失败）或 None（正常处理请求）。
+    """
+    etag = entity_tag(meta)
+    modified = http_timestamp(meta.last_modified)
+
+    if_match = headers.get("if-match")
+    if if_match is not None:
+        if not _etag_matches(if_match, etag, weak=False):
+            return 412
+    else:
+        since = http_timestamp(headers.get("if-unmodified-since", ""))
+        if since is not None and modified is not None and modified > since:
+            return 412
+
+    safe = method in ("GET", "HEAD")
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag, weak=True):
+            return 304 if safe else 412
+    elif safe:
+        since = http_timestamp(headers.get("if-modified-since", ""))
+        if since is not None and modified is not None and modified <= since:
+            return 304
+    return None
+
+
+def if_range_matches(headers: Mapping[str, str], meta: FileMeta) -> bool:
+    """If-Range 校验：不匹配时应忽略 Range，返回完整文件
+
+    只接受强校验：ETag 必须完全相同且双方都不是弱标签，日期必须与 Last-Modified 一致。
+    """
+    value = (headers.get("if-range") or "").strip()
+    if not value:
+        return True
+    if value.startswith('W/'):
+        return False
+    if value.startswith('"'):
+        etag = entity_tag(meta)
+        return bool(etag) and not meta.weak_etag and value == etag
+    since = http_timestamp(value)
+    return since is not None and since == http_timestamp(meta.last_modified)
+
+
+def precondition_response(status_code: int, validators: dict) -> Response:
+    """304 带上校验头以便客户端刷新缓存；412 不带响应体"""
+    if status_code == 304:
+        return Response(status_code=304, headers=validators)
+    return Response(status_code=status_code)
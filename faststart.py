@@ -0,0 +1,140 @@
+import dataclasses
+import os
+import struct
+from dataclasses import dataclass
+from typing import Iterator, Optional, Tuple
+
+from blockcache import file_version
+from metacache import FileMeta
+from seekindex import HEADER_READ, MAX_INDEX_BYTES, ReadAt, mp4_boxes, mp4_child, mp4_top_level
+
+# 可能是 MP4/MOV 的文件
+FASTSTART_EXTENSIONS = ('.mp4', '.m4v', '.mov')
+FASTSTART_CONTENT_TYPES = ('video/mp4', 'video/quicktime', 'video/x-m4v')
+
+# 块偏移中含有绝对位置、无法只改 stco/co64 的结构；出现时不重排
+_UNSUPPORTED = (b'saio', b'mvex')
+
+
+def faststart_candidate(filename: str, meta: FileMeta) -> bool:
+    return (os.path.splitext(filename)[1].lower() in FASTSTART_EXTENSIONS
+            or meta.content_type in FASTSTART_CONTENT_TYPES)
+
+
+def virtual_meta(meta: FileMeta) -> FileMeta:
+    """重排后文件的元数据：大小和修改时间不变，ETag 与原文件区分开"""
+    return dataclasses.replace(meta, etag=f"{file_version(meta)}-faststart")
+
+
+@dataclass
+class VirtualMP4:
+    """moov 移到 mdat 之前的虚拟文件
+
+    布局：原文件 [0, head_end) | 改写后的 moov | 原文件 [head_end, moov_start) | 原文件 [moov_end, size)
+    大小与原文件相同；moov 之外的字节原样从上游读取。moov 为空表示不需要（或无法）重排。
+    """
+    size: int
+    moov: bytes = b""
+    head_end: int = 0
+    moov_start: int = 0
+    moov_end: int = 0
+
+    @property
+    def relocated(self) -> bool:
+        return bool(self.moov)
+
+    def _segments(self) -> Iterator[Tuple[int, int, Optional[int]]]:
+        """虚拟文件的各段：(虚拟起点, 虚拟终点, 原文件起点)，原文件起点为 None 表示 moov"""
+        moov_length = len(self.moov)
+        yield 0, self.head_end, 0
+        yield self.head_end, self.head_end + moov_length, None
+        yield self.head_end + moov_length, self.moov_end, self.head_end
+        yield self.moov_end, self.size, self.moov_end
+
+    def pieces(self, start: int, end: int) -> Iterator[Tuple[Optional[bytes], int, int]]:
+        """把虚拟文件的 [start, end] 拆分为 (moov 中的数据, 0, 0) 或 (None, 原文件起点, 原文件终点)"""
+        for seg_start, seg_end, source in self._segments():
+            lo, hi = max(start, seg_start), min(end + 1, seg_end)
+            if lo >= hi:
+                continue
+            if source is None:
+                yield self.moov[lo - seg_start:hi - seg_start], 0, 0
+            else:
+                yield None, source + lo - seg_start, source + hi - seg_start - 1
+
+    def virtual_offset(self, offset: int) -> int:
+        """原文件中的偏移在虚拟文件中的位置（mdat 后移 len(moov)，moov 移到 head_end）"""
+        if self.head_end <= offset < self.moov_start:
+            return offset + len(self.moov)
+        if self.moov_start <= offset < self.moov_end:
+            return self.head_end + offset - self.moov_start
+        return offset
+
+    def source_range(self, start: int, end: int) -> Optional[Tuple[int, int]]:
+        """虚拟范围对应的原文件范围（首尾上游片段的跨度），全部落在 moov 中时返回 None"""
+        spans = [(lo, hi) for data, lo, hi in self.pieces(start, end) if data is None]
+        if not spans:
+            return None
+        return spans[0][0], spans[-1][1]
+
+
+def _shift_offsets(moov: bytearray, moov_start: int, head_end: int) -> bool:
+    """把位于 [head_end, moov_start) 的块偏移后移 len(moov)；32 位偏移溢出时返回 False"""
+    shift = len(moov)
+    body = next(((s, e) for kind, s, e in mp4_boxes(moov) if kind == b'moov'), None)
+    if body is None:
+        return False
+    if any(kind in _UNSUPPORTED for kind, _, _ in mp4_boxes(moov, body[0], body[1])):
+        return False
+    for kind, trak_start, trak_end in mp4_boxes(moov, body[0], body[1]):
+        if kind != b'trak':
+            continue
+        stbl = mp4_child(moov, trak_start, trak_end, [b'mdia', b'minf', b'stbl'])
+        if stbl is None:
+            continue
+        for table, start, end in mp4_boxes(moov, stbl[0], stbl[1]):
+            if table in _UNSUPPORTED:
+                return False
+            if table not in (b'stco', b'co64'):
+                continue
+            fmt, width = ('>I', 4) if table == b'stco' else ('>Q', 8)
+            if end - start < 8:
+                return False
+            count = struct.unpack_from('>I', moov, start + 4)[0]
+            if start + 8 + count * width > end:
+                return False
+            for pos in range(start + 8, start + 8 + count * width, width):
+                offset = struct.unpack_from(fmt, moov, pos)[0]
+                if head_end <= offset < moov_start:
+                    offset += shift
+                    if offset >= 1 << (8 * width):
+                        return False
+                    struct.pack_into(fmt, moov, pos, offset)
+    return True
+
+
+async def plan_faststart(read_at: ReadAt, size: int) -> VirtualMP4:
+    """读取顶层结构；moov 位于第一个 mdat 之后时读取 moov 并改写块偏移
+
+    不是 MP4、已经是 faststart、moov 过大或含有无法改写的结构时返回不重排的布局。
+    """
+    identity = VirtualMP4(size)
+    head = await read_at(0, min(HEADER_READ, size) - 1)
+    if head[4:8] not in (b'ftyp', b'free', b'mdat', b'wide', b'skip'):
+        return identity
+    head_end = moov = None
+    async for kind, start, end in mp4_top_level(read_at, size, head):
+        if kind == b'mdat' and head_end is None:
+            head_end = start
+        elif kind == b'moov':
+            moov = start, end
+            break
+    if head_end is None or moov is None or moov[0] < head_end:
+        return identity
+    moov_start, moov_end = moov
+    if moov_end - moov_start > MAX_INDEX_BYTES:
+        return identity
+    data = bytearray(await read_at(moov_start, moov_end - 1))
+    if len(data) != moov_end - moov_start or not _shift_offsets(data, moov_start, head_end):
+        return identity
+    return VirtualMP4(size, bytes(data), head_end, moov_start, moov_end)
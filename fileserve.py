@@ -0,0 +1,79 @@
+import mmap
+import os
+from typing import AsyncIterator, Optional
+from urllib.parse import quote
+
+import anyio
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+from conditional import evaluate_preconditions, if_range_matches, precondition_response, validator_headers
+from local_storage import LocalStorage
+from ranges import MultipartByteranges, RangeNotSatisfiable, parse_range_header
+
+CHUNK_SIZE = 1024 * 1024
+
+
+async def iter_file(path: str, start: int, end: int, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """读取本地文件的 [start, end] 字节（闭区间）
+
+    文件映射到内存后按块切片，不经过 read() 的额外缓冲；
+    切片在工作线程中进行，冷数据缺页读盘时不阻塞事件循环。
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        end = min(end, size - 1)
+        if end < start:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            pos = start
+            while pos <= end:
+                stop = min(pos + chunk_size, end + 1)
+                yield await anyio.to_thread.run_sync(mapped.__getitem__, slice(pos, stop))
+                pos = stop
+
+
+def local_file_response(request: Request, path: str, content_type: str,
+                        download_name: Optional[str] = None, cache_control: str = "") -> Response:
+    """返回本地文件，支持条件请求（304/412、If-Range）、单区间、多区间范围请求和 416"""
+    meta = LocalStorage.stat(path)
+    if meta is None:
+        raise FileNotFoundError(path)
+    file_size = meta.size
+    validators = validator_headers(meta, cache_control)
+    status_code = evaluate_preconditions(request.headers, meta, request.method)
+    if status_code is not None:
+        return precondition_response(status_code, validators)
+
+    headers = {
+        "Content-Type": content_type,
+        "Accept-Ranges": "bytes",
+        **validators,
+    }
+    if download_name:
+        headers["Content-Disposition"] = f'inline; filename="{quote(download_name)}"'
+
+    range_header = request.headers.get("Range") if if_range_matches(request.headers, meta) else None
+    try:
+        ranges = parse_range_header(range_header, file_size)
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{file_size}", "Accept-Ranges": "bytes"})
+
+    if ranges is None:
+        headers["Content-Length"] = str(file_size)
+        return StreamingResponse(iter_file(path, 0, file_size - 1), headers=headers)
+
+    if len(ranges) == 1:
+        r = ranges[0]
+        headers["Content-Range"] = f"bytes {r.start}-{r.end}/{file_size}"
+        headers["Content-Length"] = str(r.length)
+        return StreamingResponse(iter_file(path, r.start, r.end), status_code=206, headers=headers)
+
+    multipart = MultipartByteranges(ranges, file_size, content_type)
+    headers["Content-Type"] = multipart.content_type
+    headers["Content-Length"] = str(multipart.content_length)
+    return StreamingResponse(
+        multipart.iter_body(lambda start, end: iter_file(path, start, end)),
+        status_code=206,
+        headers=headers,
+    )
@@ -6,6 +6,7 @@ import HomePage from './components/HomePage';
 import ArtPlayer from './components/ArtPlayer';
 import MetadataEditor from './components/MetadataEditor';
 import ServerConfig from './components/ServerConfig';
+import axios from 'axios';
 import './styles/global.css';
 import './styles/layout.css';
 
@@ -103,18 +104,36 @@ function PlayerWrapper() {
   const encodedFilename = pathParts[pathParts.length - 1];
   const filename = decodeURIComponent(encodedFilename);
   const [playerKey, setPlayerKey] = useState(0);
+  // 探测结果给出的播放方式：null 表示尚未探测完成
+  const [decision, setDecision] = useState<string | null>(null);
+  
+  // 从URL参数中获取格式指定
+  const urlParams = new URLSearchParams(window.location.search);
+  const format = urlParams.get('format');
+  
+  // 未指定格式时先探测媒体信息，浏览器无法直接播放的文件直接使用转换API，不必等播放失败
+  useEffect(() => {
+    if (!filename || format) return;
+    setDecision(null);
+    axios.get(`/api/probe/${encodedFilename}`)
+      .then(response => setDecision(response.data.decision))
+      .catch(error => {
+        console.error('探测媒体信息失败:', error);
+        setDecision('direct');
+      });
+  }, [encodedFilename, format]);
   
   if (!filename) {
     return <div>文件不存在</div>;
   }
   
-  // 从URL参数中获取格式指定
-  const urlParams = new URLSearchParams(window.location.search);
-  const format = urlParams.get('format');
+  if (!format && decision === null) {
+    return <div className="loading-container">读取媒体信息中...</div>;
+  }
   
-  // 根据参数选择不同的API源 - 使用已编码的文件名
+  // 根据参数或探测结果选择不同的API源 - 使用已编码的文件名
   let sourceUrl = `/api/raw/${encodedFilename}`;
-  if (format === 'mp4') {
+  if (format === 'mp4' || (!format && decision !== 'direct')) {
     sourceUrl = `/api/converted/${encodedFilename}`;
   }
   
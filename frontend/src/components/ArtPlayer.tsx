@@ -13,11 +13,10 @@ interface PlayerProps {
   onError?: () => void; // 可选的错误回调
 }
 
-// 获取视频文件尺寸
+// 获取视频封面：由后端按需截取并缓存
 const getVideoPoster = (url: string): string => {
-  // 这里可以生成视频的缩略图
-  // 如果没有自动生成功能，可以返回一个通用占位符
-  return '/placeholder.jpg';
+  const match = url.match(/^\/api\/(?:raw|converted|stream-direct)\/([^?]+)/);
+  return match ? `/api/thumbnail/${match[1]}` : '/placeholder.jpg';
 };
 
 export default function ArtPlayer({ src, type, onError }: PlayerProps) {
@@ -476,7 +475,14 @@ export default function ArtPlayer({ src, type, onError }: PlayerProps) {
           art.on('pause', () => {
             console.log('暂停播放');
           });
-          
+
+          // 直接播放原文件时，跳转前通知服务端预热目标关键帧所在的块
+          art.on('seek', (currentTime: number) => {
+            const match = src.match(/^\/api\/(?:raw|stream-direct)\/(.+)$/);
+            if (!match) return;
+            axios.get(`/api/seek/${match[1]}`, { params: { t: currentTime } }).catch(() => {});
+          });
+
           art.on('error', (error: any) => {
             console.error('播放错误', error);
             if (isMounted) {
@@ -9,6 +9,56 @@ const formatDuration = (seconds: number) => {
   return `${mins}:${secs.toString().padStart(2, '0')}`;
 };
 
+// 缩略图队列已满时服务端返回 503 和 Retry-After，按提示重试，超过次数后隐藏
+const MAX_THUMBNAIL_RETRIES = 5;
+
+function Thumbnail({ name }: { name: string }) {
+  const url = `/api/thumbnail/${encodeURIComponent(name)}`;
+  const [attempt, setAttempt] = useState(0);
+  const [hidden, setHidden] = useState(false);
+
+  useEffect(() => {
+    setAttempt(0);
+    setHidden(false);
+  }, [url]);
+
+  const handleError = async () => {
+    if (attempt >= MAX_THUMBNAIL_RETRIES) {
+      setHidden(true);
+      return;
+    }
+    try {
+      // <img> 拿不到响应头，单独请求一次读取状态码和 Retry-After
+      const response = await fetch(url);
+      if (response.ok) {
+        setAttempt(attempt + 1);
+        return;
+      }
+      if (response.status !== 503) {
+        setHidden(true);
+        return;
+      }
+      const seconds = Number(response.headers.get('Retry-After')) || 10;
+      setTimeout(() => setAttempt(attempt + 1), seconds * 1000);
+    } catch {
+      setHidden(true);
+    }
+  };
+
+  if (hidden) {
+    return null;
+  }
+  return (
+    <img
+      className="media-thumbnail"
+      src={attempt ? `${url}?retry=${attempt}` : url}
+      alt=""
+      loading="lazy"
+      onError={handleError}
+    />
+  );
+}
+
 interface FileItem {
   name: string;
   type: 'video' | 'audio';
@@ -39,11 +89,11 @@ export default function FileList() {
             response = await axios.get(`/api/ftp/files?url=${encodeURIComponent(url)}&username=${encodeURIComponent(username)}&password=${encodeURIComponent(password)}`);
           } else {
             // 默认本地文件
-            response = await axios.get('/api/files');
+            response = await axios.get('/api/files?prewarm_thumbnails=true');
           }
         } else {
           // 默认本地文件
-          response = await axios.get('/api/files');
+          response = await axios.get('/api/files?prewarm_thumbnails=true');
         }
         
         const mediaFiles = response.data.files.map((file: any) => ({
@@ -52,21 +102,21 @@ export default function FileList() {
           metadata: file.metadata,
         }));
         
-        // 获取每个文件的元数据
-        const filesWithMetadata = await Promise.all(
-          mediaFiles.map(async (file: FileItem) => {
-            try {
-              const metadataResponse = await axios.get(`/api/metadata/${file.name}`);
-              return {
-                ...file,
-                metadata: metadataResponse.data
-              };
-            } catch (error) {
-              return file;
-            }
-          })
-        );
-        
+        // 一次请求批量获取所有文件的元数据
+        let filesWithMetadata = mediaFiles;
+        try {
+          const metadataResponse = await axios.post('/api/metadata/batch-get', {
+            filenames: mediaFiles.map((file: FileItem) => file.name)
+          });
+          const items = metadataResponse.data.items;
+          filesWithMetadata = mediaFiles.map((file: FileItem) => ({
+            ...file,
+            metadata: items[file.name]?.metadata ?? file.metadata
+          }));
+        } catch (error) {
+          console.error('获取元数据失败:', error);
+        }
+
         setFiles(filesWithMetadata);
       } catch (err) {
         const error = err as AxiosError;
@@ -122,6 +172,7 @@ export default function FileList() {
                   <div className="media-type-icon">
                     {file.type === 'video' ? '🎥' : '🎵'}
                   </div>
+                  {file.type === 'video' && <Thumbnail name={file.name} />}
                 </div>
                 <div className="file-info">
                   <span className="filename">{file.metadata?.title || file.name}</span>
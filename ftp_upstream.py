@@ -0,0 +1,358 @@
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import posixpath
+import threading
+import time
+from calendar import timegm
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from email.utils import formatdate
+from ftplib import FTP, all_errors, error_perm, error_temp
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import anyio
+
+from metacache import FileMeta
+from metrics import UPSTREAM_BYTES, UPSTREAM_DURATION
+
+# ftplib 可能抛出的所有异常（协议错误、网络错误、连接意外关闭）
+FTP_ERRORS = all_errors
+
+
+def parse_ftp_url(url: str) -> Tuple[str, str]:
+    """解析 ftp://host/path 形式的地址，返回 (主机, 路径)"""
+    if url.startswith('ftp://'):
+        url = url[6:]
+    host = url.split('/')[0]
+    path = '/' + '/'.join(url.split('/')[1:]) if '/' in url else '/'
+    return host, path
+
+
+@dataclass(frozen=True)
+class FTPServer:
+    """一个 FTP 服务器及登录凭据，同时作为连接池的键"""
+    host: str
+    port: int = 21
+    username: str = ""
+    password: str = ""
+
+    @classmethod
+    def from_url(cls, url: str, username: str = "", password: str = "") -> Tuple["FTPServer", str]:
+        """解析 ftp://host[:port]/path，返回 (服务器, 路径)"""
+        host, path = parse_ftp_url(url)
+        port = 21
+        if ':' in host:
+            host, _, port_text = host.rpartition(':')
+            port = int(port_text)
+        return cls(host, port, username or "anonymous", password), path
+
+    def cache_path(self, path: str) -> str:
+        """元数据缓存和块缓存使用的键，区分不同服务器和凭据，避免错误的密码命中缓存"""
+        credential = hashlib.sha256(f"{self.username}:{self.password}".encode("utf-8")).hexdigest()[:16]
+        return f"ftp://{self.username}:{credential}@{self.host}:{self.port}{path}"
+
+
+@dataclass(frozen=True)
+class FTPEntry:
+    """MLSD 返回的单个目录项"""
+    name: str
+    path: str
+    is_dir: bool
+    meta: FileMeta
+
+
+def _parse_modify(value: str) -> str:
+    """把 MLSD/MDTM 的 YYYYMMDDHHMMSS（UTC）转换为 HTTP 日期"""
+    try:
+        timestamp = timegm(time.strptime(value[:14], "%Y%m%d%H%M%S"))
+    except ValueError:
+        return ""
+    return formatdate(timestamp, usegmt=True)
+
+
+def _file_meta(name: str, facts: Dict[str, str]) -> FileMeta:
+    size = int(facts.get('size', '0') or 0)
+    modify = facts.get('modify', '')
+    return FileMeta(
+        size=size,
+        content_type=mimetypes.guess_type(name)[0] or "application/octet-stream",
+        # FTP 没有 ETag，用大小和修改时间标识文件版本
+        etag=f"{size}-{modify}" if modify else "",
+        last_modified=_parse_modify(modify),
+    )
+
+
+def _parse_mlst(response: str) -> Dict[str, str]:
+    """解析 MLST 响应中的事实行，如 ' type=file;size=123;modify=20240101000000; /path'"""
+    for line in response.splitlines()[1:]:
+        if line.startswith(' '):
+            facts_text = line.strip().split(' ', 1)[0]
+            return dict(
+                fact.split('=', 1) for fact in facts_text.split(';') if '=' in fact
+            )
+    return {}
+
+
+class _Pool:
+    """单个服务器的空闲控制连接"""
+
+    def __init__(self):
+        self.idle = deque()     # (FTP, 放回时间)
+        self.slots: Optional[asyncio.Semaphore] = None
+
+
+class FTPUpstream:
+    """FTP 上游的异步封装
+
+    ftplib 本身是阻塞的，这里把每次会话放到工作线程中执行，
+    并用 CapacityLimiter 限制同时占用的线程数，避免拖垮事件循环和线程池。
+    已登录的控制连接按服务器缓存复用，每个服务器同时使用的连接数不超过 max_connections。
+    """
+
+    def __init__(self, max_workers: int = 8, timeout: float = 30, max_connections: int = 4,
+                 idle_timeout: float = 60):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self._limiter = anyio.CapacityLimiter(max_workers)
+        self._pools: Dict[FTPServer, _Pool] = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, server: FTPServer) -> _Pool:
+        pool = self._pools.get(server)
+        if pool is None:
+            pool = self._pools[server] = _Pool()
+        return pool
+
+    def _slots(self, server: FTPServer) -> asyncio.Semaphore:
+        pool = self._pool(server)
+        if pool.slots is None:
+            pool.slots = asyncio.Semaphore(self.max_connections)
+        return pool.slots
+
+    # ---- 连接池（在工作线程中执行） ----
+
+    def _connect(self, server: FTPServer) -> FTP:
+        ftp = FTP()
+        ftp.connect(server.host, server.port, timeout=self.timeout)
+        try:
+            ftp.login(server.username, server.password)
+        except Exception:
+            ftp.close()
+            raise
+        return ftp
+
+    def _checkout(self, server: FTPServer) -> FTP:
+        """取出一个可用的控制连接，空闲连接先用 NOOP 确认仍然有效"""
+        pool = self._pool(server)
+        while True:
+            with self._lock:
+                if not pool.idle:
+                    break
+                ftp, returned = pool.idle.pop()
+            if time.monotonic() - returned > self.idle_timeout:
+                self._discard(ftp)
+                continue
+            try:
+                ftp.voidcmd('NOOP')
+                return ftp
+            except Exception:
+                self._discard(ftp)
+        return self._connect(server)
+
+    def _checkin(self, server: FTPServer, ftp: FTP):
+        with self._lock:
+            self._pool(server).idle.append((ftp, time.monotonic()))
+
+    @staticmethod
+    def _discard(ftp: FTP):
+        try:
+            ftp.quit()
+        except Exception:
+            ftp.close()
+
+    @asynccontextmanager
+    async def _session(self, server: FTPServer):
+        """占用一个控制连接；出现异常时关闭连接而不放回连接池"""
+        async with self._slots(server):
+            ftp = await anyio.to_thread.run_sync(self._checkout, server, limiter=self._limiter)
+            try:
+                yield ftp
+            except BaseException:
+                await anyio.to_thread.run_sync(self._discard, ftp, limiter=self._limiter)
+                raise
+            else:
+                self._checkin(server, ftp)
+
+    async def _run(self, server: FTPServer, func, *args):
+        async with self._session(server) as ftp:
+            return await anyio.to_thread.run_sync(func, ftp, *args, limiter=self._limiter)
+
+    async def _timed(self, method: str, server: FTPServer, func, *args):
+        """执行一次会话并记录耗时（含等待连接池的时间）"""
+        started = time.monotonic()
+        status = "error"
+        try:
+            result = await self._run(server, func, *args)
+            status = "ok"
+            return result
+        finally:
+            UPSTREAM_DURATION.observe(time.monotonic() - started, protocol="ftp", method=method, status=status)
+
+    # ---- 列表与元数据 ----
+
+    @staticmethod
+    def _mlsd(ftp: FTP, path: str) -> List[FTPEntry]:
+        try:
+            listing = list(ftp.mlsd(path, facts=['type', 'size', 'modify']))
+        except error_perm as e:
+            if not str(e).startswith(('500', '501', '502')):
+                raise
+            # 服务器不支持 MLSD，退回只有文件名的 NLST
+            ftp.cwd(path)
+            listing = [(posixpath.basename(name), {}) for name in ftp.nlst()]
+        entries = []
+        for name, facts in listing:
+            kind = facts.get('type', 'file')
+            if kind in ('cdir', 'pdir') or name in ('.', '..'):
+                continue
+            entries.append(FTPEntry(
+                name=name,
+                path=posixpath.join(path, name),
+                is_dir=kind == 'dir',
+                meta=_file_meta(name, facts),
+            ))
+        return entries
+
+    @staticmethod
+    def _stat(ftp: FTP, path: str) -> Optional[FileMeta]:
+        try:
+            facts = _parse_mlst(ftp.sendcmd(f'MLST {path}'))
+        except error_perm as e:
+            if str(e).startswith('550'):
+                return None
+            # 不支持 MLST 时使用 SIZE + MDTM
+            ftp.voidcmd('TYPE I')
+            try:
+                size = ftp.size(path)
+            except error_perm as e:
+                if str(e).startswith('550'):
+                    return None
+                raise
+            facts = {'type': 'file', 'size': str(size or 0)}
+            try:
+                facts['modify'] = ftp.sendcmd(f'MDTM {path}').split()[-1]
+            except error_perm:
+                pass
+        if facts.get('type', 'file') != 'file':
+            return None
+        return _file_meta(posixpath.basename(path), facts)
+
+    async def list(self, server: FTPServer, path: str) -> List[FTPEntry]:
+        """用 MLSD 列出目录，一次往返得到大小和修改时间"""
+        return await self._timed("MLSD", server, self._mlsd, path)
+
+    async def stat(self, server: FTPServer, path: str) -> Optional[FileMeta]:
+        """获取文件元数据，文件不存在时返回 None"""
+        return await self._timed("MLST", server, self._stat, path)
+
+    # ---- 数据传输 ----
+
+    @staticmethod
+    def _open_transfer(ftp: FTP, path: str, start: int):
+        """发送 REST + RETR 打开数据连接，返回 (数据连接, 需要丢弃的字节数)"""
+        ftp.voidcmd('TYPE I')
+        if start:
+            try:
+                return ftp.transfercmd(f'RETR {path}', start), 0
+            except error_perm as e:
+                if not str(e).startswith(('500', '501', '502', '504')):
+                    raise
+                logging.warning(f"FTP服务器不支持REST, 从文件开头读取: {path}")
+        return ftp.transfercmd(f'RETR {path}'), start
+
+    @staticmethod
+    def _finish_transfer(ftp: FTP, conn, complete: bool) -> bool:
+        """关闭数据连接并读取传输结果，返回控制连接能否继续复用
+
+        提前关闭数据连接时服务器回复 426（或已发送完时回复 226），
+        读取这一条回复后控制连接即恢复同步，不需要发送 ABOR。
+        """
+        conn.close()
+        try:
+            ftp.voidresp()
+        except error_temp:
+            if complete:
+                return False
+        except Exception:
+            return False
+        return True
+
+    async def stream(self, server: FTPServer, path: str, start: Optional[int] = None,
+                     end: Optional[int] = None, etag: str = "",
+                     chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        """流式读取文件的 [start, end] 字节范围（闭区间）
+
+        FTP 无法在传输中校验文件版本，etag 仅为与 WebDAV 上游保持相同的调用方式。
+        """
+        start = start or 0
+        remaining = None if end is None else end - start + 1
+        started = time.monotonic()
+        async with self._slots(server):
+            ftp = await anyio.to_thread.run_sync(self._checkout, server, limiter=self._limiter)
+            reusable = False
+            try:
+                try:
+                    conn, skip = await anyio.to_thread.run_sync(
+                        self._open_transfer, ftp, path, start, limiter=self._limiter
+                    )
+                except Exception:
+                    UPSTREAM_DURATION.observe(time.monotonic() - started, protocol="ftp", method="RETR",
+                                              status="error")
+                    raise
+                UPSTREAM_DURATION.observe(time.monotonic() - started, protocol="ftp", method="RETR", status="ok")
+                complete = False
+                try:
+                    while remaining is None or remaining > 0:
+                        size = chunk_size if remaining is None else min(chunk_size, remaining + skip)
+                        data = await anyio.to_thread.run_sync(conn.recv, size, limiter=self._limiter)
+                        if not data:
+                            complete = True
+                            break
+                        if skip:
+                            dropped = min(skip, len(data))
+                            data = data[dropped:]
+                            skip -= dropped
+                            if not data:
+                                continue
+                        if remaining is not None:
+                            data = data[:remaining]
+                            remaining -= len(data)
+                        UPSTREAM_BYTES.inc(len(data), protocol="ftp")
+                        yield data
+                finally:
+                    reusable = await anyio.to_thread.run_sync(
+                        self._finish_transfer, ftp, conn, complete, limiter=self._limiter
+                    )
+            finally:
+                if reusable:
+                    self._checkin(server, ftp)
+                else:
+                    await anyio.to_thread.run_sync(self._discard, ftp, limiter=self._limiter)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                f"{server.host}:{server.port}": {"idle": len(pool.idle)}
+                for server, pool in self._pools.items()
+            }
+
+    async def aclose(self):
+        with self._lock:
+            connections = [ftp for pool in self._pools.values() for ftp, _ in pool.idle]
+            self._pools.clear()
+        for ftp in connections:
+            await anyio.to_thread.run_sync(self._discard, ftp, limiter=self._limiter)
@@ -0,0 +1,51 @@
+import math
+from typing import List, Tuple
+
+PLAYLIST_CONTENT_TYPE = "application/vnd.apple.mpegurl"
+SEGMENT_CONTENT_TYPE = "video/mp2t"
+
+
+def segment_count(duration: float, segment_duration: float) -> int:
+    """分段数；不足半个分段的结尾并入最后一段，避免生成极短的分段"""
+    count = int(duration // segment_duration)
+    if count == 0 or duration - count * segment_duration >= segment_duration / 2:
+        count += 1
+    return count
+
+
+def segment_bounds(index: int, duration: float, segment_duration: float) -> Tuple[float, float]:
+    """返回第 index 个分段的 (起始时间, 时长)，最后一段时长为剩余部分"""
+    start = index * segment_duration
+    if index == segment_count(duration, segment_duration) - 1:
+        return start, duration - start
+    return start, segment_duration
+
+
+def segments_ahead(index: int, count: int, ahead: int) -> List[int]:
+    """index 之后需要预先生成的分段序号"""
+    return list(range(index + 1, min(index + 1 + ahead, count)))
+
+
+def build_playlist(duration: float, segment_duration: float,
+                   uri_template: str = "segment/{index}.ts") -> str:
+    """生成 VOD 媒体播放列表
+
+    分段按固定时长切分，在被请求时才生成，因此播放列表只依赖媒体总时长，
+    可以在转码开始前立即返回。
+    """
+    count = segment_count(duration, segment_duration)
+    _, last_length = segment_bounds(count - 1, duration, segment_duration)
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{math.ceil(max(segment_duration, last_length))}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+    ]
+    for index in range(count):
+        _, length = segment_bounds(index, duration, segment_duration)
+        lines.append(f"#EXTINF:{length:.3f},")
+        lines.append(uri_template.format(index=index))
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
@@ -0,0 +1,283 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from metrics import JOB_BUCKETS, REGISTRY
+
+# 优先级：数值越小越先执行
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PREWARM = 10
+
+PRIORITY_NAMES = {
+    "interactive": PRIORITY_INTERACTIVE,
+    "prewarm": PRIORITY_PREWARM,
+}
+
+JOB_DURATION = REGISTRY.histogram(
+    "noediv_job_duration_seconds",
+    "Run time of ffmpeg jobs after they obtained a worker slot",
+    ("scheduler", "kind", "status"),
+    buckets=JOB_BUCKETS,
+)
+JOB_WAIT = REGISTRY.histogram(
+    "noediv_job_queue_wait_seconds",
+    "Time ffmpeg jobs spent queued before obtaining a worker slot",
+    ("scheduler", "kind"),
+    buckets=JOB_BUCKETS,
+)
+
+
+class SchedulerBusy(Exception):
+    """排队已满，应返回 503 并在 retry_after 秒后重试"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many pending jobs, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobCancelled(Exception):
+    """任务已被取消"""
+
+
+class Job:
+    """一个占用 ffmpeg 工作槽的任务"""
+
+    def __init__(self, kind: str, label: str, priority: int, key: Optional[str] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.label = label
+        self.priority = priority
+        self.key = key
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.result: Any = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.cancel_requested = False
+        self.on_cancel: Optional[Callable[[], None]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._future: Optional[asyncio.Future] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "label": self.label,
+            "priority": self.priority,
+            "status": self.status,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobScheduler:
+    """ffmpeg 任务调度器
+
+    - 同时运行的 ffmpeg 进程不超过 max_workers，等待中的任务按优先级出队
+    - 排队数达到 max_queue 时拒绝新任务（SchedulerBusy），预热任务只能使用一半的队列
+    - 后台任务按 key 去重，相同转码只执行一次
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue: int = 16, threads_per_job: int = 2,
+                 history: int = 200, name: str = "transcode"):
+        self.name = name
+        self.max_workers = max(max_workers, 1)
+        self.max_queue = max_queue
+        self.threads_per_job = threads_per_job
+        self._running = 0
+        self._waiters = []              # 堆：(优先级, 序号, future)
+        self._seq = itertools.count()
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._by_key: Dict[str, Job] = {}
+        self._history = history
+        self._durations = deque(maxlen=50)
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    # ---- 工作槽 ----
+
+    def retry_after(self) -> int:
+        """根据近期任务耗时估算重试等待时间"""
+        if not self._durations:
+            return 10
+        average = sum(self._durations) / len(self._durations)
+        estimate = average * (len(self._waiters) + 1) / self.max_workers
+        return int(min(max(math.ceil(estimate), 1), 300))
+
+    def admit(self, priority: int):
+        """检查排队深度，超限时抛出 SchedulerBusy"""
+        if self._running < self.max_workers and not self._waiters:
+            return
+        limit = self.max_queue if priority <= PRIORITY_INTERACTIVE else self.max_queue // 2
+        if len(self._waiters) >= limit:
+            self.rejected += 1
+            raise SchedulerBusy(self.retry_after())
+
+    async def acquire(self, job: Job):
+        """等待一个工作槽"""
+        self._register(job)
+        if self._running < self.max_workers and not self._waiters:
+            self._running += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            job._future = future
+            entry = (job.priority, next(self._seq), future)
+            heapq.heappush(self._waiters, entry)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # 已分配到槽位但随即被取消，归还槽位
+                    self._release_slot()
+                else:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                raise
+        if job.cancel_requested:
+            self._release_slot()
+            raise JobCancelled(job.id)
+        job.status = "running"
+        job.started = time.time()
+        JOB_WAIT.observe(job.started - job.created, scheduler=self.name, kind=job.kind)
+
+    def release(self, job: Job, error: Optional[BaseException] = None):
+        """归还工作槽并记录任务结果"""
+        if job.status == "running":
+            self._release_slot()
+            self._durations.append(time.time() - job.started)
+        job.finished = time.time()
+        if job.cancel_requested or isinstance(error, (asyncio.CancelledError, JobCancelled)):
+            job.status = "cancelled"
+        elif error is not None:
+            job.status = "failed"
+            job.error = str(error)
+            self.failed += 1
+        else:
+            job.status = "done"
+            self.completed += 1
+        if job.started is not None:
+            JOB_DURATION.observe(job.finished - job.started, scheduler=self.name, kind=job.kind, status=job.status)
+        if job.key and self._by_key.get(job.key) is job:
+            del self._by_key[job.key]
+
+    def _release_slot(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # 槽位直接移交给下一个等待者
+                future.set_result(None)
+                return
+        self._running -= 1
+
+    def _register(self, job: Job):
+        self._jobs[job.id] = job
+        while len(self._jobs) > self._history:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest.status in ("queued", "running"):
+                break
+            del self._jobs[oldest_id]
+
+    # ---- 后台任务 ----
+
+    def submit(self, kind: str, label: str, factory: Callable[[int], Awaitable[Any]],
+               priority: int = PRIORITY_INTERACTIVE, key: Optional[str] = None) -> Job:
+        """提交后台任务；factory(threads) 在获得工作槽后执行。相同 key 的任务只执行一次"""
+        if key is not None:
+            existing = self._by_key.get(key)
+            if existing is not None:
+                if priority < existing.priority and existing.status == "queued":
+                    self._promote(existing, priority)
+                return existing
+        self.admit(priority)
+        job = Job(kind, label, priority, key)
+        if key is not None:
+            self._by_key[key] = job
+        job._task = asyncio.get_running_loop().create_task(self._run(job, factory))
+        job._task.add_done_callback(_consume_exception)
+        return job
+
+    def _promote(self, job: Job, priority: int):
+        """提升排队中任务的优先级"""
+        job.priority = priority
+        for i, (_, seq, future) in enumerate(self._waiters):
+            if future is job._future:
+                self._waiters[i] = (priority, seq, future)
+                heapq.heapify(self._waiters)
+                break
+
+    async def _run(self, job: Job, factory: Callable[[int], Awaitable[Any]]):
+        error = None
+        try:
+            await self.acquire(job)
+            logging.info(f"开始任务 {job.id}: {job.kind} {job.label}")
+            job.result = await factory(self.threads_per_job)
+            return job.result
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.release(job, error)
+            logging.info(f"任务结束 {job.id}: {job.status}")
+
+    async def wait(self, job: Job) -> Any:
+        """等待后台任务完成；调用方被取消不影响任务本身"""
+        try:
+            return await asyncio.shield(job._task)
+        except asyncio.CancelledError:
+            if job.status == "cancelled":
+                raise JobCancelled(job.id)
+            raise
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if job.status not in ("queued", "running"):
+            return job
+        job.cancel_requested = True
+        if job.on_cancel is not None:
+            job.on_cancel()
+        if job._task is not None:
+            job._task.cancel()
+        logging.info(f"取消任务 {job.id}: {job.label}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> list:
+        return [job.to_dict() for job in reversed(self._jobs.values())]
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "running": self._running,
+            "queued": len(self._waiters),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    async def aclose(self):
+        tasks = [job._task for job in self._jobs.values()
+                 if job._task is not None and not job._task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _consume_exception(task: asyncio.Task):
+    # 任务的异常由 wait() 的调用方处理；无人等待时在这里取出，避免警告
+    if not task.cancelled():
+        task.exception()
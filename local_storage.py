@@ -0,0 +1,67 @@
+import mimetypes
+import os
+from email.utils import formatdate
+from typing import List, Optional, Tuple
+
+from metacache import FileMeta
+
+# 本地文件在缓存和任务中使用的路径前缀，与 WebDAV 远程路径区分
+LOCAL_PREFIX = "local://"
+
+
+class LocalStorage:
+    """服务器本地挂载的媒体目录
+
+    存在于本地目录中的文件直接从磁盘读取，不经过 WebDAV。
+    所有方法都会访问文件系统，由调用方放到工作线程中执行。
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.realpath(root)
+
+    def resolve(self, filename: str) -> Optional[str]:
+        """返回文件的绝对路径；文件不存在或路径越出根目录时返回 None"""
+        path = os.path.realpath(os.path.join(self.root, filename.lstrip('/')))
+        if os.path.commonpath([self.root, path]) != self.root:
+            return None
+        return path if os.path.isfile(path) else None
+
+    @staticmethod
+    def key(path: str) -> str:
+        return LOCAL_PREFIX + path
+
+    @staticmethod
+    def owns(key: str) -> bool:
+        return key.startswith(LOCAL_PREFIX)
+
+    @staticmethod
+    def path_of(key: str) -> str:
+        return key[len(LOCAL_PREFIX):]
+
+    @staticmethod
+    def stat(path: str) -> Optional[FileMeta]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return FileMeta(
+            size=st.st_size,
+            content_type=mimetypes.guess_type(path)[0] or "application/octet-stream",
+            # 与 WebDAV 服务器常见的 ETag 形式一致：修改时间 + 大小
+            etag=f"{st.st_mtime_ns:x}-{st.st_size:x}",
+            last_modified=formatdate(st.st_mtime, usegmt=True),
+        )
+
+    def list(self, directory: str = "") -> List[Tuple[str, FileMeta]]:
+        """列出目录下的文件（不含子目录）"""
+        path = os.path.realpath(os.path.join(self.root, directory.lstrip('/')))
+        if os.path.commonpath([self.root, path]) != self.root or not os.path.isdir(path):
+            return []
+        files = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    meta = self.stat(entry.path)
+                    if meta is not None:
+                        files.append((entry.name, meta))
+        return files
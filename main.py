@@ -1,20 +1,43 @@
-from fastapi import FastAPI, HTTPException, Response, Body, Request
+from fastapi import FastAPI, HTTPException, Response, Body, Request, Query
 from fastapi.middleware import Middleware
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from webdav3.client import Client
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
 import os
 import io
-import ffmpeg
-import aiofiles
+import posixpath
 import time
 import logging
-import tempfile
 from dotenv import load_dotenv
 from urllib.parse import quote, unquote
-import requests
+from contextlib import asynccontextmanager
 from fastapi.responses import PlainTextResponse, JSONResponse
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from pydantic import BaseModel, StrictInt
+from settings import load_settings
+from upstream import WebDAVUpstream, UpstreamError
+from ftp_upstream import FTP_ERRORS, FTPServer, FTPUpstream
+from metacache import FileMeta, MetadataCache
+from blockcache import BlockCache, CachedReader, file_version
+from prefetch import Prefetcher
+from transcode import DEFAULT_ENCODE_OPTIONS, TranscodeError, first_fragment, probe_media, run_ffmpeg, segment_args, stream_transcode, streaming_args, transcode_to_file
+from transcode_cache import TranscodeCache, cache_key
+from fileserve import iter_file, local_file_response
+from conditional import evaluate_preconditions, if_range_matches, precondition_response, validator_headers
+from local_storage import LocalStorage
+from jobs import Job, JobCancelled, JobScheduler, SchedulerBusy, PRIORITY_INTERACTIVE, PRIORITY_NAMES, PRIORITY_PREWARM
+from metastore import MAX_BATCH_ITEMS, InvalidMetadata, MetadataStore, VersionConflict
+from catalog import Catalog, CatalogCrawler, media_type
+from hls import PLAYLIST_CONTENT_TYPE, SEGMENT_CONTENT_TYPE, build_playlist, segment_bounds, segment_count, segments_ahead
+from probe import DECISION_DIRECT, DECISION_TRANSCODE, MediaInfo, PlaybackPlan, ProbeCache, parse_probe, playback_plan
+from asynccache import AsyncLRUCache
+from thumbnails import THUMBNAIL_CONTENT_TYPE, VTT_CONTENT_TYPE, ThumbnailPrewarmer, build_vtt, generate_poster, generate_sprite, poster_time, scaled_size, trickplay_interval, trickplay_times
+from shaping import CLASS_BACKGROUND, CLASS_BULK, CLASS_PLAYBACK, BandwidthScheduler
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, MetricsMiddleware
+from faststart import VirtualMP4, faststart_candidate, plan_faststart, virtual_meta
+from seekindex import SeekIndex, SeekIndexError, build_index
+from ranges import ByteRange, MultipartByteranges, RangeNotSatisfiable, SpanPolicy, parse_range_header
 
 # Configure logging
 logging.basicConfig(
@@ -27,6 +50,197 @@ logging.basicConfig(
 
 load_dotenv()
 
+# 启动时加载一次配置，并创建应用级共享的上游客户端
+settings = load_settings()
+upstream = WebDAVUpstream(settings)
+ftp_upstream = FTPUpstream(
+    max_workers=settings.ftp_max_workers,
+    timeout=settings.webdav_timeout,
+    max_connections=settings.ftp_max_connections,
+)
+
+# 本地媒体目录，其中的文件不经过 WebDAV
+local_storage = LocalStorage(settings.local_media_root) if settings.local_media_root else None
+
+# PROPFIND 元数据缓存，避免每次范围请求都查询上游
+metadata_cache = MetadataCache(
+    ttl=settings.metadata_cache_ttl,
+    negative_ttl=settings.metadata_cache_negative_ttl,
+    max_entries=settings.metadata_cache_max_entries,
+)
+
+# 范围请求的磁盘块缓存，位于 stream_direct 与上游之间
+block_cache = BlockCache(
+    directory=settings.block_cache_dir,
+    max_bytes=settings.block_cache_size_mb * 1024 * 1024,
+    block_size=settings.block_cache_block_kb * 1024,
+)
+
+# 上游带宽调度：全局限速、播放流与下载流按权重公平分配，预读等后台读取只用剩余带宽
+bandwidth = BandwidthScheduler(
+    rate=settings.bandwidth_limit_mbps * 1e6 / 8,
+    playback_weight=settings.bandwidth_playback_weight,
+    bulk_weight=settings.bandwidth_bulk_weight,
+    floor_factor=settings.bandwidth_floor_factor,
+)
+block_reader = CachedReader(block_cache, upstream.stream, bandwidth,
+                            subscriber_buffer=settings.upstream_coalesce_buffer_mb * 1024 * 1024)
+
+# 转码结果缓存
+transcode_cache = TranscodeCache(
+    directory=settings.transcode_cache_dir,
+    max_bytes=settings.transcode_cache_size_mb * 1024 * 1024,
+)
+
+# ffmpeg 任务调度：限制并发进程数，按优先级排队，超载时拒绝
+job_scheduler = JobScheduler(
+    max_workers=settings.transcode_max_jobs,
+    max_queue=settings.transcode_max_queue,
+    threads_per_job=settings.transcode_threads_per_job,
+    name="transcode",
+)
+
+# 开放区间的自适应跨度：顺序读取时逐步放大，跳转后回落
+span_policy = SpanPolicy(
+    min_span=settings.range_min_span_kb * 1024,
+    max_span=settings.range_max_span_mb * 1024 * 1024,
+)
+
+# 顺序播放的后台预读
+prefetcher = Prefetcher(
+    block_reader,
+    blocks_ahead=settings.prefetch_blocks,
+    max_concurrent=settings.prefetch_max_concurrent,
+    min_sequential=settings.prefetch_min_sequential,
+    max_seek_blocks=settings.seek_prefetch_blocks,
+)
+
+# 用户元数据，持久化到 SQLite，多个 worker 共享
+metadata_store = MetadataStore(settings.metadata_db)
+
+# 媒体库索引：后台爬虫增量刷新，列表和搜索只查询本地数据库
+catalog = Catalog(settings.catalog_db, settings.metadata_db)
+catalog_crawler = CatalogCrawler(
+    catalog,
+    upstream,
+    max_depth=settings.catalog_max_depth,
+    concurrency=settings.catalog_crawl_concurrency,
+    interval=settings.catalog_refresh_interval,
+)
+
+# 封面缩略图和拖动预览雪碧图：独立的缓存和低优先级任务池，不占用播放转码的工作槽
+thumbnail_cache = TranscodeCache(
+    directory=settings.thumbnail_cache_dir,
+    max_bytes=settings.thumbnail_cache_size_mb * 1024 * 1024,
+)
+thumbnail_scheduler = JobScheduler(
+    max_workers=settings.thumbnail_max_jobs,
+    max_queue=settings.thumbnail_max_queue,
+    threads_per_job=1,
+    name="thumbnail",
+)
+thumbnail_prewarmer = ThumbnailPrewarmer(lambda filename: prewarm_thumbnails(filename))
+
+# ffprobe 探测结果（容器、编码、时长、轨道），供播放决策和 HLS 使用
+probe_cache = ProbeCache(max_entries=settings.probe_cache_max_entries)
+
+# 关键帧时间 -> 字节偏移索引（MP4 采样表、Matroska Cues、AVI idx1），供跳转时预热块缓存
+seek_index_cache: AsyncLRUCache[SeekIndex] = AsyncLRUCache(max_entries=settings.seek_index_cache_max_entries)
+
+# moov 在末尾的 MP4 的虚拟 faststart 布局（改写后的 moov 保存在内存中）
+faststart_cache: AsyncLRUCache[VirtualMP4] = AsyncLRUCache(max_entries=settings.faststart_cache_max_entries)
+
+# 抓取时从各组件的计数中读取的指标
+def _cache_counts(attribute: str) -> dict:
+    caches = {
+        "metadata": metadata_cache,
+        "blocks": block_cache,
+        "transcode": transcode_cache,
+        "thumbnails": thumbnail_cache,
+        "probe": probe_cache,
+        "seek_index": seek_index_cache,
+        "faststart": faststart_cache,
+    }
+    return {(name,): getattr(cache, attribute) for name, cache in caches.items()}
+
+def _scheduler_counts(key: str) -> dict:
+    return {(scheduler.name,): scheduler.stats()[key] for scheduler in (job_scheduler, thumbnail_scheduler)}
+
+REGISTRY.callback("counter", "noediv_cache_hits_total", "Cache hits", lambda: _cache_counts("hits"), ("cache",))
+REGISTRY.callback("counter", "noediv_cache_misses_total", "Cache misses", lambda: _cache_counts("misses"), ("cache",))
+REGISTRY.callback("gauge", "noediv_job_queue_depth", "ffmpeg jobs waiting for a worker slot",
+                  lambda: _scheduler_counts("queued"), ("scheduler",))
+REGISTRY.callback("gauge", "noediv_jobs_running", "ffmpeg jobs currently running",
+                  lambda: _scheduler_counts("running"), ("scheduler",))
+REGISTRY.callback("counter", "noediv_jobs_rejected_total", "ffmpeg jobs rejected because the queue was full",
+                  lambda: _scheduler_counts("rejected"), ("scheduler",))
+REGISTRY.callback("counter", "noediv_prefetched_blocks_total", "Blocks fetched ahead of playback",
+                  lambda: prefetcher.prefetched_blocks)
+
+async def stat_remote(remote_path: str) -> Optional[FileMeta]:
+    """获取远程文件元数据，优先使用缓存；文件不存在时返回 None"""
+    hit, meta = metadata_cache.get(remote_path)
+    if hit:
+        return meta
+    meta = await upstream.stat(remote_path)
+    metadata_cache.put(remote_path, meta)
+    return meta
+
+async def stat_media(filename: str):
+    """定位媒体文件，返回 (路径, 元数据)；本地目录中存在的文件优先，否则查询 WebDAV
+
+    本地文件的路径带 local:// 前缀，与远程路径共用转码缓存和任务的键而不会冲突。
+    """
+    if local_storage is not None:
+        path = await run_in_threadpool(local_storage.resolve, filename)
+        if path is not None:
+            return LocalStorage.key(path), await run_in_threadpool(LocalStorage.stat, path)
+    remote_path = upstream.remote_path(filename)
+    return remote_path, await stat_remote(remote_path)
+
+async def faststart_layout(decoded_filename: str, remote_path: str, file_info: FileMeta) -> Optional[VirtualMP4]:
+    """moov 位于文件末尾的远程 MP4 返回重排后的布局，其余文件返回 None
+
+    布局按路径和文件版本缓存，每个文件只读取一次顶层结构和 moov（经过块缓存）。
+    """
+    if not settings.virtual_faststart or LocalStorage.owns(remote_path) \
+            or not faststart_candidate(decoded_filename, file_info):
+        return None
+
+    async def read_at(start: int, end: int) -> bytes:
+        return b"".join([chunk async for chunk in block_reader.read(remote_path, file_info, start, end)])
+
+    async def plan() -> VirtualMP4:
+        layout = await plan_faststart(read_at, file_info.size)
+        if layout.relocated:
+            logging.info(f"虚拟 faststart: {remote_path}, moov {len(layout.moov)} 字节移到 {layout.head_end}")
+        return layout
+
+    try:
+        layout = await faststart_cache.get_or_create((remote_path, file_version(file_info)), plan)
+    except UpstreamError as e:
+        # 读取失败时按原文件发送，由后续的范围读取报告错误
+        logging.error(f"读取 MP4 结构失败: {e.status_code}")
+        return None
+    return layout if layout.relocated else None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.webdav_server:
+        catalog_crawler.start()
+    yield
+    await catalog_crawler.aclose()
+    await thumbnail_prewarmer.aclose()
+    await thumbnail_scheduler.aclose()
+    await job_scheduler.aclose()
+    await prefetcher.aclose()
+    await bandwidth.aclose()
+    await upstream.aclose()
+    await ftp_upstream.aclose()
+    block_cache.close()
+    catalog.close()
+    metadata_store.close()
+
 # 允许跨域请求 - 允许所有方法包括OPTIONS和HEAD
 middleware = [
     Middleware(
@@ -34,68 +248,127 @@ middleware = [
         allow_origins=["*"], 
         allow_methods=["*"],  # 允许所有方法
         allow_headers=["*"],
-        expose_headers=["Content-Range", "Content-Length", "Accept-Ranges", "Content-Encoding", "Content-Disposition"],
+        expose_headers=["Content-Range", "Content-Length", "Accept-Ranges", "Content-Encoding", "Content-Disposition", "ETag", "Last-Modified"],
         max_age=600  # 缓存预检请求结果10分钟
-    )
+    ),
+    # 每个请求的耗时、首字节时间和发送字节数，见 /api/metrics
+    Middleware(MetricsMiddleware),
 ]
-app = FastAPI(middleware=middleware)
-
-metadata_store = {}
+app = FastAPI(middleware=middleware, lifespan=lifespan)
 
 # 添加OPTIONS请求处理
 @app.options("/{path:path}")
 async def options_route(path: str):
     return PlainTextResponse("OK")
 
+def version_conflict_response(e: VersionConflict) -> JSONResponse:
+    """元数据已被其他客户端修改时返回 409 和当前版本号"""
+    return JSONResponse(status_code=409, content={"detail": str(e), "conflicts": e.conflicts})
+
+# 元数据请求体；类型不符时 FastAPI 返回 422
+class MetadataItem(BaseModel):
+    filename: str = ""
+    metadata: Dict[str, Any] = {}
+    version: Optional[StrictInt] = None
+
+class MetadataBatch(BaseModel):
+    items: List[MetadataItem] = []
+
+class MetadataBatchGet(BaseModel):
+    filenames: List[str] = []
+
+async def put_metadata(entries: list) -> dict:
+    """写入元数据；无法保存为 JSON 的值（NaN、Infinity）返回 422"""
+    for filename, metadata, _ in entries:
+        if not filename or not metadata:
+            raise HTTPException(status_code=400, detail="Missing filename or metadata")
+    try:
+        return await run_in_threadpool(metadata_store.put_many, entries)
+    except InvalidMetadata as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+# 保存元数据；可携带 version（读取时的版本号）进行乐观并发控制
 @app.post("/api/metadata")
-async def save_metadata(payload: dict = Body(...)):
-    filename = payload.get('filename')
-    metadata = payload.get('metadata')
-    
-    if not filename or not metadata:
-        raise HTTPException(status_code=400, detail="Missing filename or metadata")
-        
-    metadata_store[filename] = metadata
-    return {"status": "success", "filename": filename}
+async def save_metadata(payload: MetadataItem):
+    try:
+        versions = await put_metadata([(payload.filename, payload.metadata, payload.version)])
+    except VersionConflict as e:
+        return version_conflict_response(e)
+    return {"status": "success", "filename": payload.filename, "version": versions[payload.filename]}
+
+# 批量保存元数据，任一条版本冲突时整批不写入
+@app.post("/api/metadata/batch")
+async def save_metadata_batch(payload: MetadataBatch):
+    if len(payload.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Too many items (max {MAX_BATCH_ITEMS})")
+    try:
+        versions = await put_metadata([(item.filename, item.metadata, item.version) for item in payload.items])
+    except VersionConflict as e:
+        return version_conflict_response(e)
+    return {"status": "success", "versions": versions}
+
+# 批量读取元数据，不存在的文件不出现在结果中
+@app.post("/api/metadata/batch-get")
+async def get_metadata_batch(payload: MetadataBatchGet):
+    filenames = payload.filenames
+    if len(filenames) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Too many filenames (max {MAX_BATCH_ITEMS})")
+    found = await run_in_threadpool(metadata_store.get_many, filenames)
+    return {"items": {
+        filename: {"metadata": metadata, "version": version}
+        for filename, (metadata, version) in found.items()
+    }}
 
 @app.get("/api/metadata/{filename:path}")
 async def get_metadata(filename: str):
     # URL解码文件名
     decoded_filename = unquote(filename)
-    return metadata_store.get(decoded_filename, {})
+    found = await run_in_threadpool(metadata_store.get, decoded_filename)
+    if found is None:
+        return {}
+    metadata, version = found
+    # 版本号通过 ETag 返回，保存时作为 version 提交
+    return JSONResponse(content=metadata, headers={"ETag": f'"{version}"'})
 
 # 添加HEAD请求支持
 @app.head("/api/raw/{filename:path}")
-async def head_raw_file(filename: str):
+async def head_raw_file(request: Request, filename: str):
+    return await head_media(request, filename)
+
+async def head_media(request: Request, filename: str, virtual: bool = False):
+    """媒体文件的 HEAD 应答；virtual 为 True 时与 /api/stream-direct 一致，按虚拟 faststart 文件给出校验头"""
     # URL解码文件名
     decoded_filename = unquote(filename)
     logging.info(f"HEAD请求: {decoded_filename}")
     
-    # 创建WebDAV客户端
     try:
-        webdav = Client({
-            'webdav_hostname': os.getenv('WEBDAV_SERVER'),
-            'webdav_login': os.getenv('WEBDAV_USERNAME'),
-            'webdav_password': os.getenv('WEBDAV_PASSWORD'),
-            'webdav_timeout': 5
-        })
-        webdav.verify = False
-        
-        # 构建远程路径
-        media_root = os.getenv('MEDIA_ROOT', '')
-        remote_path = f"{media_root}/{filename}" if media_root else filename
-        
+        # 获取文件信息（带缓存）
+        try:
+            remote_path, file_info = await stat_media(decoded_filename)
+        except Exception as e:
+            logging.error(f"获取文件信息失败: {str(e)}")
+            return JSONResponse(
+                status_code=200,  # 返回200而不是错误，让客户端继续尝试
+                content={"success": False, "message": f"File info not available, but might exist: {str(e)}"}
+            )
+
         # 检查文件是否存在
-        if not webdav.check(remote_path):
+        if file_info is None:
             logging.error(f"文件未找到: {remote_path}")
             raise HTTPException(status_code=404, detail=f"File not found: {decoded_filename}")
 
-        # 获取文件信息
         try:
-            file_info = webdav.info(remote_path)
-            file_size = int(file_info.get('size', 0))
+            file_size = file_info.size
             logging.info(f"文件信息: {file_info}")
             
+            # 重排后的 MP4 大小不变，但内容不同，使用独立的 ETag
+            if virtual and await faststart_layout(decoded_filename, remote_path, file_info) is not None:
+                file_info = virtual_meta(file_info)
+            validators = validator_headers(file_info, settings.media_cache_control)
+            status_code = evaluate_preconditions(request.headers, file_info, request.method)
+            if status_code is not None:
+                return precondition_response(status_code, validators)
+            
             # 设置内容类型
             content_type = "application/octet-stream"
             if decoded_filename.endswith('.mp4'):
@@ -110,7 +383,8 @@ async def head_raw_file(filename: str):
                     "Content-Type": content_type,
                     "Content-Length": str(file_size),
                     "Accept-Ranges": "bytes",
-                    "Content-Disposition": f'inline; filename="{quote(decoded_filename)}"'
+                    "Content-Disposition": f'inline; filename="{quote(decoded_filename)}"',
+                    **validators,
                 }
             )
         except Exception as e:
@@ -129,35 +403,52 @@ async def head_raw_file(filename: str):
 
 # WebDAV文件列表
 @app.get("/api/files")
-async def get_files():
+async def get_files(prewarm: bool = Query(False, alias="prewarm_thumbnails")):
+    files = await list_root_files()
+    if prewarm:
+        thumbnail_prewarmer.enqueue(item["name"] for item in files if item["type"] == "video")
+    return {"files": files}
+
+async def list_root_files() -> List[dict]:
     max_retries = 3
     retry_delay = 1
     
+    # 本地媒体目录中的文件排在前面，同名时覆盖远程文件（与 stat_media 的查找顺序一致）
+    local_files = []
+    if local_storage is not None:
+        for name, meta in sorted(await run_in_threadpool(local_storage.list)):
+            kind = media_type(name)
+            if kind is not None:
+                local_files.append({"name": name, "type": kind, "size": meta.size, "last_modified": meta.last_modified})
+    local_names = {item["name"] for item in local_files}
+    
+    # 索引已建立时直接从本地数据库返回根目录文件
+    if await run_in_threadpool(catalog.has_dir, ""):
+        _, items = await run_in_threadpool(catalog.query, "", limit=100000)
+        return local_files + [
+            {"name": item["name"], "type": item["type"], "size": item["size"], "last_modified": item["last_modified"]}
+            for item in items if item["name"] not in local_names
+        ]
+    if not settings.webdav_server:
+        return local_files
+    
     for attempt in range(max_retries):
         try:
-            webdav = Client({
-                'webdav_hostname': os.getenv('WEBDAV_SERVER'),
-                'webdav_login': os.getenv('WEBDAV_USERNAME'),
-                'webdav_password': os.getenv('WEBDAV_PASSWORD'),
-                'webdav_timeout': 30,
-                'disable_check': True
-            })
-            webdav.verify = False
-            
-            media_root = os.getenv('MEDIA_ROOT', '')
-            files = webdav.list(media_root)
+            entries = await upstream.list(settings.media_root)
             
             # 过滤出媒体文件
             media_files = []
-            for file in files:
-                if file.endswith(('.mp4', '.mkv', '.avi', '.mov', '.webm', '.mp3', '.flac', '.wav', '.aac', '.m4v', '.ts', '.vob', '.mts', '.3gp')):
-                    print(f"Processing file: {file}")  # 调试日志
+            for entry in entries:
+                kind = None if entry.is_dir else media_type(entry.name)
+                if kind is not None and entry.name not in local_names:
                     media_files.append({
-                        "name": os.path.basename(file),
-                        "type": "audio" if file.endswith(('.mp3', '.flac', '.wav', '.aac')) else "video"
+                        "name": entry.name,
+                        "type": kind,
+                        "size": entry.meta.size,
+                        "last_modified": entry.meta.last_modified
                     })
                     
-            return {"files": media_files}
+            return local_files + media_files
 
         except Exception as e:
             raise HTTPException(
@@ -165,19 +456,69 @@ async def get_files():
                 detail=f"WebDAV操作失败: {str(e)}"
             )
 
+def _page_limit(limit: int) -> int:
+    return min(max(limit, 1), 1000)
+
+# 媒体库索引：按目录分页列出文件
+@app.get("/api/catalog/files")
+async def catalog_files(path: str = "", recursive: bool = False, sort: str = "name", order: str = "asc",
+                        offset: int = 0, limit: int = 100,
+                        prewarm: bool = Query(False, alias="prewarm_thumbnails")):
+    path = path.strip('/')
+    limit = _page_limit(limit)
+    total, items = await run_in_threadpool(
+        catalog.query, path, recursive=recursive, sort=sort, descending=order == "desc",
+        offset=max(offset, 0), limit=limit,
+    )
+    if prewarm:
+        thumbnail_prewarmer.enqueue(item["path"] for item in items if item["type"] == "video")
+    return {"path": path, "total": total, "offset": offset, "limit": limit, "files": items}
+
+# 媒体库索引：子目录
+@app.get("/api/catalog/dirs")
+async def catalog_dirs(path: str = ""):
+    path = path.strip('/')
+    return {"path": path, "dirs": await run_in_threadpool(catalog.list_dirs, path)}
+
+# 媒体库索引：按文件名/标题和标签搜索
+@app.get("/api/catalog/search")
+async def catalog_search(q: str = "", tag: Optional[List[str]] = Query(None), type: Optional[str] = None,
+                         path: Optional[str] = None, sort: str = "name", order: str = "asc",
+                         offset: int = 0, limit: int = 100):
+    limit = _page_limit(limit)
+    total, items = await run_in_threadpool(
+        catalog.query, path.strip('/') if path is not None else None, recursive=True, q=q, tags=tag,
+        kind=type, sort=sort, descending=order == "desc", offset=max(offset, 0), limit=limit,
+    )
+    return {"q": q, "tags": tag or [], "total": total, "offset": offset, "limit": limit, "files": items}
+
+# 立即刷新媒体库索引；full=true 时重新列出所有目录
+@app.post("/api/catalog/refresh", status_code=202)
+async def refresh_catalog(full: bool = False):
+    return {"started": catalog_crawler.trigger(full)}
+
+@app.get("/api/catalog/status")
+async def catalog_status():
+    return {
+        **await run_in_threadpool(catalog.stats),
+        "running": catalog_crawler.running,
+        "last_started": catalog_crawler.last_started,
+        "last_finished": catalog_crawler.last_finished,
+        "last_error": catalog_crawler.last_error,
+        "listed": catalog_crawler.listed,
+        "skipped": catalog_crawler.skipped,
+    }
+
 # WebDAV具体实现
 @app.get("/api/webdav/files")
 async def webdav_files(url: str, username: str = "", password: str = ""):
     try:
-        webdav = Client({
-            'webdav_hostname': url,
-            'webdav_login': username,
-            'webdav_password': password
-        })
+        webdav = upstream.client_for(url, username, password)
         
         try:
-            # Directly use list method which is widely supported
-            files = webdav.list('/')
+            # Depth:1 PROPFIND 列出根目录
+            entries = await webdav.list('/')
+            files = [entry.name for entry in entries if not entry.is_dir]
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"WebDAV operation failed: {str(e)}")
         
@@ -185,7 +526,7 @@ async def webdav_files(url: str, username: str = "", password: str = ""):
         media_files = []
         for file in files:
             if file.endswith(('.mp4', '.mkv', '.avi', '.mov', '.webm', '.mp3', '.flac', '.wav', '.aac', '.m4v', '.ts', '.vob', '.mts', '.3gp')):
-                print(f"Processing file: {file}")  # 调试日志
+                logging.debug(f"Processing file: {file}")
                 media_files.append({
                     "name": os.path.basename(file),
                     "type": "audio" if file.endswith(('.mp3', '.flac', '.wav', '.aac')) else "video"
@@ -203,43 +544,99 @@ async def webdav_files(url: str, username: str = "", password: str = ""):
 @app.get("/api/ftp/files")
 async def ftp_files(url: str, username: str = "", password: str = ""):
     try:
-        from ftplib import FTP
-
-        
-        # 解析FTP URL
-        if url.startswith('ftp://'):
-            url = url[6:]
-            
-        host = url.split('/')[0]
-        path = '/' + '/'.join(url.split('/')[1:]) if '/' in url else '/'
-            
-        # 连接FTP
-        ftp = FTP(host)
-        ftp.login(username, password)
-        
-        if path != '/':
-            ftp.cwd(path)
-            
-        files = ftp.nlst()
+        # MLSD 一次返回文件名、大小和修改时间；连接来自连接池
+        server, path = FTPServer.from_url(url, username, password)
+        entries = await ftp_upstream.list(server, path)
         
         # 过滤出媒体文件
         media_files = []
-        for file in files:
-            if file.endswith(('.mp4', '.mkv', '.avi', '.mov', '.webm', '.mp3', '.flac', '.wav', '.aac', '.m4v', '.ts', '.vob', '.mts', '.3gp')):
-                print(f"Processing file: {file}")  # 调试日志
+        for entry in entries:
+            kind = None if entry.is_dir else media_type(entry.name)
+            if kind is not None:
                 media_files.append({
-                    "name": os.path.basename(file),
-                    "type": "audio" if file.endswith(('.mp3', '.flac', '.wav', '.aac')) else "video"
+                    "name": entry.name,
+                    "type": kind,
+                    "size": entry.meta.size,
+                    "last_modified": entry.meta.last_modified
                 })
                 
-        ftp.quit()
         return {"files": media_files}
     except Exception as e:
             raise HTTPException(
                 status_code=500, 
-                detail=f"WebDAV操作失败: {str(e)}"
+                detail=f"FTP操作失败: {str(e)}"
             )
 
+def ftp_target(filename: str, url: Optional[str], username: str, password: str):
+    """确定 FTP 文件所在的服务器和路径：url 参数优先，否则使用配置的 FTP_SERVER"""
+    if url:
+        server, root = FTPServer.from_url(url, username, password)
+    elif settings.ftp_server:
+        server, root = FTPServer.from_url(settings.ftp_server, settings.ftp_username, settings.ftp_password)
+    else:
+        raise HTTPException(status_code=400, detail="FTP server not configured")
+    return server, posixpath.join(root, filename)
+
+async def stat_ftp(server: FTPServer, path: str) -> Optional[FileMeta]:
+    """获取 FTP 文件元数据，与 WebDAV 共用元数据缓存"""
+    cache_path = server.cache_path(path)
+    hit, meta = metadata_cache.get(cache_path)
+    if hit:
+        return meta
+    meta = await ftp_upstream.stat(server, path)
+    metadata_cache.put(cache_path, meta)
+    return meta
+
+@app.head("/api/ftp/stream/{filename:path}")
+async def head_ftp_stream(request: Request, filename: str, url: Optional[str] = None,
+                          username: str = "", password: str = ""):
+    server, path = ftp_target(unquote(filename), url, username, password)
+    try:
+        file_info = await stat_ftp(server, path)
+    except FTP_ERRORS as e:
+        raise HTTPException(status_code=502, detail=f"FTP error: {str(e)}")
+    if file_info is None:
+        raise HTTPException(status_code=404, detail=f"File not found: {filename}")
+    validators = validator_headers(file_info, settings.media_cache_control)
+    status_code = evaluate_preconditions(request.headers, file_info, request.method)
+    if status_code is not None:
+        return precondition_response(status_code, validators)
+    return Response(
+        status_code=200,
+        headers={
+            "Content-Type": file_info.content_type,
+            "Content-Length": str(file_info.size),
+            "Accept-Ranges": "bytes",
+            **validators,
+        }
+    )
+
+# FTP 直接流式传输：REST 偏移支持范围请求，与 WebDAV 共用元数据缓存、块缓存和预读
+@app.get("/api/ftp/stream/{filename:path}")
+async def ftp_stream(request: Request, filename: str, url: Optional[str] = None,
+                     username: str = "", password: str = ""):
+    decoded_filename = unquote(filename)
+    server, path = ftp_target(decoded_filename, url, username, password)
+    logging.info(f"FTP流式传输请求: {server.host}:{server.port}{path}")
+    try:
+        file_info = await stat_ftp(server, path)
+    except FTP_ERRORS as e:
+        logging.error(f"FTP请求失败: {str(e)}")
+        raise HTTPException(status_code=502, detail=f"FTP error: {str(e)}")
+    if file_info is None:
+        raise HTTPException(status_code=404, detail=f"File not found: {decoded_filename}")
+    if file_info.size <= 0:
+        raise HTTPException(status_code=500, detail="Invalid file size")
+    
+    async def fetch(cache_path: str, start: Optional[int] = None, end: Optional[int] = None,
+                    etag: str = "", chunk_size: int = 64 * 1024):
+        async for chunk in ftp_upstream.stream(server, path, start, end, etag, chunk_size):
+            yield chunk
+    
+    reader = CachedReader(block_cache, fetch, bandwidth, subscriber_buffer=block_reader.subscriber_buffer)
+    return ranged_response(request, server.cache_path(path), file_info, reader,
+                           posixpath.basename(decoded_filename))
+
 # 客户端解码路由 - 只返回元数据信息
 @app.get("/api/stream/{filename:path}")
 async def stream_file(filename: str):
@@ -248,20 +645,6 @@ async def stream_file(filename: str):
         decoded_filename = unquote(filename)
         logging.info(f"解码后的文件名: {decoded_filename}")
         
-        # 创建WebDAV客户端
-        webdav = Client({
-            'webdav_hostname': os.getenv('WEBDAV_SERVER'),
-            'webdav_login': os.getenv('WEBDAV_USERNAME'),
-            'webdav_password': os.getenv('WEBDAV_PASSWORD'),
-            'webdav_timeout': 30
-        })
-        webdav.verify = False
-        
-        # 构建远程路径
-        media_root = os.getenv('MEDIA_ROOT', '')
-        encoded_filename = quote(decoded_filename)
-        remote_path = f"{media_root}/{encoded_filename}" if media_root else encoded_filename
-        
         # 判断文件类型
         file_type = "video"
         if decoded_filename.endswith(('.mp3', '.flac', '.wav', '.aac')):
@@ -283,129 +666,159 @@ async def stream_file(filename: str):
 
 # 支持HEAD方法的直接流API
 @app.head("/api/stream-direct/{filename:path}")
-async def head_stream_direct(filename: str):
-    return await head_raw_file(filename)
+async def head_stream_direct(request: Request, filename: str):
+    return await head_media(request, filename, virtual=True)
+
+def ranged_response(request: Request, remote_path: str, file_info: FileMeta, reader: CachedReader,
+                    display_name: str, layout: Optional[VirtualMP4] = None) -> Response:
+    """按 Range 头返回远程文件（200、206 单区间、多区间或 416），数据经块缓存读取
+
+    校验头来自 PROPFIND 的 ETag 和修改时间：条件请求命中时返回 304/412，
+    If-Range 不匹配时忽略 Range 返回完整文件。
+    给出 layout 时按虚拟 faststart 文件应答：moov 来自内存，其余字节按映射从原文件读取。
+    """
+    file_size = file_info.size
+    
+    # 获取文件类型
+    content_type = file_info.content_type
+    
+    response_meta = virtual_meta(file_info) if layout is not None else file_info
+    validators = validator_headers(response_meta, settings.media_cache_control)
+    status_code = evaluate_preconditions(request.headers, response_meta, request.method)
+    if status_code is not None:
+        return precondition_response(status_code, validators)
+    
+    # 获取请求的Range头；If-Range 校验失败时按无 Range 处理
+    range_header = request.headers.get("Range") if if_range_matches(request.headers, response_meta) else None
+    
+    response_headers = {
+        "Content-Type": content_type,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'inline; filename="{quote(display_name)}"',
+        **validators,
+    }
+    
+    # 解析范围请求（支持 a-b、a-、-N 及多区间）
+    try:
+        ranges = parse_range_header(range_header, file_size)
+    except RangeNotSatisfiable:
+        logging.info(f"范围请求无法满足: {range_header}, 文件大小: {file_size}")
+        return Response(
+            status_code=416,
+            headers={"Content-Range": f"bytes */{file_size}", "Accept-Ranges": "bytes"}
+        )
+    if range_header and ranges is None:
+        logging.warning(f"无法识别的范围请求, 返回完整文件: {range_header}")
+    
+    client_host = request.client.host if request.client else ""
+    
+    # 带宽调度的类别：后台任务（缩略图、预热转码）和整文件转码通过 priority 参数声明，
+    # 其余带 Range 的是播放，不带的是整文件下载
+    if request.query_params.get("priority") in (CLASS_BACKGROUND, CLASS_BULK):
+        stream_class = request.query_params["priority"]
+    elif request.headers.get("Range"):
+        stream_class = CLASS_PLAYBACK
+    else:
+        stream_class = CLASS_BULK
+    # 已探测过的文件按码率给播放流保底速率（不为此触发探测）
+    info = probe_cache.get((remote_path, file_version(file_info))) if stream_class == CLASS_PLAYBACK else None
+    bitrate = info.bit_rate if info is not None else 0
+    flow = None
+    
+    async def read_range(start: int, end: int):
+        # 优先从块缓存读取，缺失部分再从上游获取
+        pieces = layout.pieces(start, end) if layout is not None else [(None, start, end)]
+        for data, source_start, source_end in pieces:
+            if data is not None:
+                yield data
+                continue
+            async for chunk in reader.read(remote_path, file_info, source_start, source_end, flow):
+                yield chunk
+    
+    async def guarded(body):
+        nonlocal flow
+        # 在响应开始发送时才登记，客户端提前断开不会留下流
+        flow = reader.shaper.open(stream_class, bitrate)
+        try:
+            async for chunk in body:
+                yield chunk
+        except UpstreamError as e:
+            logging.error(f"WebDAV请求失败: {e.status_code}")
+            # 文件可能已被删除或替换，丢弃缓存的元数据
+            metadata_cache.invalidate(remote_path)
+            yield bytes(f"Error: {e.status_code}", 'utf-8')
+        except FTP_ERRORS as e:
+            logging.error(f"FTP传输失败: {str(e)}")
+            metadata_cache.invalidate(remote_path)
+        finally:
+            reader.shaper.close(flow)
+    
+    if ranges is not None and len(ranges) > 1:
+        # 多区间请求，返回 multipart/byteranges
+        multipart = MultipartByteranges(ranges, file_size, content_type)
+        logging.info(f"多区间请求: {ranges}/{file_size}")
+        status_code = 206
+        response_headers["Content-Type"] = multipart.content_type
+        content_length = multipart.content_length
+        body = multipart.iter_body(read_range)
+    else:
+        if ranges is None:
+            byte_range = ByteRange(0, file_size - 1)
+            status_code = 200
+        else:
+            # 开放区间按会话自适应截断：顺序播放逐步放大，跳转后缩小
+            byte_range = span_policy.clip((client_host, remote_path), ranges[0])
+            status_code = 206
+            response_headers["Content-Range"] = f"bytes {byte_range.start}-{byte_range.end}/{file_size}"
+        logging.info(f"请求范围: {byte_range.start}-{byte_range.end}/{file_size}")
+        
+        # 按客户端+文件检测顺序播放，触发后台预读（预读按原文件的偏移进行）
+        source = (byte_range.start, byte_range.end) if layout is None else layout.source_range(byte_range.start, byte_range.end)
+        if source is not None:
+            prefetcher.on_read(client_host, remote_path, file_info, source[0], source[1], reader)
+        content_length = byte_range.length
+        body = read_range(byte_range.start, byte_range.end)
+        
+    response_headers["Content-Length"] = str(content_length)
+        
+    logging.info(f"发送流式响应, 状态码: {status_code}, 内容类型: {content_type}, 内容长度: {content_length}")
+    return StreamingResponse(
+        guarded(body), 
+        status_code=status_code,
+        headers=response_headers
+    )
 
 # 直接流式传输API - 支持范围请求
 @app.get("/api/stream-direct/{filename:path}")
 async def stream_direct(request: Request, filename: str):
+    return await direct_response(request, filename, virtual=True)
+
+async def direct_response(request: Request, filename: str, virtual: bool = False):
+    """按 Range 发送媒体文件；virtual 为 True 时 moov 在末尾的远程 MP4 按虚拟 faststart 布局发送"""
     try:
         # URL解码文件名
         decoded_filename = unquote(filename)
         logging.info(f"直接流式传输请求: {decoded_filename}")
         
-        # 创建WebDAV客户端
-        webdav = Client({
-            'webdav_hostname': os.getenv('WEBDAV_SERVER'),
-            'webdav_login': os.getenv('WEBDAV_USERNAME'),
-            'webdav_password': os.getenv('WEBDAV_PASSWORD'),
-            'webdav_timeout': 30
-        })
-        webdav.verify = False
-        
-        # 构建远程路径
-        media_root = os.getenv('MEDIA_ROOT', '')
-        encoded_filename = quote(decoded_filename)
-        remote_path = f"{media_root}/{encoded_filename}" if media_root else encoded_filename
-        
-        # 检查文件是否存在
-        if not webdav.check(remote_path):
+        # 获取文件信息（带缓存），同时检查文件是否存在
+        remote_path, file_info = await stat_media(decoded_filename)
+        if file_info is None:
             raise HTTPException(status_code=404, detail=f"File not found: {decoded_filename}")
-            
-        # 获取文件信息
-        file_info = webdav.info(remote_path)
         logging.info(f"文件信息: {file_info}")
         
+        # 本地文件直接从磁盘发送，不经过块缓存
+        if LocalStorage.owns(remote_path):
+            return local_file_response(request, LocalStorage.path_of(remote_path),
+                                       file_info.content_type, decoded_filename, settings.media_cache_control)
+        
         # 解析文件大小
-        file_size = int(file_info.get('size', 0))
+        file_size = file_info.size
         if file_size <= 0:
             raise HTTPException(status_code=500, detail="Invalid file size")
-            
-        # 获取文件类型
-        content_type = file_info.get('content_type', 'application/octet-stream')
-        
-        # 获取WebDAV完整URL
-        webdav_url = os.getenv('WEBDAV_SERVER', '')
-        if not webdav_url.endswith('/'):
-            webdav_url += '/'
-        
-        full_url = f"{webdav_url}{remote_path}"
-        logging.info(f"完整URL: {full_url}")
-        
-        # 获取请求的Range头
-        range_header = request.headers.get("Range")
-        
-        # 创建WebDAV请求
-        # 不再使用 webdav._token，改为直接使用基本认证
-        webdav_username = os.getenv('WEBDAV_USERNAME')
-        webdav_password = os.getenv('WEBDAV_PASSWORD')
-        
-        # 创建基本认证头
-        headers = {}
-        
-        # 处理范围请求
-        start_byte = 0
-        end_byte = file_size - 1
-        
-        if range_header:
-            logging.info(f"处理范围请求: {range_header}")
-            try:
-                range_match = range_header.split('=')[1]
-                start_byte = int(range_match.split('-')[0])
-                end_part = range_match.split('-')[1]
-                if end_part:
-                    end_byte = int(end_part)
-                else:
-                    # 如果没有指定结束位置，则设为一个合理的块大小
-                    end_byte = min(start_byte + 1024*1024, file_size - 1)  # 1MB 块或文件剩余部分
-            except Exception as e:
-                logging.error(f"解析范围请求出错: {str(e)}")
-                # 如果解析失败，使用默认值
-            
-            headers["Range"] = f"bytes={start_byte}-{end_byte}"
-            
-        logging.info(f"请求范围: {start_byte}-{end_byte}/{file_size}")
-        
-        # 发送请求并处理流式响应
-        def iterfile():
-            s = requests.Session()
-            # 关闭流式传输自动解码，保持原始字节
-            with s.get(full_url, headers=headers, stream=True, auth=(webdav_username, webdav_password), verify=False) as r:
-                # 获取实际响应状态码
-                status_code = r.status_code
-                logging.info(f"WebDAV响应状态码: {status_code}")
-                
-                if status_code >= 400:
-                    logging.error(f"WebDAV请求失败: {status_code}")
-                    yield bytes(f"Error: {status_code}", 'utf-8')
-                    return
-                    
-                for chunk in r.iter_content(chunk_size=8192):
-                    if chunk:
-                        yield chunk
-        
-        # 根据是否为范围请求设置适当的状态码和头信息
-        status_code = 206 if range_header else 200
-        response_headers = {
-            "Content-Type": content_type,
-            "Accept-Ranges": "bytes",
-            "Content-Disposition": f'inline; filename="{quote(decoded_filename)}"'
-        }
         
-        if range_header:
-            response_headers["Content-Range"] = f"bytes {start_byte}-{end_byte}/{file_size}"
-            content_length = end_byte - start_byte + 1
-        else:
-            content_length = file_size
-            
-        response_headers["Content-Length"] = str(content_length)
-            
-        logging.info(f"发送流式响应, 状态码: {status_code}, 内容类型: {content_type}, 内容长度: {content_length}")
-        return StreamingResponse(
-            iterfile(), 
-            status_code=status_code,
-            headers=response_headers
-        )
+        # moov 在末尾的 MP4 以虚拟 faststart 布局发送，浏览器顺序读取即可起播
+        layout = await faststart_layout(decoded_filename, remote_path, file_info) if virtual else None
+        return ranged_response(request, remote_path, file_info, block_reader, decoded_filename, layout)
     
     except HTTPException:
         raise
@@ -413,19 +826,123 @@ async def stream_direct(request: Request, filename: str):
         logging.exception(f"流式传输出错: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Stream error: {str(e)}")
 
+# 使元数据缓存失效（文件在存储端被修改后调用）
+@app.delete("/api/cache/metadata")
+async def invalidate_metadata_cache(path: Optional[str] = None, prefix: Optional[str] = None):
+    remote_path = upstream.remote_path(path) if path else None
+    remote_prefix = upstream.remote_path(prefix) if prefix else None
+    removed = metadata_cache.invalidate(path=remote_path, prefix=remote_prefix)
+    logging.info(f"元数据缓存失效: path={path}, prefix={prefix}, 删除 {removed} 条")
+    return {"status": "success", "removed": removed}
+
+# Prometheus 文本格式的运行指标
+@app.get("/api/metrics")
+async def metrics():
+    return Response(content=REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/api/cache/metadata")
+async def metadata_cache_stats():
+    return metadata_cache.stats()
+
+@app.delete("/api/cache/transcode")
+async def clear_transcode_cache():
+    removed = transcode_cache.clear()
+    logging.info(f"清空转码缓存, 删除 {removed} 个文件")
+    return {"status": "success", "removed": removed}
+
+@app.get("/api/cache/transcode")
+async def transcode_cache_stats():
+    return transcode_cache.stats()
+
+@app.get("/api/cache/prefetch")
+async def prefetch_stats():
+    return prefetcher.stats()
+
+def bandwidth_stats() -> dict:
+    return dict(bandwidth.stats(), limit_mbps=bandwidth.rate * 8 / 1e6)
+
+# 上游带宽调度的状态与运行时调整
+@app.get("/api/bandwidth")
+async def get_bandwidth():
+    return bandwidth_stats()
+
+@app.put("/api/bandwidth")
+async def update_bandwidth(payload: dict = Body(...)):
+    """调整 limit_mbps（0 表示不限速）、playback_weight、bulk_weight、floor_factor，未给出的保持不变"""
+    fields = ("limit_mbps", "playback_weight", "bulk_weight", "floor_factor")
+    unknown = set(payload) - set(fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    values = {}
+    for name in fields:
+        if name not in payload:
+            continue
+        value = payload[name]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise HTTPException(status_code=400, detail=f"{name} must be a non-negative number")
+        if name.endswith("_weight") and value == 0:
+            raise HTTPException(status_code=400, detail=f"{name} must be positive")
+        values[name] = float(value)
+    if "limit_mbps" in values:
+        values["rate"] = values.pop("limit_mbps") * 1e6 / 8
+    bandwidth.configure(**values)
+    logging.info(f"带宽调度已更新: {payload}")
+    return bandwidth_stats()
+
+# 上游镜像的延迟、错误率和对冲等待时间
+@app.get("/api/upstream/mirrors")
+async def upstream_mirror_stats():
+    return upstream.mirrors.stats()
+
+@app.delete("/api/cache/blocks")
+async def clear_block_cache():
+    removed = block_cache.clear()
+    logging.info(f"清空块缓存, 删除 {removed} 个块")
+    return {"status": "success", "removed": removed}
+
+@app.get("/api/cache/blocks")
+async def block_cache_stats():
+    return block_cache.stats()
+
+@app.get("/api/cache/thumbnails")
+async def thumbnail_cache_stats():
+    return {
+        "cache": thumbnail_cache.stats(),
+        "jobs": thumbnail_scheduler.stats(),
+        "prewarm": thumbnail_prewarmer.stats(),
+    }
+
+@app.delete("/api/cache/thumbnails")
+async def clear_thumbnail_cache():
+    removed = thumbnail_cache.clear()
+    logging.info(f"清空缩略图缓存, 删除 {removed} 个文件")
+    return {"status": "success", "removed": removed}
+
+@app.get("/api/cache/probe")
+async def probe_cache_stats():
+    return probe_cache.stats()
+
+@app.get("/api/cache/seek-index")
+async def seek_index_cache_stats():
+    return seek_index_cache.stats()
+
+@app.get("/api/cache/faststart")
+async def faststart_cache_stats():
+    return faststart_cache.stats()
+
 # 添加对HEAD请求的支持
 @app.head("/api/raw/{filename:path}")
-async def head_raw_file_alt(filename: str):
-    return await head_raw_file(filename)
+async def head_raw_file_alt(request: Request, filename: str):
+    return await head_raw_file(request, filename)
 
-# 提供原始媒体文件流 (保留以兼容旧版客户端)
+# 提供原始媒体文件流 (保留以兼容旧版客户端)，始终与上游文件逐字节一致
 @app.get("/api/raw/{filename:path}")
 async def get_raw_file(request: Request, filename: str):
-    return await stream_direct(request, filename)
+    return await direct_response(request, filename)
 
 # 支持HEAD请求的转换API
 @app.head("/api/converted/{filename:path}")
-async def head_converted_file(filename: str):
+async def head_converted_file(filename: str, mode: Optional[str] = None):
     # 简单返回一个200响应，不做实际转换
     # URL解码文件名
     decoded_filename = unquote(filename)
@@ -439,142 +956,223 @@ async def head_converted_file(filename: str):
         status_code=200,
         headers={
             "Content-Type": "video/mp4",
-            "Accept-Ranges": "bytes",
+            # 流式转码的输出无法随机访问
+            "Accept-Ranges": "none" if (mode or settings.transcode_mode) == "stream" else "bytes",
+            "Content-Disposition": f'inline; filename="{quote(mp4_filename)}"'
+        }
+    )
+
+def submit_conversion(decoded_filename: str, remote_path: str, file_info: FileMeta,
+                      options: dict = DEFAULT_ENCODE_OPTIONS, priority: int = PRIORITY_INTERACTIVE) -> Job:
+    """提交转码任务，结果写入转码缓存；相同文件和参数只转码一次
+
+    options 由播放计划决定（重新封装、只转码音频或完整转码）；
+    较低开销的方式失败时（如 MP4 无法容纳某条流）退回完整转码，结果仍缓存在原键下。
+    ffmpeg 经 /api/stream-direct 读取源文件，moov 在末尾的 MP4/MOV 也能随机访问；
+    上游读取经过块缓存，按整文件下载（预热任务按后台）类别参与带宽调度。
+    """
+    key = cache_key(remote_path, file_info, options)
+    stream_class = CLASS_BULK if priority <= PRIORITY_INTERACTIVE else CLASS_BACKGROUND
+    input_url = media_input_url(decoded_filename, stream_class)
+    
+    async def run(threads: int) -> str:
+        async def produce(output_path: str):
+            try:
+                logging.info(f"转换文件为MP4格式: {remote_path} -> {output_path}")
+                await transcode_to_file(input_url, output_path, options, threads=threads)
+            except TranscodeError as e:
+                if options == DEFAULT_ENCODE_OPTIONS:
+                    raise
+                logging.error(f"转换文件失败: {str(e)}")
+                logging.info("改为完整转码...")
+                await transcode_to_file(input_url, output_path, DEFAULT_ENCODE_OPTIONS, threads=threads)
+        
+        return await transcode_cache.get_or_create(key, produce)
+    
+    job = job_scheduler.submit("transcode", remote_path, run, priority=priority, key=key)
+    job.on_cancel = lambda: transcode_cache.cancel(key)
+    return job
+
+async def converted_file(decoded_filename: str, remote_path: str, file_info: FileMeta,
+                         options: dict = DEFAULT_ENCODE_OPTIONS) -> str:
+    """返回转码缓存中的MP4路径，不存在时排队转码并等待完成"""
+    cached = transcode_cache.lookup(cache_key(remote_path, file_info, options))
+    if cached is not None:
+        return cached
+    return await job_scheduler.wait(submit_conversion(decoded_filename, remote_path, file_info, options))
+
+async def conversion_plan(decoded_filename: str, remote_path: str, file_info: FileMeta) -> PlaybackPlan:
+    """根据探测结果选择播放方式；探测失败时按完整转码处理"""
+    try:
+        info = await probe_file(decoded_filename, remote_path, file_info)
+    except TranscodeError as e:
+        logging.warning(f"探测媒体信息失败, 按完整转码处理: {str(e)}")
+        return PlaybackPlan(DECISION_TRANSCODE, "probe failed", DEFAULT_ENCODE_OPTIONS)
+    plan = playback_plan(info, decoded_filename)
+    logging.info(f"播放方式: {plan.decision} ({plan.reason}) {remote_path}")
+    return plan
+
+async def _close_quietly(agen):
+    try:
+        await agen.aclose()
+    except Exception:
+        pass
+
+class ClosingStreamingResponse(StreamingResponse):
+    """发送结束后总是调用 on_close
+
+    客户端在响应体开始迭代前断开时，响应体生成器的 finally 不会执行；
+    占用的资源（工作槽、ffmpeg 进程）由 on_close 兜底释放。
+    """
+
+    def __init__(self, content, on_close: Callable[[], Awaitable[None]], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.on_close()
+
+def busy_response(e: SchedulerBusy) -> JSONResponse:
+    """转码队列已满时返回 503，提示客户端稍后重试"""
+    logging.warning(f"转码队列已满, 拒绝请求: {str(e)}")
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(e.retry_after)},
+        content={"detail": str(e)}
+    )
+
+async def streaming_converted_response(decoded_filename: str, remote_path: str, file_info: FileMeta,
+                                       mp4_filename: str, options: dict = DEFAULT_ENCODE_OPTIONS):
+    """流式转码：ffmpeg 经 /api/stream-direct 读取源文件，分片 MP4 边生成边返回
+
+    源文件通过可随机访问的地址读取，moov 在末尾的 MP4/MOV 也能正确解析。
+    ffmpeg 在输出第一个分片前失败时抛出 TranscodeError / UpstreamError，由调用方决定是否重试。
+    """
+    # 流式转码同样占用一个 ffmpeg 工作槽，直到响应结束
+    job = Job("stream", remote_path, PRIORITY_INTERACTIVE)
+    job_scheduler.admit(job.priority)
+    try:
+        await job_scheduler.acquire(job)
+    except BaseException as e:
+        # 排队时被取消或客户端断开：记录结果，任务不再停留在 queued 状态
+        job_scheduler.release(job, e)
+        raise
+    
+    output = stream_transcode(None, streaming_args(options, threads=job_scheduler.threads_per_job,
+                                                   input_url=media_input_url(decoded_filename)))
+    
+    # 先取到第一个分片再返回响应，这样 ffmpeg 无法识别输入或输出为空时仍能返回错误状态码
+    try:
+        first_chunk = await first_fragment(output)
+    except BaseException as e:
+        job_scheduler.release(job, e)
+        await _close_quietly(output)
+        raise
+    
+    released = False
+    
+    async def finish(error: Optional[BaseException] = None):
+        # 由响应体结束或响应对象兜底调用，只执行一次
+        nonlocal released
+        if released:
+            return
+        released = True
+        await _close_quietly(output)
+        job_scheduler.release(job, error)
+    
+    async def body():
+        error = None
+        try:
+            yield first_chunk
+            async for chunk in output:
+                if job.cancel_requested:
+                    logging.info(f"流式转码已被取消: {remote_path}")
+                    break
+                yield chunk
+            logging.info(f"流式转码完成: {remote_path}")
+        except (TranscodeError, UpstreamError) as e:
+            # 响应头已发送，只能记录错误并结束输出
+            logging.error(f"流式转码中断: {str(e)}")
+            error = e
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            await finish(error)
+    
+    return ClosingStreamingResponse(
+        body(),
+        finish,
+        media_type="video/mp4",
+        headers={
+            "Accept-Ranges": "none",
             "Content-Disposition": f'inline; filename="{quote(mp4_filename)}"'
         }
     )
 
 # 转换为兼容格式API
+# mode=stream（默认）边转码边输出；mode=file 完整转换并缓存后返回，支持范围请求
 @app.get("/api/converted/{filename:path}")
-async def get_converted_file(request: Request, filename: str):
+async def get_converted_file(request: Request, filename: str, mode: Optional[str] = None):
     try:
         # URL解码文件名
         decoded_filename = unquote(filename)
         logging.info(f"格式转换请求: {decoded_filename}")
         
-        # 创建WebDAV客户端
-        webdav = Client({
-            'webdav_hostname': os.getenv('WEBDAV_SERVER'),
-            'webdav_login': os.getenv('WEBDAV_USERNAME'),
-            'webdav_password': os.getenv('WEBDAV_PASSWORD'),
-            'webdav_timeout': 30
-        })
-        webdav.verify = False
-        
-        # 构建远程路径
-        media_root = os.getenv('MEDIA_ROOT', '')
-        encoded_filename = quote(decoded_filename)
-        remote_path = f"{media_root}/{encoded_filename}" if media_root else encoded_filename
-        
         # 检查文件是否存在
-        if not webdav.check(remote_path):
+        remote_path, file_info = await stat_media(decoded_filename)
+        if file_info is None:
             raise HTTPException(status_code=404, detail=f"File not found: {decoded_filename}")
 
-        # 创建临时目录
-        temp_dir = os.path.join(tempfile.gettempdir(), 'noediv_cache')
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        # 创建临时文件路径 - 使用更安全的文件名
-        safe_filename = ''.join(c if c.isalnum() or c in '._-' else '_' for c in decoded_filename)
-        source_file = os.path.join(temp_dir, safe_filename)
-        
-        # 获取文件名（不含扩展名）和新扩展名
-        filename_base = os.path.splitext(safe_filename)[0]
-        mp4_filename = f"{filename_base}.mp4"
-        output_file = os.path.join(temp_dir, mp4_filename)
-        
-        # 下载文件
-        try:
-            logging.info(f"下载原始文件到临时位置: {source_file}")
-            webdav.download_file(remote_path=remote_path, local_path=source_file)
-        except Exception as e:
-            logging.error(f"下载文件失败: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Failed to download file: {str(e)}")
-
-        # 如果源文件已经是MP4格式且大小较小，直接流式传输
-        if decoded_filename.endswith('.mp4') and os.path.getsize(source_file) < 100 * 1024 * 1024:  # 100MB
-            logging.info(f"文件已经是MP4格式且小于100MB，直接传输")
-            # 清理临时文件
-            try:
-                if os.path.exists(source_file):
-                    os.remove(source_file)
-            except:
-                pass
+        # 根据容器和编码选择开销最低的方式：浏览器能直接播放的文件不经过 ffmpeg
+        plan = await conversion_plan(decoded_filename, remote_path, file_info)
+        if plan.decision == DECISION_DIRECT:
             return await stream_direct(request, filename)
-            
-        # 转换为MP4格式
-        try:
-            logging.info(f"转换文件为MP4格式: {source_file} -> {output_file}")
-            (
-                ffmpeg
-                .input(source_file)
-                .output(
-                    output_file, 
-                    vcodec='libx264',
-                    preset='ultrafast', 
-                    crf=23,
-                    acodec='aac',
-                    audio_bitrate='128k',
-                    movflags='faststart',
-                    loglevel='info'
-                )
-                .overwrite_output()
-                .run(capture_stdout=True, capture_stderr=True)
-            )
-            logging.info(f"转换完成: {output_file}")
-        except Exception as e:
-            logging.error(f"转换文件失败: {str(e)}")
-            # 如果转换失败，尝试只复制流而不重新编码
+
+        # 已有缓存结果时直接返回，支持范围请求
+        cached = transcode_cache.lookup(cache_key(remote_path, file_info, plan.options))
+        if cached is not None:
+            logging.info(f"命中转码缓存: {cached}")
+            mp4_filename = f"{os.path.splitext(os.path.basename(decoded_filename))[0]}.mp4"
+            return local_file_response(request, cached, "video/mp4", mp4_filename)
+
+        if (mode or settings.transcode_mode) == "stream":
+            mp4_filename = f"{os.path.splitext(os.path.basename(decoded_filename))[0]}.mp4"
+            logging.info(f"流式转码: {remote_path}")
             try:
-                logging.info("尝试仅复制流不重新编码...")
-                (
-                    ffmpeg
-                    .input(source_file)
-                    .output(
-                        output_file,
-                        vcodec='copy',
-                        acodec='copy',
-                        movflags='faststart'
-                    )
-                    .overwrite_output()
-                    .run(capture_stdout=True, capture_stderr=True)
-                )
-                logging.info(f"流复制完成: {output_file}")
-            except Exception as e2:
-                logging.error(f"流复制也失败了: {str(e2)}")
-                # 清理临时文件
                 try:
-                    if os.path.exists(source_file):
-                        os.remove(source_file)
-                except:
-                    pass
-                raise HTTPException(status_code=500, detail=f"File conversion failed: {str(e2)}")
+                    return await streaming_converted_response(decoded_filename, remote_path, file_info, mp4_filename,
+                                                              plan.options)
+                except TranscodeError as e:
+                    if plan.options == DEFAULT_ENCODE_OPTIONS:
+                        raise
+                    logging.error(f"{plan.decision} 失败, 改为完整转码: {str(e)}")
+                    return await streaming_converted_response(decoded_filename, remote_path, file_info, mp4_filename)
+            except SchedulerBusy as e:
+                return busy_response(e)
+            except JobCancelled:
+                raise HTTPException(status_code=409, detail="File conversion was cancelled")
+            except (TranscodeError, UpstreamError) as e:
+                logging.error(f"流式转码失败: {str(e)}")
+                raise HTTPException(status_code=500, detail=f"File conversion failed: {str(e)}")
 
-        # 将转换后的文件作为响应返回
+        # 转换为可随机访问的MP4并写入缓存；相同文件的并发请求共享同一次转码
+        mp4_filename = f"{os.path.splitext(os.path.basename(decoded_filename))[0]}.mp4"
         try:
-            async with aiofiles.open(output_file, 'rb') as f:
-                content = await f.read()
-            
-            # 清理临时文件
-            try:
-                if os.path.exists(source_file):
-                    os.remove(source_file)
-                if os.path.exists(output_file):
-                    os.remove(output_file)
-            except Exception as e:
-                logging.warning(f"清理临时文件失败: {str(e)}")
-                
-            return Response(
-                content=content,
-                headers={
-                    'Content-Type': 'video/mp4',
-                    'Content-Disposition': f'inline; filename="{quote(mp4_filename)}"',
-                    'Content-Length': str(len(content))
-                }
-            )
-        except Exception as e:
-            logging.error(f"读取转换后文件失败: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Failed to read converted file: {str(e)}")
+            output_file = await converted_file(decoded_filename, remote_path, file_info, plan.options)
+        except SchedulerBusy as e:
+            return busy_response(e)
+        except JobCancelled:
+            raise HTTPException(status_code=409, detail="File conversion was cancelled")
+        except (TranscodeError, UpstreamError) as e:
+            logging.error(f"转换文件失败: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"File conversion failed: {str(e)}")
+        
+        # 从缓存返回，支持范围请求
+        return local_file_response(request, output_file, "video/mp4", mp4_filename)
             
     except HTTPException:
         raise
@@ -582,6 +1180,372 @@ async def get_converted_file(request: Request, filename: str):
         logging.exception(f"转换过程中出错: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Conversion error: {str(e)}")
 
+def media_input_url(decoded_filename: str, stream_class: Optional[str] = None) -> str:
+    """ffmpeg 读取源文件的地址：回环到本服务的 /api/stream-direct，范围读取经过块缓存和带宽调度
+
+    stream_class 为 CLASS_BULK / CLASS_BACKGROUND 时上游读取按该类别调度，不与播放争抢带宽；
+    为 None 时 ffmpeg 的范围请求按播放处理。
+    """
+    url = f"{settings.internal_base_url.rstrip('/')}/api/stream-direct/{quote(decoded_filename)}"
+    return f"{url}?priority={stream_class}" if stream_class else url
+
+async def probe_file(decoded_filename: str, remote_path: str, file_info: FileMeta,
+                     background: bool = False) -> MediaInfo:
+    """探测媒体信息，按路径和文件版本缓存；ffprobe 经 /api/stream-direct 只读取所需的范围"""
+    async def probe() -> MediaInfo:
+        logging.info(f"探测媒体信息: {remote_path}")
+        input_url = media_input_url(decoded_filename, CLASS_BACKGROUND if background else None)
+        return parse_probe(await probe_media(input_url, settings.probe_timeout))
+    return await probe_cache.get_or_probe((remote_path, file_version(file_info)), probe)
+
+async def hls_duration(decoded_filename: str, remote_path: str, file_info: FileMeta) -> float:
+    duration = (await probe_file(decoded_filename, remote_path, file_info)).duration
+    if duration <= 0:
+        raise TranscodeError(f"Unknown media duration: {decoded_filename}")
+    return duration
+
+def hls_segment_key(remote_path: str, file_info: FileMeta, index: int) -> str:
+    options = dict(DEFAULT_ENCODE_OPTIONS, hls_time=settings.hls_segment_seconds, hls_segment=index)
+    return cache_key(remote_path, file_info, options)
+
+def submit_hls_segment(decoded_filename: str, remote_path: str, file_info: FileMeta, duration: float,
+                       index: int, priority: int = PRIORITY_INTERACTIVE) -> Job:
+    """提交单个 HLS 分段的生成任务，结果写入转码缓存；相同分段只生成一次"""
+    key = hls_segment_key(remote_path, file_info, index)
+    start, length = segment_bounds(index, duration, settings.hls_segment_seconds)
+    
+    async def run(threads: int) -> str:
+        async def produce(output_path: str):
+            logging.info(f"生成HLS分段: {remote_path} #{index} ({start:.1f}s +{length:.1f}s)")
+            await run_ffmpeg(segment_args(media_input_url(decoded_filename), output_path, start, length, threads=threads))
+        
+        return await transcode_cache.get_or_create(key, produce, suffix=".ts")
+    
+    job = job_scheduler.submit("hls", f"{remote_path}#{index}", run, priority=priority, key=key)
+    job.on_cancel = lambda: transcode_cache.cancel(key)
+    return job
+
+def prewarm_hls_segments(decoded_filename: str, remote_path: str, file_info: FileMeta, duration: float, index: int):
+    """在后台预先生成播放位置之后的几个分段；队列繁忙时放弃"""
+    count = segment_count(duration, settings.hls_segment_seconds)
+    for ahead in segments_ahead(index, count, settings.hls_prefetch_segments):
+        key = hls_segment_key(remote_path, file_info, ahead)
+        if transcode_cache.lookup(key, ".ts") is not None:
+            continue
+        try:
+            submit_hls_segment(decoded_filename, remote_path, file_info, duration, ahead, PRIORITY_PREWARM)
+        except SchedulerBusy:
+            logging.info(f"转码队列繁忙, 跳过HLS分段预生成: {remote_path} #{ahead}")
+            break
+
+def thumbnail_plan(decoded_filename: str, remote_path: str, file_info: FileMeta, kind: str,
+                   info: MediaInfo) -> Tuple[str, Callable[[str], Awaitable[None]]]:
+    """根据探测结果确定缩略图的缓存键和生成函数"""
+    video = info.tracks_of('video')
+    if not video or info.duration <= 0:
+        raise TranscodeError(f"No video stream: {decoded_filename}")
+    input_url = media_input_url(decoded_filename, CLASS_BACKGROUND)
+    
+    if kind == "poster":
+        width, height = scaled_size(settings.thumbnail_width, video[0].width, video[0].height)
+        at = poster_time(info.duration)
+        key = cache_key(remote_path, file_info, {"thumbnail": kind, "width": width, "at": at})
+        
+        async def produce(output_path: str):
+            await generate_poster(input_url, output_path, at, width, height)
+    else:
+        width, height = scaled_size(settings.trickplay_width, video[0].width, video[0].height)
+        interval = trickplay_interval(info.duration, settings.trickplay_interval)
+        key = cache_key(remote_path, file_info, {"thumbnail": kind, "width": width, "interval": interval})
+        
+        async def produce(output_path: str):
+            await generate_sprite(input_url, output_path, trickplay_times(info.duration, interval), width, height)
+    return key, produce
+
+async def thumbnail_file(decoded_filename: str, remote_path: str, file_info: FileMeta, kind: str,
+                         priority: int = PRIORITY_INTERACTIVE) -> str:
+    """返回封面（poster）或拖动预览雪碧图（sprite）的缓存路径，不存在时排队生成并等待
+
+    探测也在缩略图任务中进行（按后台类别读取上游），未命中时探测数量受任务槽位限制。
+    """
+    info = probe_cache.get((remote_path, file_version(file_info)))
+    if info is not None:
+        cached = thumbnail_cache.lookup(thumbnail_plan(decoded_filename, remote_path, file_info, kind, info)[0], ".jpg")
+        if cached is not None:
+            return cached
+    
+    keys = []
+    
+    async def run(threads: int) -> str:
+        media = await probe_file(decoded_filename, remote_path, file_info, background=True)
+        key, produce = thumbnail_plan(decoded_filename, remote_path, file_info, kind, media)
+        keys.append(key)
+        logging.info(f"生成缩略图: {kind} {remote_path}")
+        return await thumbnail_cache.get_or_create(key, produce, suffix=".jpg")
+    
+    def cancel():
+        for key in keys:
+            thumbnail_cache.cancel(key)
+    
+    job_key = cache_key(remote_path, file_info, {"thumbnail": kind})
+    job = thumbnail_scheduler.submit(kind, remote_path, run, priority=priority, key=job_key)
+    if job.on_cancel is None:
+        job.on_cancel = cancel
+    return await thumbnail_scheduler.wait(job)
+
+async def prewarm_thumbnails(decoded_filename: str):
+    """目录预热：以低优先级生成封面（可选拖动预览）"""
+    remote_path, file_info = await stat_media(decoded_filename)
+    if file_info is None:
+        return
+    await thumbnail_file(decoded_filename, remote_path, file_info, "poster", PRIORITY_PREWARM)
+    if settings.thumbnail_prewarm_trickplay:
+        await thumbnail_file(decoded_filename, remote_path, file_info, "sprite", PRIORITY_PREWARM)
+
+async def thumbnail_response(request: Request, decoded_filename: str, kind: str):
+    remote_path, file_info = await stat_media(decoded_filename)
+    if file_info is None:
+        raise HTTPException(status_code=404, detail=f"File not found: {decoded_filename}")
+    try:
+        path = await thumbnail_file(decoded_filename, remote_path, file_info, kind)
+    except SchedulerBusy as e:
+        if kind == "poster":
+            # 不丢弃请求：转入预热队列排到队首，客户端按 Retry-After 重试时多半已命中缓存
+            thumbnail_prewarmer.enqueue([decoded_filename], urgent=True)
+        return busy_response(e)
+    except JobCancelled:
+        raise HTTPException(status_code=409, detail="Thumbnail generation was cancelled")
+    except TranscodeError as e:
+        logging.error(f"生成缩略图失败: {str(e)}")
+        raise HTTPException(status_code=422, detail=f"Thumbnail generation failed: {str(e)}")
+    return local_file_response(request, path, THUMBNAIL_CONTENT_TYPE)
+
+# 封面缩略图
+@app.get("/api/thumbnail/{filename:path}")
+async def get_thumbnail(request: Request, filename: str):
+    return await thumbnail_response(request, unquote(filename), "poster")
+
+# 拖动预览：雪碧图
+@app.get("/api/trickplay/{filename:path}/sprite.jpg")
+async def get_trickplay_sprite(request: Request, filename: str):
+    return await thumbnail_response(request, unquote(filename), "sprite")
+
+# 拖动预览：WebVTT 索引，只依赖探测结果，不等待雪碧图生成
+@app.get("/api/trickplay/{filename:path}/index.vtt")
+async def get_trickplay_vtt(filename: str):
+    decoded_filename = unquote(filename)
+    remote_path, file_info = await stat_media(decoded_filename)
+    if file_info is None:
+        raise HTTPException(status_code=404, detail=f"File not found: {decoded_filename}")
+    try:
+        info = await probe_file(decoded_filename, remote_path, file_info)
+    except TranscodeError as e:
+        raise HTTPException(status_code=422, detail=f"Probe failed: {str(e)}")
+    video = info.tracks_of('video')
+    if not video or info.duration <= 0:
+        raise HTTPException(status_code=404, detail=f"No video stream: {decoded_filename}")
+    width, height = scaled_size(settings.trickplay_width, video[0].width, video[0].height)
+    interval = trickplay_interval(info.duration, settings.trickplay_interval)
+    return Response(
+        content=build_vtt(info.duration, interval, width, height,
+                          f"/api/trickplay/{quote(decoded_filename)}/sprite.jpg"),
+        media_type=VTT_CONTENT_TYPE,
+    )
+
+# 媒体探测：不下载整个文件即可得到容器、编码、时长和轨道，并给出播放方式建议
+@app.get("/api/probe/{filename:path}")
+async def probe_route(filename: str):
+    decoded_filename = unquote(filename)
+    remote_path, file_info = await stat_media(decoded_filename)
+    if file_info is None:
+        raise HTTPException(status_code=404, detail=f"File not found: {decoded_filename}")
+    try:
+        info = await probe_file(decoded_filename, remote_path, file_info)
+    except TranscodeError as e:
+        logging.error(f"探测媒体信息失败: {str(e)}")
+        raise HTTPException(status_code=422, detail=f"Probe failed: {str(e)}")
+    plan = playback_plan(info, decoded_filename)
+    quoted = quote(decoded_filename)
+    return {
+        "filename": decoded_filename,
+        "size": file_info.size,
+        "etag": file_info.etag,
+        **info.to_dict(),
+        "decision": plan.decision,
+        "reason": plan.reason,
+        "urls": {
+            "direct": f"/api/stream-direct/{quoted}",
+            "converted": f"/api/converted/{quoted}",
+            "hls": f"/api/hls/{quoted}/index.m3u8",
+        },
+    }
+
+async def seek_index_file(remote_path: str, file_info: FileMeta) -> SeekIndex:
+    """建立关键帧索引，按路径和文件版本缓存；只范围读取容器的索引结构，远程文件经过块缓存"""
+    async def read_at(start: int, end: int) -> bytes:
+        if LocalStorage.owns(remote_path):
+            chunks = iter_file(LocalStorage.path_of(remote_path), start, end)
+        else:
+            chunks = block_reader.read(remote_path, file_info, start, end, flow)
+        return b"".join([chunk async for chunk in chunks])
+
+    async def build() -> SeekIndex:
+        logging.info(f"建立关键帧索引: {remote_path}")
+        return await build_index(read_at, file_info.size)
+
+    flow = bandwidth.open(CLASS_PLAYBACK)
+    try:
+        return await seek_index_cache.get_or_create((remote_path, file_version(file_info)), build)
+    finally:
+        bandwidth.close(flow)
+
+async def load_seek_index(decoded_filename: str):
+    remote_path, file_info = await stat_media(decoded_filename)
+    if file_info is None:
+        raise HTTPException(status_code=404, detail=f"File not found: {decoded_filename}")
+    try:
+        return remote_path, file_info, await seek_index_file(remote_path, file_info)
+    except SeekIndexError as e:
+        logging.error(f"建立关键帧索引失败: {str(e)}")
+        raise HTTPException(status_code=422, detail=f"Seek index unavailable: {str(e)}")
+    except UpstreamError as e:
+        logging.error(f"WebDAV请求失败: {e.status_code}")
+        metadata_cache.invalidate(remote_path)
+        raise HTTPException(status_code=502, detail=f"Upstream error: {e.status_code}")
+
+# 关键帧索引：时间（秒）与字节偏移一一对应，按时间升序；
+# 偏移是 /api/stream-direct 中的位置，虚拟 faststart 的文件已换算到重排后的布局
+@app.get("/api/seek-index/{filename:path}")
+async def seek_index_route(filename: str):
+    decoded_filename = unquote(filename)
+    remote_path, file_info, index = await load_seek_index(decoded_filename)
+    result = index.to_dict()
+    layout = await faststart_layout(decoded_filename, remote_path, file_info)
+    if layout is not None:
+        result["offsets"] = [layout.virtual_offset(offset) for offset in index.offsets]
+    return {"filename": decoded_filename, "size": file_info.size, **result}
+
+# 跳转预告：播放器跳转时调用，定位 t 之前最近的关键帧，并把到下一个关键帧为止的块读入缓存
+@app.get("/api/seek/{filename:path}")
+async def seek_hint(request: Request, filename: str, t: float = Query(..., ge=0)):
+    decoded_filename = unquote(filename)
+    remote_path, file_info, index = await load_seek_index(decoded_filename)
+    # 返回的范围按 /api/stream-direct 的布局，预热时换算回原文件中的范围
+    layout = await faststart_layout(decoded_filename, remote_path, file_info)
+    position = layout.virtual_offset if layout is not None else (lambda offset: offset)
+    at, after = index.lookup(t)
+    start = position(index.offsets[at])
+    end = position(index.offsets[after]) - 1 if after < len(index) else file_info.size - 1
+    end = max(start, min(end, file_info.size - 1))
+    blocks = 0
+    source = layout.source_range(start, end) if layout is not None else (start, end)
+    if not LocalStorage.owns(remote_path) and source is not None:
+        client_host = request.client.host if request.client else ""
+        blocks = prefetcher.on_seek(client_host, remote_path, file_info, *source)
+    return {
+        "filename": decoded_filename,
+        "time": t,
+        "keyframe_time": index.times[at],
+        "start": start,
+        "end": end,
+        "prefetch_blocks": blocks,
+    }
+
+# HLS 播放列表：按固定时长切分，分段在请求时按需生成
+@app.get("/api/hls/{filename:path}/index.m3u8")
+async def hls_playlist(filename: str):
+    decoded_filename = unquote(filename)
+    remote_path, file_info = await stat_media(decoded_filename)
+    if file_info is None:
+        raise HTTPException(status_code=404, detail=f"File not found: {decoded_filename}")
+    try:
+        duration = await hls_duration(decoded_filename, remote_path, file_info)
+    except TranscodeError as e:
+        logging.error(f"读取媒体时长失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Probe failed: {str(e)}")
+    return Response(
+        content=build_playlist(duration, settings.hls_segment_seconds),
+        media_type=PLAYLIST_CONTENT_TYPE,
+        headers={"Cache-Control": "no-cache"}
+    )
+
+# HLS 分段：命中缓存直接返回，否则优先生成该分段，并预生成后续分段
+@app.get("/api/hls/{filename:path}/segment/{index:int}.ts")
+async def hls_segment(request: Request, filename: str, index: int):
+    decoded_filename = unquote(filename)
+    remote_path, file_info = await stat_media(decoded_filename)
+    if file_info is None:
+        raise HTTPException(status_code=404, detail=f"File not found: {decoded_filename}")
+    try:
+        duration = await hls_duration(decoded_filename, remote_path, file_info)
+    except TranscodeError as e:
+        logging.error(f"读取媒体时长失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Probe failed: {str(e)}")
+    if index >= segment_count(duration, settings.hls_segment_seconds):
+        raise HTTPException(status_code=404, detail=f"Segment not found: {index}")
+    
+    segment_path = transcode_cache.lookup(hls_segment_key(remote_path, file_info, index), ".ts")
+    if segment_path is None:
+        try:
+            job = submit_hls_segment(decoded_filename, remote_path, file_info, duration, index)
+            prewarm_hls_segments(decoded_filename, remote_path, file_info, duration, index)
+            segment_path = await job_scheduler.wait(job)
+        except SchedulerBusy as e:
+            return busy_response(e)
+        except JobCancelled:
+            raise HTTPException(status_code=409, detail="Segment generation was cancelled")
+        except TranscodeError as e:
+            logging.error(f"生成HLS分段失败: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Segment generation failed: {str(e)}")
+    else:
+        prewarm_hls_segments(decoded_filename, remote_path, file_info, duration, index)
+    
+    return local_file_response(request, segment_path, SEGMENT_CONTENT_TYPE)
+
+# 提交后台转码任务（如预热即将播放的文件）
+@app.post("/api/jobs/transcode", status_code=202)
+async def submit_transcode_job(payload: dict = Body(...)):
+    filename = payload.get('filename')
+    priority_name = payload.get('priority', 'prewarm')
+    if not filename:
+        raise HTTPException(status_code=400, detail="Missing filename")
+    if priority_name not in PRIORITY_NAMES:
+        raise HTTPException(status_code=400, detail=f"Unknown priority: {priority_name}")
+    
+    remote_path, file_info = await stat_media(filename)
+    if file_info is None:
+        raise HTTPException(status_code=404, detail=f"File not found: {filename}")
+    
+    plan = await conversion_plan(filename, remote_path, file_info)
+    if plan.decision == DECISION_DIRECT:
+        return {"status": "direct", "filename": filename}
+    if transcode_cache.lookup(cache_key(remote_path, file_info, plan.options)) is not None:
+        return {"status": "cached", "filename": filename}
+    try:
+        job = submit_conversion(filename, remote_path, file_info, plan.options,
+                                priority=PRIORITY_NAMES[priority_name])
+    except SchedulerBusy as e:
+        return busy_response(e)
+    return job.to_dict()
+
+@app.get("/api/jobs")
+async def list_jobs():
+    return {"stats": job_scheduler.stats(), "jobs": job_scheduler.jobs()}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job.to_dict()
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = job_scheduler.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job.to_dict()
+
 # 如果存在本地静态文件目录，则提供静态文件服务
 if os.path.exists("./static"):
     app.mount("/static", StaticFiles(directory="static"), name="static")
\ No newline at end of file
@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+
+def normalize_etag(etag: str) -> str:
+    """去掉弱校验前缀和引号，便于比较 PROPFIND 与 GET 返回的 ETag
+
+    是否为弱校验由 is_weak_etag 单独判断，记录在 FileMeta.weak_etag 中。
+    """
+    etag = (etag or "").strip()
+    if etag.startswith("W/"):
+        etag = etag[2:]
+    return etag.strip('"')
+
+
+def is_weak_etag(etag: str) -> bool:
+    return (etag or "").strip().startswith("W/")
+
+
+@dataclass(frozen=True)
+class FileMeta:
+    """远程文件的元数据（来自 PROPFIND）"""
+    size: int
+    content_type: str = "application/octet-stream"
+    etag: str = ""          # 已规范化（无引号）
+    last_modified: str = ""
+    weak_etag: bool = False  # 上游 ETag 为弱校验（W/），不能用于 If-Range 等强比较
+
+
+class MetadataCache:
+    """按远程路径缓存 PROPFIND 结果的 LRU 缓存
+
+    - 正常条目在 ttl 秒后过期
+    - 404 结果以 None 记录，在 negative_ttl 秒后过期
+    - 超过 max_entries 时淘汰最久未使用的条目
+    """
+
+    def __init__(self, ttl: float = 60, negative_ttl: float = 10, max_entries: int = 4096):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # path -> (过期时间, FileMeta 或 None)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str) -> Tuple[bool, Optional[FileMeta]]:
+        """返回 (是否命中, 元数据)；命中且元数据为 None 表示文件不存在"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            expires, meta = entry
+            if expires <= now:
+                del self._entries[path]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return True, meta
+
+    def put(self, path: str, meta: Optional[FileMeta]):
+        """写入缓存；meta 为 None 时作为不存在记录"""
+        ttl = self.ttl if meta is not None else self.negative_ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[path] = (time.monotonic() + ttl, meta)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, path: Optional[str] = None, prefix: Optional[str] = None) -> int:
+        """删除指定路径、指定前缀或全部条目，返回删除数量"""
+        with self._lock:
+            if path is None and prefix is None:
+                count = len(self._entries)
+                self._entries.clear()
+                return count
+            keys = [k for k in self._entries
+                    if k == path or (prefix is not None and k.startswith(prefix))]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,143 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    path TEXT PRIMARY KEY,          -- 与 /api/metadata 的 filename 相同（相对 MEDIA_ROOT）
+    data TEXT NOT NULL,             -- JSON
+    title TEXT NOT NULL DEFAULT '',
+    version INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS metadata_title ON metadata (title COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS metadata_tags (
+    tag TEXT NOT NULL COLLATE NOCASE,
+    path TEXT NOT NULL,
+    PRIMARY KEY (tag, path)
+);
+CREATE INDEX IF NOT EXISTS metadata_tags_path ON metadata_tags (path);
+"""
+
+# 单条 SQL 中 IN (...) 的参数个数上限
+BATCH_SIZE = 500
+
+# 批量接口单次请求的最大条目数
+MAX_BATCH_ITEMS = 1000
+
+
+class InvalidMetadata(ValueError):
+    """元数据不是 JSON 对象，或含有无法保存为 JSON 的值（NaN、Infinity 等）"""
+
+
+class VersionConflict(Exception):
+    """写入时的版本号与当前版本不一致（乐观并发控制）"""
+
+    def __init__(self, conflicts: Dict[str, int]):
+        super().__init__(f"Version conflict: {', '.join(conflicts)}")
+        self.conflicts = conflicts      # path -> 当前版本（0 表示不存在）
+
+
+def _tags(metadata: dict) -> List[str]:
+    tags = metadata.get('tags') or []
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    return sorted({str(tag).strip() for tag in tags if str(tag).strip()})
+
+
+class MetadataStore:
+    """持久化的用户元数据（SQLite，WAL 模式）
+
+    - 每条记录带版本号，写入时可指定期望版本，不一致则抛出 VersionConflict
+    - 批量读写在一条事务内完成
+    - 多个 uvicorn worker 各自打开连接，由 SQLite 的文件锁协调写入
+    """
+
+    def __init__(self, db_path: str, busy_timeout: float = 5):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # 手动管理事务，写入使用 BEGIN IMMEDIATE，避免多进程并发升级写锁时失败
+        self._conn = sqlite3.connect(db_path, timeout=busy_timeout, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def get(self, path: str) -> Optional[Tuple[dict, int]]:
+        """返回 (元数据, 版本号)，不存在时返回 None"""
+        return self.get_many([path]).get(path)
+
+    def get_many(self, paths: Iterable[str]) -> Dict[str, Tuple[dict, int]]:
+        paths = list(dict.fromkeys(paths))
+        result = {}
+        with self._lock:
+            for i in range(0, len(paths), BATCH_SIZE):
+                chunk = paths[i:i + BATCH_SIZE]
+                rows = self._conn.execute(
+                    f"SELECT path, data, version FROM metadata WHERE path IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for row in rows:
+                    result[row["path"]] = (json.loads(row["data"]), row["version"])
+        return result
+
+    def put(self, path: str, metadata: dict, expected_version: Optional[int] = None) -> int:
+        """写入一条元数据并返回新版本号"""
+        return self.put_many([(path, metadata, expected_version)])[path]
+
+    def put_many(self, items: List[Tuple[str, dict, Optional[int]]]) -> Dict[str, int]:
+        """在一条事务内写入多条元数据，返回 path -> 新版本号
+
+        expected_version 为 None 时无条件写入，为 0 时要求记录不存在；
+        任意一条版本不一致时整批不写入并抛出 VersionConflict。
+        """
+        now = time.time()
+        versions = {}
+        # 事务之外先序列化，校验失败时不占用写锁
+        encoded = []
+        for path, metadata, _ in items:
+            if not isinstance(metadata, dict):
+                raise InvalidMetadata(f"Metadata for {path} must be an object")
+            try:
+                encoded.append(json.dumps(metadata, ensure_ascii=False, allow_nan=False))
+            except (TypeError, ValueError) as e:
+                raise InvalidMetadata(f"Metadata for {path} is not valid JSON: {e}")
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                conflicts = {}
+                for (path, metadata, expected), data in zip(items, encoded):
+                    row = self._conn.execute("SELECT version FROM metadata WHERE path = ?", (path,)).fetchone()
+                    current = row["version"] if row else 0
+                    if expected is not None and expected != current:
+                        conflicts[path] = current
+                        continue
+                    versions[path] = current + 1
+                    self._conn.execute(
+                        "INSERT INTO metadata (path, data, title, version, updated) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT (path) DO UPDATE SET data = excluded.data, title = excluded.title, "
+                        "version = excluded.version, updated = excluded.updated",
+                        (path, data, str(metadata.get('title') or ''),
+                         current + 1, now),
+                    )
+                    self._conn.execute("DELETE FROM metadata_tags WHERE path = ?", (path,))
+                    self._conn.executemany("INSERT OR IGNORE INTO metadata_tags (tag, path) VALUES (?, ?)",
+                                           [(tag, path) for tag in _tags(metadata)])
+                if conflicts:
+                    raise VersionConflict(conflicts)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return versions
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
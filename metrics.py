@@ -0,0 +1,281 @@
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 秒级延迟的默认桶：覆盖本地缓存命中（毫秒级）到慢速 NAS（数十秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# 转码等长任务的桶
+JOB_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+LabelValues = Tuple[str, ...]
+
+INF_LABEL = 'le="+Inf"'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Gauge(Counter):
+    """可增可减的瞬时值"""
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """分桶统计的观测值（延迟、耗时）"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelValues, list] = {}     # -> [各桶计数..., 总和, 总数]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(entry)) for key, entry in self._values.items())
+        lines = self.header()
+        for key, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, INF_LABEL)} {entry[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(entry[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {entry[-1]}")
+        return lines
+
+
+class Callback(_Metric):
+    """抓取时才读取的值，用于已有 stats() 中的计数和队列深度
+
+    fn 返回单个数值，或 {标签值元组: 数值}。
+    """
+
+    def __init__(self, kind: str, name: str, documentation: str,
+                 fn: Callable[[], Union[float, Dict[LabelValues, float]]], labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Registry:
+    """指标注册表，按 Prometheus 文本格式输出"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Duplicate metric: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, kind: str, name: str, documentation: str, fn: Callable,
+                 labelnames: Tuple[str, ...] = ()) -> Callback:
+        return self._register(Callback(kind, name, documentation, fn, labelnames))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# 进程内共享的注册表；各模块在导入时定义自己的指标
+REGISTRY = Registry()
+
+# ---- HTTP ----
+
+HTTP_DURATION = REGISTRY.histogram(
+    "noediv_http_request_duration_seconds",
+    "HTTP request duration until the response body completes",
+    ("method", "handler", "status"),
+)
+HTTP_TTFB = REGISTRY.histogram(
+    "noediv_http_time_to_first_byte_seconds",
+    "Time from request start to the first response body byte",
+    ("handler",),
+)
+HTTP_BYTES = REGISTRY.counter(
+    "noediv_http_response_bytes_total",
+    "Response body bytes sent to clients",
+    ("handler",),
+)
+HTTP_IN_PROGRESS = REGISTRY.gauge(
+    "noediv_http_requests_in_progress",
+    "Requests currently being served, including active streams",
+    ("handler",),
+)
+
+# ---- 上游 ----
+
+UPSTREAM_DURATION = REGISTRY.histogram(
+    "noediv_upstream_request_duration_seconds",
+    "Upstream request latency (listing/stat until the full response, GET/RETR until the transfer starts)",
+    ("protocol", "method", "status"),
+)
+UPSTREAM_BYTES = REGISTRY.counter(
+    "noediv_upstream_bytes_total",
+    "Media bytes read from upstream servers",
+    ("protocol",),
+)
+
+
+def _handler(scope) -> str:
+    """路由匹配后的处理函数名，作为低基数的标签"""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    return getattr(endpoint, "__name__", type(endpoint).__name__)
+
+
+class MetricsMiddleware:
+    """记录每个请求的耗时、首字节时间、发送字节数和进行中的请求数
+
+    以纯 ASGI 中间件实现，不缓冲响应体，流式响应照常逐块发送。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.monotonic()
+        status = 500
+        first_byte: Optional[float] = None
+        sent = 0
+        # 处理函数在路由匹配后才确定，进行中计数在响应开始时加入
+        counted = None
+
+        async def send_wrapper(message):
+            nonlocal status, first_byte, sent, counted
+            kind = message["type"]
+            if kind == "http.response.start":
+                status = message["status"]
+                counted = _handler(scope)
+                HTTP_IN_PROGRESS.inc(handler=counted)
+            elif kind == "http.response.body":
+                size = len(message.get("body", b""))
+                if size and first_byte is None:
+                    first_byte = time.monotonic()
+                sent += size
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            handler = _handler(scope)
+            if counted is not None:
+                HTTP_IN_PROGRESS.dec(handler=counted)
+            HTTP_DURATION.observe(time.monotonic() - started, method=scope["method"], handler=handler,
+                                  status=str(status))
+            if first_byte is not None:
+                HTTP_TTFB.observe(first_byte - started, handler=handler)
+            if sent:
+                HTTP_BYTES.inc(sent, handler=handler)
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from blockcache import CachedReader
+from metacache import FileMeta
+from shaping import CLASS_BACKGROUND, CLASS_PLAYBACK
+
+
+class _Session:
+    __slots__ = ("next_offset", "sequential", "task", "prefetched_to", "touched")
+
+    def __init__(self):
+        self.next_offset = -1        # 顺序读取时下一次请求的预期起点
+        self.sequential = 0          # 连续顺序请求次数
+        self.task: Optional[asyncio.Task] = None
+        self.prefetched_to = -1      # 已预读到的块序号
+        self.touched = time.monotonic()
+
+
+class Prefetcher:
+    """按 (客户端, 文件) 检测顺序播放，并在后台把后续若干块预读进块缓存
+
+    - 连续 min_sequential 次顺序请求后才开始预读
+    - 发生跳转（seek）时取消该会话正在进行的预读
+    - 全局最多 max_concurrent 个预读任务，超出时直接跳过而不是排队
+    - 客户端预告跳转（on_seek）时，立即读取目标关键帧所在的块，最多 max_seek_blocks 块
+    """
+
+    def __init__(self, reader: CachedReader, blocks_ahead: int = 4, max_concurrent: int = 4,
+                 min_sequential: int = 2, max_sessions: int = 1024, session_ttl: float = 300,
+                 max_seek_blocks: int = 16):
+        self.reader = reader
+        self.blocks_ahead = blocks_ahead
+        self.max_concurrent = max_concurrent
+        self.min_sequential = min_sequential
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.max_seek_blocks = max_seek_blocks
+        self._sessions = OrderedDict()
+        self._running = 0
+        self.prefetched_blocks = 0
+        self.cancelled = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.blocks_ahead > 0 and self.reader.cache.enabled
+
+    def _session(self, key: Hashable) -> _Session:
+        now = time.monotonic()
+        session = self._sessions.get(key)
+        if session is None:
+            session = _Session()
+            self._sessions[key] = session
+        self._sessions.move_to_end(key)
+        session.touched = now
+        # 清理过期或超量的会话
+        while self._sessions:
+            oldest_key, oldest = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - oldest.touched < self.session_ttl:
+                break
+            self._cancel(oldest)
+            del self._sessions[oldest_key]
+        return session
+
+    def _cancel(self, session: _Session):
+        if session.task is not None and not session.task.done():
+            session.task.cancel()
+            self.cancelled += 1
+        session.task = None
+        session.prefetched_to = -1
+
+    def on_read(self, key: Hashable, path: str, meta: FileMeta, start: int, end: int,
+                reader: Optional[CachedReader] = None):
+        """记录一次范围读取，必要时启动后台预读；reader 用于其他上游（如 FTP）的读取器"""
+        if not self.enabled:
+            return
+        session = self._session((key, path))
+        block_size = self.reader.cache.block_size
+        # 允许一个块以内的重叠或空隙，浏览器的请求边界并不总是严格衔接
+        if session.next_offset >= 0 and abs(start - session.next_offset) <= block_size:
+            session.sequential += 1
+        else:
+            if session.sequential:
+                logging.info(f"检测到跳转，取消预读: {path} @ {start}")
+            self._cancel(session)
+            session.sequential = 0
+        session.next_offset = end + 1
+
+        if session.sequential < self.min_sequential or end + 1 >= meta.size:
+            return
+        if session.task is not None and not session.task.done():
+            return
+        first = (end + 1) // block_size
+        last = first + self.blocks_ahead - 1
+        first = max(first, session.prefetched_to + 1)
+        if first > last or self._running >= self.max_concurrent:
+            return
+        session.task = asyncio.get_running_loop().create_task(
+            self._prefetch(reader or self.reader, session, path, meta, first, last)
+        )
+
+    def on_seek(self, key: Hashable, path: str, meta: FileMeta, start: int, end: int,
+                reader: Optional[CachedReader] = None) -> int:
+        """客户端即将跳转到 start：取消该会话原有的预读，立即把 [start, end] 所在的块读入缓存
+
+        随后从 start 开始的范围请求按顺序读取计数，预读照常接续。返回计划读取的块数。
+        """
+        if not self.enabled:
+            return 0
+        session = self._session((key, path))
+        self._cancel(session)
+        session.sequential = 0
+        session.next_offset = start
+        block_size = self.reader.cache.block_size
+        first = start // block_size
+        last = min(end // block_size, first + self.max_seek_blocks - 1, (meta.size - 1) // block_size)
+        session.task = asyncio.get_running_loop().create_task(
+            self._prefetch(reader or self.reader, session, path, meta, first, last, CLASS_PLAYBACK)
+        )
+        return last - first + 1
+
+    async def _prefetch(self, reader: CachedReader, session: _Session, path: str, meta: FileMeta,
+                        first: int, last: int, kind: str = CLASS_BACKGROUND):
+        self._running += 1
+        # 预读只使用播放流用剩的上游带宽；客户端明确要跳转的位置按播放流读取
+        flow = reader.shaper.open(kind)
+        try:
+            fetched = await reader.warm(path, meta, first, last, flow)
+            session.prefetched_to = last
+            self.prefetched_blocks += fetched
+        except Exception as e:
+            # 预读失败不影响正常播放
+            logging.warning(f"预读失败: {path} [{first}-{last}]: {str(e)}")
+        finally:
+            reader.shaper.close(flow)
+            self._running -= 1
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "sessions": len(self._sessions),
+            "running": self._running,
+            "prefetched_blocks": self.prefetched_blocks,
+            "cancelled": self.cancelled,
+        }
+
+    async def aclose(self):
+        tasks = [s.task for s in self._sessions.values() if s.task is not None and not s.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._sessions.clear()
@@ -0,0 +1,201 @@
+import os
+from dataclasses import asdict, dataclass
+from typing import Awaitable, Callable, Hashable, List, Optional, Tuple
+
+from asynccache import AsyncLRUCache
+from transcode import COPY_OPTIONS, DEFAULT_ENCODE_OPTIONS
+
+# 浏览器可直接播放的容器（ffprobe format_name 中的名称）
+DIRECT_CONTAINERS = {"mp4", "mov", "webm", "mp3", "ogg", "flac", "wav"}
+
+# MP4 中浏览器普遍支持的视频编码；H.264 仅限 8 位 4:2:0
+BROWSER_VIDEO_CODECS = {"h264", "vp8", "vp9", "av1"}
+BROWSER_PIX_FMTS = {"yuv420p", "yuvj420p"}
+BROWSER_AUDIO_CODECS = {"aac", "mp3", "opus", "vorbis", "flac"}
+
+# 可以原样复制进 MP4 且浏览器能解码的编码（VP8、Vorbis 只在 WebM 中可用）
+MP4_VIDEO_CODECS = {"h264", "vp9", "av1"}
+MP4_AUDIO_CODECS = {"aac", "mp3", "opus", "flac"}
+
+# 播放方式，按开销从低到高：直接播放 / 仅重新封装为 MP4 / 只转码音频 / 完整转码
+DECISION_DIRECT = "direct"
+DECISION_REMUX = "remux"
+DECISION_AUDIO = "transcode_audio"
+DECISION_TRANSCODE = "transcode"
+
+# 重新封装：复制音视频流；字幕多为 MP4 不支持的格式，直接丢弃
+REMUX_OPTIONS = dict(COPY_OPTIONS, sn=None)
+
+# 只转码音频（如 AC3/DTS/TrueHD）：视频原样复制，音频转为双声道 AAC
+AUDIO_TRANSCODE_OPTIONS = {
+    'vcodec': 'copy',
+    'acodec': 'aac',
+    'audio_bitrate': '128k',
+    'ac': 2,
+    'sn': None,
+}
+
+
+@dataclass(frozen=True)
+class Track:
+    """单条媒体流"""
+    index: int
+    type: str                       # video / audio / subtitle / data
+    codec: str
+    profile: str = ""
+    language: str = ""
+    title: str = ""
+    default: bool = False
+    bit_rate: int = 0
+    width: int = 0
+    height: int = 0
+    frame_rate: float = 0
+    pix_fmt: str = ""
+    channels: int = 0
+    sample_rate: int = 0
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    """ffprobe 结果中播放决策所需的部分"""
+    container: str                  # format_name，如 "matroska,webm"
+    duration: float
+    bit_rate: int
+    tracks: Tuple[Track, ...]
+
+    def tracks_of(self, kind: str) -> List[Track]:
+        return [track for track in self.tracks if track.type == kind]
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _frame_rate(value: str) -> float:
+    """把 ffprobe 的 "24000/1001" 形式转换为浮点数"""
+    num, _, den = (value or "").partition('/')
+    if _float(den or 1) == 0:
+        return 0.0
+    return round(_float(num) / _float(den or 1), 3)
+
+
+def parse_probe(data: dict) -> MediaInfo:
+    """把 ffprobe -show_format -show_streams 的 JSON 转换为 MediaInfo"""
+    fmt = data.get('format') or {}
+    tracks = []
+    for stream in data.get('streams') or []:
+        kind = stream.get('codec_type') or 'data'
+        # 封面图在 ffprobe 中表现为视频流，不计入播放决策
+        if kind == 'video' and (stream.get('disposition') or {}).get('attached_pic'):
+            continue
+        tags = stream.get('tags') or {}
+        tracks.append(Track(
+            index=_int(stream.get('index')),
+            type=kind,
+            codec=stream.get('codec_name') or '',
+            profile=stream.get('profile') or '',
+            language=tags.get('language') or '',
+            title=tags.get('title') or '',
+            default=bool((stream.get('disposition') or {}).get('default')),
+            bit_rate=_int(stream.get('bit_rate')),
+            width=_int(stream.get('width')),
+            height=_int(stream.get('height')),
+            frame_rate=_frame_rate(stream.get('avg_frame_rate') or stream.get('r_frame_rate')),
+            pix_fmt=stream.get('pix_fmt') or '',
+            channels=_int(stream.get('channels')),
+            sample_rate=_int(stream.get('sample_rate')),
+        ))
+    return MediaInfo(
+        container=fmt.get('format_name') or '',
+        duration=_float(fmt.get('duration')),
+        bit_rate=_int(fmt.get('bit_rate')),
+        tracks=tuple(tracks),
+    )
+
+
+def _primary(tracks: List[Track]) -> Optional[Track]:
+    """浏览器播放的轨道：标记为默认的轨道，否则第一条"""
+    for track in tracks:
+        if track.default:
+            return track
+    return tracks[0] if tracks else None
+
+
+@dataclass(frozen=True)
+class PlaybackPlan:
+    """播放方式及对应的 ffmpeg 输出参数（直接播放时为 None）"""
+    decision: str
+    reason: str
+    options: Optional[dict] = None
+
+
+def _video_ok(track: Optional[Track], codecs: set) -> bool:
+    if track is None:
+        return True
+    # 10 位或 4:4:4 的 H.264 浏览器普遍无法硬件解码
+    return track.codec in codecs and (track.codec != 'h264' or track.pix_fmt in BROWSER_PIX_FMTS)
+
+
+def _audio_ok(track: Optional[Track], codecs: set) -> bool:
+    return track is None or track.codec in codecs
+
+
+def _direct_container(info: MediaInfo, filename: str) -> bool:
+    names = set(info.container.split(','))
+    # Matroska 与 WebM 在 ffprobe 中不区分，只有 .webm 文件按 WebM 直接播放
+    if 'matroska' in names and os.path.splitext(filename)[1].lower() != '.webm':
+        names.discard('webm')
+    return bool(names & DIRECT_CONTAINERS)
+
+
+def playback_plan(info: MediaInfo, filename: str) -> PlaybackPlan:
+    """选择开销最低的播放方式
+
+    只检查浏览器实际播放的轨道（默认轨道，否则第一条）：
+    容器和编码都可用时直接播放；编码可用时只重新封装；
+    仅音频不可用时复制视频、转码音频；否则完整转码。
+    """
+    video = _primary(info.tracks_of('video'))
+    audio = _primary(info.tracks_of('audio'))
+    if video is None and audio is None:
+        return PlaybackPlan(DECISION_TRANSCODE, "no audio or video stream", DEFAULT_ENCODE_OPTIONS)
+
+    if (_direct_container(info, filename)
+            and _video_ok(video, BROWSER_VIDEO_CODECS) and _audio_ok(audio, BROWSER_AUDIO_CODECS)):
+        return PlaybackPlan(DECISION_DIRECT, f"container {info.container}")
+
+    if _video_ok(video, MP4_VIDEO_CODECS):
+        if _audio_ok(audio, MP4_AUDIO_CODECS):
+            return PlaybackPlan(DECISION_REMUX, f"container {info.container}", REMUX_OPTIONS)
+        return PlaybackPlan(DECISION_AUDIO, f"audio codec {audio.codec}", AUDIO_TRANSCODE_OPTIONS)
+
+    reason = f"video codec {video.codec}"
+    options = DEFAULT_ENCODE_OPTIONS
+    if video.pix_fmt and video.pix_fmt not in BROWSER_PIX_FMTS:
+        reason = f"video codec {video.codec} ({video.pix_fmt})"
+        # libx264 默认保留源像素格式，10 位输入会得到浏览器无法播放的 High 10
+        options = dict(DEFAULT_ENCODE_OPTIONS, pix_fmt='yuv420p')
+    return PlaybackPlan(DECISION_TRANSCODE, reason, options)
+
+
+class ProbeCache(AsyncLRUCache[MediaInfo]):
+    """探测结果缓存，键包含文件版本，文件变化后自然失效
+
+    同一文件的并发探测只执行一次，其余请求等待同一个结果。
+    """
+
+    async def get_or_probe(self, key: Hashable, probe: Callable[[], Awaitable[MediaInfo]]) -> MediaInfo:
+        return await self.get_or_create(key, probe)
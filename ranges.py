@@ -0,0 +1,156 @@
+import secrets
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Hashable, List, Optional
+
+# 单个请求最多处理的区间数，超出时合并为一个覆盖区间
+MAX_RANGES = 32
+
+
+class RangeNotSatisfiable(Exception):
+    """所有请求区间都超出文件范围，应返回 416"""
+
+
+class ByteRange:
+    """一个闭区间字节范围；open_ended 表示客户端未指定结束位置（bytes=a-）"""
+    __slots__ = ("start", "end", "open_ended")
+
+    def __init__(self, start: int, end: int, open_ended: bool = False):
+        self.start = start
+        self.end = end
+        self.open_ended = open_ended
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start + 1
+
+    def __repr__(self):
+        return f"ByteRange({self.start}, {self.end}{', open' if self.open_ended else ''})"
+
+
+def parse_range_header(header: Optional[str], size: int) -> Optional[List[ByteRange]]:
+    """按 RFC 9110 解析 Range 头
+
+    返回 None 表示没有或无法识别的 Range 头（应返回完整文件）；
+    所有区间都不可满足时抛出 RangeNotSatisfiable。
+    支持 bytes=a-b、bytes=a-、bytes=-N 以及逗号分隔的多个区间。
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition("-")
+        first, last = first.strip(), last.strip()
+        if not sep or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            # 后缀区间：最后 N 个字节
+            if not last:
+                return None
+            suffix = int(last)
+            if suffix == 0:
+                continue
+            ranges.append(ByteRange(max(size - suffix, 0), size - 1))
+            continue
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            continue
+        if last:
+            ranges.append(ByteRange(start, min(int(last), size - 1)))
+        else:
+            ranges.append(ByteRange(start, size - 1, open_ended=True))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+    if len(ranges) > MAX_RANGES:
+        return [ByteRange(min(r.start for r in ranges), max(r.end for r in ranges))]
+    return _coalesce(ranges)
+
+
+def _coalesce(ranges: List[ByteRange]) -> List[ByteRange]:
+    """合并重叠或相邻的区间，避免重复传输相同字节"""
+    if len(ranges) == 1:
+        return ranges
+    ordered = sorted(ranges, key=lambda r: r.start)
+    merged = [ordered[0]]
+    for r in ordered[1:]:
+        last = merged[-1]
+        if r.start <= last.end + 1:
+            merged[-1] = ByteRange(last.start, max(last.end, r.end), last.open_ended or r.open_ended)
+        else:
+            merged.append(r)
+    return merged
+
+
+class SpanPolicy:
+    """开放区间（bytes=a-）的自适应截断策略
+
+    同一客户端对同一文件连续顺序读取时，每次把返回长度翻倍直至 max_span；
+    发生跳转后回落到 min_span，让 seek 后的首包尽快返回。
+    """
+
+    def __init__(self, min_span: int = 1024 * 1024, max_span: int = 16 * 1024 * 1024,
+                 max_sessions: int = 1024, session_ttl: float = 300):
+        self.min_span = min_span
+        self.max_span = max(max_span, min_span)
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self._sessions = OrderedDict()   # key -> (下一次预期起点, 当前跨度, 更新时间)
+
+    def clip(self, key: Hashable, byte_range: ByteRange) -> ByteRange:
+        """按会话状态截断开放区间，并记录本次读取位置"""
+        now = time.monotonic()
+        next_offset, span, _ = self._sessions.pop(key, (-1, self.min_span, now))
+        if byte_range.open_ended:
+            if byte_range.start == next_offset:
+                span = min(span * 2, self.max_span)
+            else:
+                span = self.min_span
+            byte_range = ByteRange(byte_range.start, min(byte_range.start + span - 1, byte_range.end), True)
+        self._sessions[key] = (byte_range.end + 1, span, now)
+        while self._sessions:
+            oldest_key, (_, _, touched) = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - touched < self.session_ttl:
+                break
+            del self._sessions[oldest_key]
+        return byte_range
+
+
+class MultipartByteranges:
+    """multipart/byteranges 响应体的构造"""
+
+    def __init__(self, ranges: List[ByteRange], size: int, content_type: str):
+        self.ranges = ranges
+        self.boundary = secrets.token_hex(16)
+        self.content_type = f"multipart/byteranges; boundary={self.boundary}"
+        self._part_headers = [
+            (f"--{self.boundary}\r\n"
+             f"Content-Type: {content_type}\r\n"
+             f"Content-Range: bytes {r.start}-{r.end}/{size}\r\n\r\n").encode("latin-1")
+            for r in ranges
+        ]
+        self._trailer = f"--{self.boundary}--\r\n".encode("latin-1")
+
+    @property
+    def content_length(self) -> int:
+        body = sum(r.length for r in self.ranges)
+        framing = sum(len(h) + 2 for h in self._part_headers) + len(self._trailer)
+        return body + framing
+
+    async def iter_body(self, read: Callable[[int, int], AsyncIterator[bytes]]) -> AsyncIterator[bytes]:
+        """read(start, end) 返回对应区间的字节流"""
+        for header, r in zip(self._part_headers, self.ranges):
+            yield header
+            async for chunk in read(r.start, r.end):
+                yield chunk
+            yield b"\r\n"
+        yield self._trailer
@@ -0,0 +1,481 @@
+import bisect
+import struct
+import sys
+from array import array
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+# read_at(start, end) -> 文件的 [start, end] 字节（闭区间），经块缓存的范围读取
+ReadAt = Callable[[int, int], Awaitable[bytes]]
+
+# 为建立索引最多读取的头部数据量（moov、Cues、idx1）
+MAX_INDEX_BYTES = 64 * 1024 * 1024
+
+# 没有关键帧表（全部为关键帧）时，索引点的最小间隔（秒）
+MIN_POINT_INTERVAL = 1.0
+
+# 定位顶层结构时每次读取的长度
+HEADER_READ = 64 * 1024
+
+
+class SeekIndexError(Exception):
+    """文件结构无法识别或没有可用的索引"""
+
+
+@dataclass
+class SeekIndex:
+    """关键帧时间 -> 字节偏移表，按时间升序"""
+    container: str
+    duration: float = 0.0
+    times: array = field(default_factory=lambda: array('d'))
+    offsets: array = field(default_factory=lambda: array('q'))
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def add(self, time: float, offset: int):
+        self.times.append(time)
+        self.offsets.append(offset)
+
+    def finish(self) -> "SeekIndex":
+        """按时间排序、去掉重复时间点"""
+        points = sorted(set(zip(self.times, self.offsets)))
+        self.times = array('d')
+        self.offsets = array('q')
+        for time, offset in points:
+            if self.times and time == self.times[-1]:
+                continue
+            self.add(time, offset)
+        return self
+
+    def lookup(self, time: float) -> Optional[Tuple[int, int]]:
+        """返回不晚于 time 的关键帧下标，以及其后第一个晚于 time 的关键帧下标（没有时为 len）"""
+        if not self.times:
+            return None
+        at = max(bisect.bisect_right(self.times, time) - 1, 0)
+        after = bisect.bisect_right(self.times, time, lo=at + 1)
+        return at, after
+
+    def to_dict(self) -> dict:
+        return {
+            "container": self.container,
+            "duration": self.duration,
+            "keyframes": len(self),
+            "times": [round(t, 3) for t in self.times],
+            "offsets": list(self.offsets),
+        }
+
+
+async def build_index(read_at: ReadAt, size: int) -> SeekIndex:
+    """按文件头识别容器并建立索引：MP4/MOV（moov 采样表）、Matroska/WebM（Cues）、AVI（idx1）"""
+    head = await read_at(0, min(HEADER_READ, size) - 1)
+    try:
+        if head[4:8] in (b'ftyp', b'moov', b'free', b'mdat', b'wide', b'skip'):
+            index = await _mp4_index(read_at, size, head)
+        elif head[:4] == b'\x1a\x45\xdf\xa3':
+            index = await _mkv_index(read_at, size, head)
+        elif head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+            index = await _avi_index(read_at, size)
+        else:
+            raise SeekIndexError("Unsupported container")
+    except (struct.error, IndexError) as e:
+        # 截断或损坏的结构：字段越界
+        raise SeekIndexError(f"Malformed container: {e}") from e
+    if not len(index):
+        raise SeekIndexError(f"No keyframe index in {index.container}")
+    return index.finish()
+
+
+# ---- MP4 / MOV ----
+
+def mp4_boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[bytes, int, int]]:
+    """遍历 [start, end) 中的 box，返回 (类型, 内容起点, 内容终点)"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def mp4_child(data: bytes, start: int, end: int, path: List[bytes]) -> Optional[Tuple[int, int]]:
+    """按路径查找嵌套 box，返回内容范围"""
+    for kind, body_start, body_end in mp4_boxes(data, start, end):
+        if kind == path[0]:
+            if len(path) == 1:
+                return body_start, body_end
+            return mp4_child(data, body_start, body_end, path[1:])
+    return None
+
+
+def _table(data: bytes, body: Tuple[int, int], fmt: str, columns: int, header: int = 8) -> array:
+    """读取 full box 中的大端整数表（跳过版本/标志和条目数）；条目数超出 box 时只取 box 内的完整条目"""
+    start, end = body
+    count = struct.unpack_from('>I', data, start + 4)[0]
+    values = array(fmt)
+    width = columns * values.itemsize
+    count = min(count, max(end - start - header, 0) // width)
+    values.frombytes(data[start + header:start + header + count * width])
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+
+async def mp4_top_level(read_at: ReadAt, size: int, head: bytes) -> AsyncIterator[Tuple[bytes, int, int]]:
+    """遍历文件的顶层 box，返回 (类型, 起点, 终点)；头部之外的 box 只读取其 16 字节的头"""
+    pos = 0
+    while pos + 8 <= size:
+        if pos + 16 <= len(head):
+            header = head[pos:pos + 16]
+        else:
+            header = await read_at(pos, min(pos + 16, size) - 1)
+        if len(header) < 8:
+            return
+        box_size, box_kind = struct.unpack_from('>I4s', header)
+        if box_size == 1 and len(header) >= 16:
+            box_size = struct.unpack_from('>Q', header, 8)[0]
+        elif box_size == 0:
+            box_size = size - pos
+        if box_size < 8:
+            return
+        yield box_kind, pos, min(pos + box_size, size)
+        pos += box_size
+
+
+async def _mp4_index(read_at: ReadAt, size: int, head: bytes) -> SeekIndex:
+    found = None
+    async for kind, box_start, box_end in mp4_top_level(read_at, size, head):
+        if kind == b'moov':
+            found = box_start, box_end
+            break
+    if found is None:
+        raise SeekIndexError("No moov box")
+    start, end = found
+    if end - start > MAX_INDEX_BYTES:
+        raise SeekIndexError("moov box too large")
+    moov = head[start:end] if end <= len(head) else await read_at(start, end - 1)
+    index = SeekIndex("mp4")
+
+    body = next(((s, e) for kind, s, e in mp4_boxes(moov, 0, len(moov)) if kind == b'moov'), None)
+    if body is None:
+        raise SeekIndexError("Malformed moov box")
+    mvhd = mp4_child(moov, body[0], body[1], [b'mvhd'])
+    if mvhd is not None:
+        version = moov[mvhd[0]]
+        if version == 1:
+            timescale, duration = struct.unpack_from('>IQ', moov, mvhd[0] + 20)
+        else:
+            timescale, duration = struct.unpack_from('>II', moov, mvhd[0] + 12)
+        if timescale:
+            index.duration = duration / timescale
+
+    for kind, trak_start, trak_end in mp4_boxes(moov, body[0], body[1]):
+        if kind != b'trak':
+            continue
+        hdlr = mp4_child(moov, trak_start, trak_end, [b'mdia', b'hdlr'])
+        if hdlr is None or moov[hdlr[0] + 8:hdlr[0] + 12] != b'vide':
+            continue
+        _mp4_track(moov, trak_start, trak_end, index)
+        break
+    return index
+
+
+def _mp4_track(moov: bytes, trak_start: int, trak_end: int, index: SeekIndex):
+    mdhd = mp4_child(moov, trak_start, trak_end, [b'mdia', b'mdhd'])
+    stbl = mp4_child(moov, trak_start, trak_end, [b'mdia', b'minf', b'stbl'])
+    if mdhd is None or stbl is None:
+        return
+    version = moov[mdhd[0]]
+    timescale = struct.unpack_from('>I', moov, mdhd[0] + (20 if version == 1 else 12))[0] or 1
+
+    boxes = {kind: (s, e) for kind, s, e in mp4_boxes(moov, stbl[0], stbl[1])}
+    if b'stts' not in boxes or b'stsc' not in boxes or b'stsz' not in boxes:
+        return
+    if b'stco' in boxes:
+        chunk_offsets = _table(moov, boxes[b'stco'], 'I', 1)
+    elif b'co64' in boxes:
+        chunk_offsets = _table(moov, boxes[b'co64'], 'Q', 1)
+    else:
+        return
+    stts = _table(moov, boxes[b'stts'], 'I', 2)
+    stsc = _table(moov, boxes[b'stsc'], 'I', 3)
+    stsz_start = boxes[b'stsz'][0]
+    uniform_size, sample_count = struct.unpack_from('>II', moov, stsz_start + 4)
+    sizes = None if uniform_size else _table(moov, (stsz_start + 4, boxes[b'stsz'][1]), 'I', 1)
+    # stss 缺失表示每个采样都是关键帧
+    sync = set(_table(moov, boxes[b'stss'], 'I', 1)) if b'stss' in boxes else None
+
+    # 解码时间：stts 的 (采样数, 时长) 展开
+    sample_times = array('d')
+    elapsed = 0
+    for i in range(0, len(stts) - 1, 2):
+        count, delta = stts[i], stts[i + 1]
+        for _ in range(count):
+            sample_times.append(elapsed / timescale)
+            elapsed += delta
+
+    # 采样 -> 块：stsc 的 (起始块, 每块采样数, 描述索引)，块号从 1 开始
+    sample = 0
+    last_point = -MIN_POINT_INTERVAL
+    entries = [(stsc[i], stsc[i + 1]) for i in range(0, len(stsc) - 2, 3)]
+    for n, (first_chunk, per_chunk) in enumerate(entries):
+        next_first = entries[n + 1][0] if n + 1 < len(entries) else len(chunk_offsets) + 1
+        for chunk in range(first_chunk, next_first):
+            if chunk - 1 >= len(chunk_offsets):
+                return
+            offset = chunk_offsets[chunk - 1]
+            for _ in range(per_chunk):
+                if sample >= sample_count or sample >= len(sample_times):
+                    return
+                time = sample_times[sample]
+                if (sync is None and time - last_point >= MIN_POINT_INTERVAL) or (sync is not None and sample + 1 in sync):
+                    index.add(time, offset)
+                    last_point = time
+                offset += uniform_size or sizes[sample]
+                sample += 1
+
+
+# ---- Matroska / WebM ----
+
+MKV_SEGMENT = 0x18538067
+MKV_SEEKHEAD = 0x114D9B74
+MKV_SEEK = 0x4DBB
+MKV_SEEK_ID = 0x53AB
+MKV_SEEK_POSITION = 0x53AC
+MKV_INFO = 0x1549A966
+MKV_TIMESTAMP_SCALE = 0x2AD7B1
+MKV_DURATION = 0x4489
+MKV_TRACKS = 0x1654AE6B
+MKV_TRACK_ENTRY = 0xAE
+MKV_TRACK_NUMBER = 0xD7
+MKV_TRACK_TYPE = 0x83
+MKV_CUES = 0x1C53BB6B
+MKV_CUE_POINT = 0xBB
+MKV_CUE_TIME = 0xB3
+MKV_CUE_TRACK_POSITIONS = 0xB7
+MKV_CUE_TRACK = 0xF7
+MKV_CUE_CLUSTER_POSITION = 0xF1
+MKV_CLUSTER = 0x1F43B675
+
+
+def _vint(data: bytes, pos: int, keep_marker: bool) -> Tuple[int, int]:
+    """读取 EBML 变长整数，返回 (值, 长度)；大小全为 1 时返回 -1（未知大小）"""
+    first = data[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8 or pos + length > len(data):
+        raise SeekIndexError("Malformed EBML")
+    value = first if keep_marker else first & (mask - 1)
+    for b in data[pos + 1:pos + length]:
+        value = (value << 8) | b
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        value = -1
+    return value, length
+
+
+def _elements(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, int, int]]:
+    """遍历 [start, end) 中的 EBML 元素，返回 (ID, 内容起点, 内容终点)；遇到截断的元素时停止"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos < end:
+        try:
+            element_id, id_length = _vint(data, pos, True)
+            size, size_length = _vint(data, pos + id_length, False)
+        except (SeekIndexError, IndexError):
+            return
+        body = pos + id_length + size_length
+        if size < 0:
+            # 未知大小（直播写入的 Segment/Cluster），只报告起点
+            yield element_id, body, -1
+            return
+        yield element_id, body, body + size
+        pos = body + size
+
+
+def _uint(data: bytes, start: int, end: int) -> int:
+    return int.from_bytes(data[start:end], 'big')
+
+
+def _float(data: bytes, start: int, end: int) -> float:
+    if end - start == 4:
+        return struct.unpack('>f', data[start:end])[0]
+    if end - start == 8:
+        return struct.unpack('>d', data[start:end])[0]
+    return 0.0
+
+
+async def _mkv_element(read_at: ReadAt, size: int, pos: int, expected: int) -> Optional[bytes]:
+    """读取位于 pos 的完整元素内容（ID 必须为 expected）"""
+    header = await read_at(pos, min(pos + 12, size) - 1)
+    for element_id, body, body_end in _elements(header):
+        if element_id != expected or body_end < 0 or body_end - body > MAX_INDEX_BYTES:
+            return None
+        if pos + body_end > size:
+            return None
+        return await read_at(pos + body, pos + body_end - 1)
+    return None
+
+
+async def _mkv_index(read_at: ReadAt, size: int, head: bytes) -> SeekIndex:
+    index = SeekIndex("matroska")
+    segment = None
+    for element_id, body, _ in _elements(head):
+        if element_id == MKV_SEGMENT:
+            segment = body
+            break
+    if segment is None:
+        raise SeekIndexError("No Matroska segment")
+
+    # Segment 开头的顶层元素：SeekHead 给出 Info、Tracks、Cues 的位置（相对 Segment 内容起点）
+    positions: Dict[int, int] = {}
+    parts: Dict[int, bytes] = {}
+    for element_id, body, body_end in _elements(head, segment):
+        if element_id == MKV_CLUSTER or body_end < 0:
+            break
+        if body_end > len(head):
+            break
+        if element_id in (MKV_INFO, MKV_TRACKS, MKV_CUES):
+            parts[element_id] = head[body:body_end]
+        elif element_id == MKV_SEEKHEAD:
+            for seek_id, seek_body, seek_end in _elements(head, body, body_end):
+                if seek_id != MKV_SEEK:
+                    continue
+                target = position = None
+                for child_id, child_body, child_end in _elements(head, seek_body, seek_end):
+                    if child_id == MKV_SEEK_ID:
+                        target = _uint(head, child_body, child_end)
+                    elif child_id == MKV_SEEK_POSITION:
+                        position = _uint(head, child_body, child_end)
+                if target is not None and position is not None:
+                    positions.setdefault(target, position)
+
+    for element_id in (MKV_INFO, MKV_TRACKS, MKV_CUES):
+        if element_id not in parts and element_id in positions:
+            data = await _mkv_element(read_at, size, segment + positions[element_id], element_id)
+            if data is not None:
+                parts[element_id] = data
+    if MKV_CUES not in parts:
+        raise SeekIndexError("No Matroska Cues")
+
+    scale = 1_000_000
+    info = parts.get(MKV_INFO)
+    if info is not None:
+        duration = 0.0
+        for element_id, body, body_end in _elements(info):
+            if element_id == MKV_TIMESTAMP_SCALE:
+                scale = _uint(info, body, body_end) or scale
+            elif element_id == MKV_DURATION:
+                duration = _float(info, body, body_end)
+        index.duration = duration * scale / 1e9
+
+    video_tracks = set()
+    tracks = parts.get(MKV_TRACKS)
+    if tracks is not None:
+        for element_id, body, body_end in _elements(tracks):
+            if element_id != MKV_TRACK_ENTRY:
+                continue
+            number = kind = None
+            for child_id, child_body, child_end in _elements(tracks, body, body_end):
+                if child_id == MKV_TRACK_NUMBER:
+                    number = _uint(tracks, child_body, child_end)
+                elif child_id == MKV_TRACK_TYPE:
+                    kind = _uint(tracks, child_body, child_end)
+            if kind == 1 and number is not None:
+                video_tracks.add(number)
+
+    cues = parts[MKV_CUES]
+    for element_id, body, body_end in _elements(cues):
+        if element_id != MKV_CUE_POINT:
+            continue
+        time = None
+        for child_id, child_body, child_end in _elements(cues, body, body_end):
+            if child_id == MKV_CUE_TIME:
+                time = _uint(cues, child_body, child_end) * scale / 1e9
+            elif child_id == MKV_CUE_TRACK_POSITIONS and time is not None:
+                track = position = None
+                for pos_id, pos_body, pos_end in _elements(cues, child_body, child_end):
+                    if pos_id == MKV_CUE_TRACK:
+                        track = _uint(cues, pos_body, pos_end)
+                    elif pos_id == MKV_CUE_CLUSTER_POSITION:
+                        position = _uint(cues, pos_body, pos_end)
+                if position is not None and (not video_tracks or track in video_tracks):
+                    index.add(time, segment + position)
+    return index
+
+
+# ---- AVI ----
+
+AVIIF_KEYFRAME = 0x10
+
+
+async def _avi_index(read_at: ReadAt, size: int) -> SeekIndex:
+    """解析 hdrl 中视频流的帧率和 idx1 中的关键帧；OpenDML（AVIX）扩展部分不在 idx1 中"""
+    index = SeekIndex("avi")
+    pos = 12
+    hdrl = None
+    movi = None
+    idx1 = None
+    while pos + 8 <= size and idx1 is None:
+        header = await read_at(pos, min(pos + 12, size) - 1)
+        if len(header) < 8:
+            break
+        kind, length = struct.unpack_from('<4sI', header)
+        if kind == b'LIST' and header[8:12] == b'hdrl':
+            if length > MAX_INDEX_BYTES:
+                raise SeekIndexError("AVI header too large")
+            hdrl = await read_at(pos + 12, pos + 8 + length - 1)
+        elif kind == b'LIST' and header[8:12] == b'movi':
+            movi = pos + 8
+        elif kind == b'idx1':
+            if length > MAX_INDEX_BYTES:
+                raise SeekIndexError("AVI index too large")
+            idx1 = await read_at(pos + 8, min(pos + 8 + length, size) - 1)
+        pos += 8 + length + (length & 1)
+    if hdrl is None or movi is None or idx1 is None:
+        raise SeekIndexError("No AVI idx1 index")
+
+    # 第几个 strl 是视频流，以及它的 scale/rate
+    stream = 0
+    video = None
+    scale = rate = 0
+    p = 0
+    while p + 8 <= len(hdrl):
+        kind, length = struct.unpack_from('<4sI', hdrl, p)
+        if kind == b'LIST' and hdrl[p + 8:p + 12] == b'strl':
+            strh = hdrl.find(b'strh', p + 12, p + 8 + length)
+            if strh >= 0 and hdrl[strh + 8:strh + 12] == b'vids' and video is None:
+                video = stream
+                scale, rate = struct.unpack_from('<II', hdrl, strh + 8 + 20)
+            stream += 1
+        p += 8 + length + (length & 1)
+    if video is None or not rate:
+        raise SeekIndexError("No AVI video stream")
+
+    prefix = f"{video:02d}".encode()
+    frame = 0
+    relative = None
+    for p in range(0, len(idx1) - 15, 16):
+        chunk_id, flags, offset, _ = struct.unpack_from('<4sIII', idx1, p)
+        if chunk_id[:2] != prefix or chunk_id[2:] not in (b'dc', b'db'):
+            continue
+        if relative is None:
+            # idx1 的偏移通常相对 'movi' 标记，少数文件使用绝对偏移
+            relative = offset < movi
+        if flags & AVIIF_KEYFRAME:
+            index.add(frame * scale / rate, movi + offset if relative else offset)
+        frame += 1
+    index.duration = frame * scale / rate
+    return index
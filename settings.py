@@ -0,0 +1,201 @@
+import os
+import tempfile
+from dataclasses import dataclass
+
+
+def _env_str(name: str, default: str = "") -> str:
+    return os.getenv(name, default) or default
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return int(value)
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return float(value)
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass(frozen=True)
+class Settings:
+    """服务配置，启动时从环境变量读取一次"""
+
+    # WebDAV 上游
+    webdav_server: str = ""
+    webdav_username: str = ""
+    webdav_password: str = ""
+    media_root: str = ""
+    webdav_timeout: float = 30
+    webdav_verify_tls: bool = False
+
+    # 上游连接池
+    upstream_custom_clients: int = 8     # 缓存的用户自定义服务器客户端数量
+    upstream_pool_maxsize: int = 32      # 每个主机保持的keep-alive连接数
+    upstream_max_retries: int = 1
+    webdav_mirrors: str = ""                  # 逗号分隔的镜像地址，与主服务器使用相同的账号和 MEDIA_ROOT
+    upstream_hedge_percentile: float = 95     # 首字节超过该分位数时向次优镜像发出对冲请求，0 表示不对冲
+    upstream_hedge_min_delay: float = 0.05    # 对冲前的最短等待（秒）
+    ftp_max_workers: int = 8             # 同时执行的阻塞FTP会话数
+
+    # FTP 上游（/api/ftp/stream 未指定 url 时使用）
+    ftp_server: str = ""                 # ftp://host[:port]/path
+    ftp_username: str = ""
+    ftp_password: str = ""
+    ftp_max_connections: int = 4         # 每个服务器同时使用的控制连接数
+
+    # 本地媒体目录，其中的文件直接从磁盘读取，不经过 WebDAV；为空表示不启用
+    local_media_root: str = ""
+
+    # 上游带宽调度，运行时可通过 PUT /api/bandwidth 调整
+    bandwidth_limit_mbps: float = 0          # 所有流的上游总速率（Mbit/s），0 表示不限速
+    bandwidth_playback_weight: float = 4     # 播放流（带 Range）的公平份额权重
+    bandwidth_bulk_weight: float = 1         # 整文件下载的公平份额权重
+    bandwidth_floor_factor: float = 1.5      # 播放流保底速率 = 媒体码率 x 此系数
+
+    # 媒体响应的 Cache-Control，ETag/Last-Modified 始终返回；为空表示不设置
+    media_cache_control: str = "public, max-age=3600"
+
+    # PROPFIND 元数据缓存
+    metadata_cache_ttl: float = 60
+    metadata_cache_negative_ttl: float = 10
+    metadata_cache_max_entries: int = 4096
+
+    # 范围请求块缓存
+    block_cache_dir: str = ""
+    block_cache_size_mb: int = 2048      # 0 表示关闭
+    block_cache_block_kb: int = 1024
+
+    # 开放区间（bytes=a-）的自适应跨度
+    range_min_span_kb: int = 1024
+    range_max_span_mb: int = 16
+    upstream_coalesce_buffer_mb: int = 8     # 共享上游读取时每个读取者的最大缓冲，超出时分离
+
+    # /api/converted 默认模式：stream 流式转码，file 整文件转换
+    transcode_mode: str = "stream"
+    transcode_cache_dir: str = ""
+    transcode_cache_size_mb: int = 10240
+    transcode_max_jobs: int = max((os.cpu_count() or 2) // 2, 1)   # 同时运行的 ffmpeg 进程数
+    transcode_max_queue: int = 16
+    transcode_threads_per_job: int = 2
+
+    # 顺序播放预读
+    prefetch_blocks: int = 4             # 0 表示关闭
+    prefetch_max_concurrent: int = 4
+    prefetch_min_sequential: int = 2
+
+    # HLS 分段输出
+    hls_segment_seconds: float = 6
+    hls_prefetch_segments: int = 3       # 请求某一分段时预先生成其后的分段数
+    internal_base_url: str = "http://127.0.0.1:8000"   # ffmpeg 回环读取 /api/stream-direct 的地址
+
+    # 缩略图与拖动预览（雪碧图 + WebVTT）
+    thumbnail_cache_dir: str = ""
+    thumbnail_cache_size_mb: int = 512
+    thumbnail_max_jobs: int = 1
+    thumbnail_max_queue: int = 32
+    thumbnail_width: int = 320
+    trickplay_width: int = 160
+    trickplay_interval: float = 10
+    thumbnail_prewarm_trickplay: bool = False   # 目录预热时是否同时生成拖动预览
+
+    # 媒体探测（ffprobe）
+    probe_timeout: float = 30
+    probe_cache_max_entries: int = 4096
+
+    # 关键帧索引（跳转预热）
+    seek_index_cache_max_entries: int = 256
+    seek_prefetch_blocks: int = 16
+
+    # 虚拟 faststart：moov 在末尾的远程 MP4 按 moov 在前的布局发送
+    virtual_faststart: bool = True
+    faststart_cache_max_entries: int = 64
+
+    # 用户元数据（持久化）
+    metadata_db: str = ""
+
+    # 媒体库索引
+    catalog_db: str = ""
+    catalog_refresh_interval: float = 300   # 0 表示只在启动时爬取一次
+    catalog_max_depth: int = 8
+    catalog_crawl_concurrency: int = 4
+
+
+def load_settings() -> Settings:
+    """从环境变量构建配置对象"""
+    return Settings(
+        webdav_server=_env_str("WEBDAV_SERVER"),
+        webdav_username=_env_str("WEBDAV_USERNAME"),
+        webdav_password=_env_str("WEBDAV_PASSWORD"),
+        media_root=_env_str("MEDIA_ROOT"),
+        webdav_timeout=_env_float("WEBDAV_TIMEOUT", 30),
+        webdav_verify_tls=_env_bool("WEBDAV_VERIFY_TLS", False),
+        upstream_custom_clients=_env_int("UPSTREAM_CUSTOM_CLIENTS", 8),
+        upstream_pool_maxsize=_env_int("UPSTREAM_POOL_MAXSIZE", 32),
+        upstream_max_retries=_env_int("UPSTREAM_MAX_RETRIES", 1),
+        webdav_mirrors=_env_str("WEBDAV_MIRRORS"),
+        upstream_hedge_percentile=_env_float("UPSTREAM_HEDGE_PERCENTILE", 95),
+        upstream_hedge_min_delay=_env_float("UPSTREAM_HEDGE_MIN_DELAY", 0.05),
+        ftp_max_workers=_env_int("FTP_MAX_WORKERS", 8),
+        ftp_server=_env_str("FTP_SERVER"),
+        ftp_username=_env_str("FTP_USERNAME"),
+        ftp_password=_env_str("FTP_PASSWORD"),
+        ftp_max_connections=_env_int("FTP_MAX_CONNECTIONS", 4),
+        local_media_root=_env_str("LOCAL_MEDIA_ROOT"),
+        bandwidth_limit_mbps=_env_float("BANDWIDTH_LIMIT_MBPS", 0),
+        bandwidth_playback_weight=_env_float("BANDWIDTH_PLAYBACK_WEIGHT", 4),
+        bandwidth_bulk_weight=_env_float("BANDWIDTH_BULK_WEIGHT", 1),
+        bandwidth_floor_factor=_env_float("BANDWIDTH_FLOOR_FACTOR", 1.5),
+        media_cache_control=_env_str("MEDIA_CACHE_CONTROL", "public, max-age=3600"),
+        metadata_cache_ttl=_env_float("METADATA_CACHE_TTL", 60),
+        metadata_cache_negative_ttl=_env_float("METADATA_CACHE_NEGATIVE_TTL", 10),
+        metadata_cache_max_entries=_env_int("METADATA_CACHE_MAX_ENTRIES", 4096),
+        block_cache_dir=_env_str("BLOCK_CACHE_DIR", os.path.join(tempfile.gettempdir(), "noediv_blocks")),
+        block_cache_size_mb=_env_int("BLOCK_CACHE_SIZE_MB", 2048),
+        block_cache_block_kb=_env_int("BLOCK_CACHE_BLOCK_KB", 1024),
+        range_min_span_kb=_env_int("RANGE_MIN_SPAN_KB", 1024),
+        range_max_span_mb=_env_int("RANGE_MAX_SPAN_MB", 16),
+        upstream_coalesce_buffer_mb=_env_int("UPSTREAM_COALESCE_BUFFER_MB", 8),
+        transcode_mode=_env_str("TRANSCODE_MODE", "stream"),
+        transcode_cache_dir=_env_str("TRANSCODE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "noediv_transcode")),
+        transcode_cache_size_mb=_env_int("TRANSCODE_CACHE_SIZE_MB", 10240),
+        transcode_max_jobs=_env_int("TRANSCODE_MAX_JOBS", max((os.cpu_count() or 2) // 2, 1)),
+        transcode_max_queue=_env_int("TRANSCODE_MAX_QUEUE", 16),
+        transcode_threads_per_job=_env_int("TRANSCODE_THREADS_PER_JOB", 2),
+        prefetch_blocks=_env_int("PREFETCH_BLOCKS", 4),
+        prefetch_max_concurrent=_env_int("PREFETCH_MAX_CONCURRENT", 4),
+        prefetch_min_sequential=_env_int("PREFETCH_MIN_SEQUENTIAL", 2),
+        hls_segment_seconds=_env_float("HLS_SEGMENT_SECONDS", 6),
+        hls_prefetch_segments=_env_int("HLS_PREFETCH_SEGMENTS", 3),
+        internal_base_url=_env_str("INTERNAL_BASE_URL", "http://127.0.0.1:8000"),
+        thumbnail_cache_dir=_env_str("THUMBNAIL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "noediv_thumbnails")),
+        thumbnail_cache_size_mb=_env_int("THUMBNAIL_CACHE_SIZE_MB", 512),
+        thumbnail_max_jobs=_env_int("THUMBNAIL_MAX_JOBS", 1),
+        thumbnail_max_queue=_env_int("THUMBNAIL_MAX_QUEUE", 32),
+        thumbnail_width=_env_int("THUMBNAIL_WIDTH", 320),
+        trickplay_width=_env_int("TRICKPLAY_WIDTH", 160),
+        trickplay_interval=_env_float("TRICKPLAY_INTERVAL", 10),
+        thumbnail_prewarm_trickplay=_env_bool("THUMBNAIL_PREWARM_TRICKPLAY", False),
+        probe_timeout=_env_float("PROBE_TIMEOUT", 30),
+        probe_cache_max_entries=_env_int("PROBE_CACHE_MAX_ENTRIES", 4096),
+        seek_index_cache_max_entries=_env_int("SEEK_INDEX_CACHE_MAX_ENTRIES", 256),
+        seek_prefetch_blocks=_env_int("SEEK_PREFETCH_BLOCKS", 16),
+        virtual_faststart=_env_bool("VIRTUAL_FASTSTART", True),
+        faststart_cache_max_entries=_env_int("FASTSTART_CACHE_MAX_ENTRIES", 64),
+        metadata_db=_env_str("METADATA_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "metadata.db")),
+        catalog_db=_env_str("CATALOG_DB", os.path.join(tempfile.gettempdir(), "noediv_catalog.db")),
+        catalog_refresh_interval=_env_float("CATALOG_REFRESH_INTERVAL", 300),
+        catalog_max_depth=_env_int("CATALOG_MAX_DEPTH", 8),
+        catalog_crawl_concurrency=_env_int("CATALOG_CRAWL_CONCURRENCY", 4),
+    )
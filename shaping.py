@@ -0,0 +1,194 @@
+import asyncio
+import time
+from typing import List, Optional, Tuple
+
+from metrics import REGISTRY
+
+# 流的类别：播放（带 Range 的浏览器/ffmpeg 读取）、批量下载（不带 Range 的整文件请求）、
+# 后台（预读、缩略图）。后台流只使用前台流用剩的带宽。
+CLASS_PLAYBACK = "playback"
+CLASS_BULK = "bulk"
+CLASS_BACKGROUND = "background"
+CLASSES = (CLASS_PLAYBACK, CLASS_BULK, CLASS_BACKGROUND)
+
+# 令牌桶容量（秒）：允许短时突发，又不至于让一个流一次拿走过多带宽
+BURST_SECONDS = 0.25
+MIN_BURST = 256 * 1024
+
+# 保底速率的积累上限（秒），空闲的播放流不会攒下过多优先额度
+FLOOR_WINDOW = 2.0
+
+SHAPED_BYTES = REGISTRY.counter(
+    "noediv_bandwidth_bytes_total",
+    "Upstream bytes passed through the bandwidth scheduler",
+    ("class",),
+)
+SHAPED_WAIT = REGISTRY.counter(
+    "noediv_bandwidth_wait_seconds_total",
+    "Time streams spent waiting for upstream bandwidth",
+    ("class",),
+)
+
+
+class Flow:
+    """一个上游读取流（一次范围响应或一次预读）"""
+    __slots__ = ("kind", "floor", "vtime", "floor_credit", "floor_updated")
+
+    def __init__(self, kind: str, floor: float = 0):
+        self.kind = kind
+        self.floor = floor              # 保底速率（字节/秒），0 表示没有
+        self.vtime = 0.0                # 加权公平排队的虚拟开始时间
+        self.floor_credit = 0.0         # 距保底速率还差的字节数，大于 0 时优先调度
+        self.floor_updated = time.monotonic()
+
+
+class BandwidthScheduler:
+    """上游带宽调度
+
+    - 全局令牌桶限制所有流的上游总速率（rate 为 0 时不限速，只计数）
+    - 前台流按权重做加权公平排队（start-time fair queuing），空闲的流不占份额
+    - 未达到保底速率（媒体码率 x floor_factor）的播放流优先获得带宽
+    - 后台流只在没有前台流等待时才被调度
+    数据先从上游读到，再按块申请额度，TCP 背压让上游随之减速。
+    """
+
+    def __init__(self, rate: float = 0, playback_weight: float = 4, bulk_weight: float = 1,
+                 floor_factor: float = 1.5):
+        self.rate = rate
+        self.weights = {CLASS_PLAYBACK: playback_weight, CLASS_BULK: bulk_weight, CLASS_BACKGROUND: 1}
+        self.floor_factor = floor_factor
+        self._flows: List[Flow] = []
+        self._waiters: List[Tuple[Flow, int, asyncio.Future]] = []
+        self._vtime = 0.0
+        self._tokens = 0.0
+        self._refilled = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def burst(self) -> float:
+        return max(self.rate * BURST_SECONDS, MIN_BURST)
+
+    def configure(self, rate: Optional[float] = None, playback_weight: Optional[float] = None,
+                  bulk_weight: Optional[float] = None, floor_factor: Optional[float] = None):
+        """运行时调整参数；未给出的参数保持不变"""
+        if rate is not None:
+            self.rate = rate
+        if playback_weight is not None:
+            self.weights[CLASS_PLAYBACK] = playback_weight
+        if bulk_weight is not None:
+            self.weights[CLASS_BULK] = bulk_weight
+        if floor_factor is not None:
+            self.floor_factor = floor_factor
+        # 立即按新速率重新调度等待中的流
+        self._tokens = min(self._tokens, self.burst)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._kick()
+
+    def open(self, kind: str, bitrate: float = 0) -> Flow:
+        """登记一个流；bitrate 为媒体码率（比特/秒），播放流据此获得保底速率"""
+        floor = bitrate / 8 * self.floor_factor if kind == CLASS_PLAYBACK else 0
+        flow = Flow(kind, floor)
+        flow.vtime = self._vtime
+        self._flows.append(flow)
+        return flow
+
+    def close(self, flow: Flow):
+        try:
+            self._flows.remove(flow)
+        except ValueError:
+            pass
+
+    async def acquire(self, flow: Optional[Flow], nbytes: int):
+        """申请转发 nbytes 字节的额度；flow 为 None 时不受调度"""
+        if flow is None:
+            return
+        if self.rate <= 0:
+            SHAPED_BYTES.inc(nbytes, **{"class": flow.kind})
+            return
+        future = asyncio.get_running_loop().create_future()
+        # 重新变为活跃的流不能用空闲期间的虚拟时间插队
+        flow.vtime = max(flow.vtime, self._vtime)
+        self._waiters.append((flow, nbytes, future))
+        self._kick()
+        started = time.monotonic()
+        try:
+            await future
+            # 在获得额度时计数：被取消后改用其他流重新申请的数据不重复计入
+            SHAPED_BYTES.inc(nbytes, **{"class": flow.kind})
+        finally:
+            if future.cancelled():
+                self._waiters = [w for w in self._waiters if w[2] is not future]
+            SHAPED_WAIT.inc(time.monotonic() - started, **{"class": flow.kind})
+
+    def _kick(self):
+        if self._waiters and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._dispatch())
+
+    def _refill(self, now: float):
+        self._tokens = min(self._tokens + (now - self._refilled) * self.rate, self.burst)
+        self._refilled = now
+
+    def _below_floor(self, flow: Flow, now: float) -> bool:
+        if flow.floor <= 0:
+            return False
+        flow.floor_credit = min(flow.floor_credit + (now - flow.floor_updated) * flow.floor,
+                                flow.floor * FLOOR_WINDOW)
+        flow.floor_updated = now
+        return flow.floor_credit > 0
+
+    def _select(self, now: float) -> Tuple[Flow, int, asyncio.Future]:
+        """后台流排在最后；前台流中未达保底速率的优先，其余按虚拟时间"""
+        return min(
+            self._waiters,
+            key=lambda w: (w[0].kind == CLASS_BACKGROUND, not self._below_floor(w[0], now), w[0].vtime),
+        )
+
+    async def _dispatch(self):
+        while self._waiters:
+            if self.rate <= 0:
+                for _, _, future in self._waiters:
+                    if not future.done():
+                        future.set_result(None)
+                self._waiters.clear()
+                return
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens < 0:
+                # 上一次发放透支了令牌，等速率补回后再继续
+                await asyncio.sleep(-self._tokens / self.rate)
+                continue
+            waiter = self._select(now)
+            self._waiters.remove(waiter)
+            flow, nbytes, future = waiter
+            if future.done():
+                continue
+            self._tokens -= nbytes
+            self._vtime = flow.vtime
+            flow.vtime += nbytes / max(self.weights.get(flow.kind, 1), 1e-6)
+            # 超出保底的部分最多抵扣一个窗口，之前的突发不会长期压低优先级
+            flow.floor_credit = max(flow.floor_credit - nbytes, -flow.floor * FLOOR_WINDOW)
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        flows = {kind: 0 for kind in CLASSES}
+        for flow in self._flows:
+            flows[flow.kind] = flows.get(flow.kind, 0) + 1
+        return {
+            "rate": self.rate,
+            "playback_weight": self.weights[CLASS_PLAYBACK],
+            "bulk_weight": self.weights[CLASS_BULK],
+            "floor_factor": self.floor_factor,
+            "flows": flows,
+            "waiting": len(self._waiters),
+        }
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        for _, _, future in self._waiters:
+            if not future.done():
+                future.cancel()
+        self._waiters.clear()
@@ -0,0 +1,173 @@
+"""按字节构造测试用的小型 MP4 / Matroska / AVI 文件"""
+import struct
+
+from seekindex import (MKV_CLUSTER, MKV_CUE_CLUSTER_POSITION, MKV_CUE_POINT, MKV_CUE_TIME, MKV_CUE_TRACK,
+                       MKV_CUE_TRACK_POSITIONS, MKV_CUES, MKV_DURATION, MKV_INFO, MKV_SEEK, MKV_SEEK_ID,
+                       MKV_SEEK_POSITION, MKV_SEEKHEAD, MKV_SEGMENT, MKV_TIMESTAMP_SCALE, MKV_TRACK_ENTRY,
+                       MKV_TRACK_NUMBER, MKV_TRACK_TYPE, MKV_TRACKS)
+
+
+def reader(data: bytes):
+    """返回按闭区间读取 data 的 read_at，并记录读取过的范围"""
+    reads = []
+
+    async def read_at(start: int, end: int) -> bytes:
+        reads.append((start, end))
+        return data[start:end + 1]
+
+    read_at.reads = reads
+    return read_at
+
+
+# ---- MP4 ----
+
+def box(kind: bytes, payload: bytes = b"") -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def full_box(kind: bytes, payload: bytes, version: int = 0) -> bytes:
+    return box(kind, bytes([version, 0, 0, 0]) + payload)
+
+
+def table(kind: bytes, rows, fmt: str = 'I') -> bytes:
+    return full_box(kind, struct.pack('>I', len(rows)) + b"".join(struct.pack('>' + fmt * len(row), *row)
+                                                               for row in rows))
+
+
+def trak(handler: bytes, sizes, chunk_offsets, per_chunk: int, delta: int, timescale: int,
+         sync=None, co64: bool = False) -> bytes:
+    stbl = [
+        table(b'stts', [(len(sizes), delta)]),
+        table(b'stsc', [(1, per_chunk, 1)]),
+        full_box(b'stsz', struct.pack('>II', 0, len(sizes)) + b"".join(struct.pack('>I', s) for s in sizes)),
+        table(b'co64', [(o,) for o in chunk_offsets], 'Q') if co64 else table(b'stco', [(o,) for o in chunk_offsets]),
+    ]
+    if sync is not None:
+        stbl.append(table(b'stss', [(n,) for n in sync]))
+    duration = len(sizes) * delta
+    return box(b'trak', box(b'mdia', b"".join([
+        full_box(b'mdhd', struct.pack('>IIII', 0, 0, timescale, duration) + b'\0' * 4),
+        full_box(b'hdlr', struct.pack('>I4s', 0, handler) + b'\0' * 12 + b'track\0'),
+        box(b'minf', box(b'stbl', b"".join(stbl))),
+    ])))
+
+
+def mp4_file(sizes=(10, 20, 30, 40, 50, 60), per_chunk: int = 3, delta: int = 500, timescale: int = 1000,
+             sync=(1, 3), co64: bool = False, moov_at_end: bool = False) -> bytes:
+    """一条视频轨（每 per_chunk 个采样一块）和一条音频轨的 MP4，块偏移指向 mdat 中的真实位置
+
+    音频轨只有一块，位于 mdat 开头之后 1 字节处。
+    """
+    ftyp = box(b'ftyp', b'isom\0\0\2\0isomiso2')
+    payload = bytes(i % 251 for i in range(sum(sizes) + 1))
+
+    def moov(mdat_body: int) -> bytes:
+        offsets = []
+        position = mdat_body + 1
+        for i, size in enumerate(sizes):
+            if i % per_chunk == 0:
+                offsets.append(position)
+            position += size
+        return box(b'moov', b"".join([
+            full_box(b'mvhd', struct.pack('>IIII', 0, 0, timescale, len(sizes) * delta) + b'\0' * 80),
+            trak(b'soun', [1], [mdat_body], 1, delta, timescale, co64=co64),
+            trak(b'vide', list(sizes), offsets, per_chunk, delta, timescale, sync, co64),
+        ]))
+
+    moov_length = len(moov(0))
+    if moov_at_end:
+        return ftyp + box(b'mdat', payload) + moov(len(ftyp) + 8)
+    return ftyp + moov(len(ftyp) + moov_length + 8) + box(b'mdat', payload)
+
+
+# ---- Matroska ----
+
+def ebml_id(element_id: int) -> bytes:
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+
+
+def ebml_size(size: int) -> bytes:
+    length = 1
+    while size >= (1 << (7 * length)) - 1:
+        length += 1
+    return (size | (1 << (7 * length))).to_bytes(length, 'big')
+
+
+def element(element_id: int, payload: bytes) -> bytes:
+    return ebml_id(element_id) + ebml_size(len(payload)) + payload
+
+
+def uint(value: int, width: int = 0) -> bytes:
+    return value.to_bytes(width or max((value.bit_length() + 7) // 8, 1), 'big')
+
+
+def mkv_file(cues=((0, 2, 0), (1000, 1, 1), (2000, 2, 2)), clusters: int = 3, cluster_size: int = 100):
+    """Info、Tracks（1 为音频，2 为视频）和若干 Cluster，Cues 在末尾，只能经 SeekHead 找到
+
+    cues 为 (时间毫秒, 轨道号, 第几个 Cluster)。返回 (文件, 各 Cluster 在文件中的偏移)。
+    """
+    header = element(0x1A45DFA3, element(0x4282, b'matroska'))
+    info = element(MKV_INFO, element(MKV_TIMESTAMP_SCALE, uint(1_000_000))
+                   + element(MKV_DURATION, struct.pack('>d', 3000.0)))
+    tracks = element(MKV_TRACKS,
+                     element(MKV_TRACK_ENTRY, element(MKV_TRACK_NUMBER, uint(1)) + element(MKV_TRACK_TYPE, uint(2)))
+                     + element(MKV_TRACK_ENTRY, element(MKV_TRACK_NUMBER, uint(2)) + element(MKV_TRACK_TYPE, uint(1))))
+
+    def seekhead(cues_position: int) -> bytes:
+        return element(MKV_SEEKHEAD, element(MKV_SEEK, element(MKV_SEEK_ID, ebml_id(MKV_CUES))
+                                             + element(MKV_SEEK_POSITION, uint(cues_position, 4))))
+
+    cluster = element(MKV_CLUSTER, b'\0' * cluster_size)
+    before_clusters = len(seekhead(0)) + len(info) + len(tracks)
+    positions = [before_clusters + i * len(cluster) for i in range(clusters)]
+    cue_data = element(MKV_CUES, b"".join(
+        element(MKV_CUE_POINT, element(MKV_CUE_TIME, uint(time)) + element(
+            MKV_CUE_TRACK_POSITIONS, element(MKV_CUE_TRACK, uint(track))
+            + element(MKV_CUE_CLUSTER_POSITION, uint(positions[n]))))
+        for time, track, n in cues))
+    body = seekhead(before_clusters + clusters * len(cluster)) + info + tracks + cluster * clusters + cue_data
+    segment = element(MKV_SEGMENT, body)
+    segment_body = len(header) + len(segment) - len(body)
+    return header + segment, [segment_body + p for p in positions]
+
+
+# ---- AVI ----
+
+def riff_chunk(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack('<4sI', kind, len(payload)) + payload + (b'\0' if len(payload) & 1 else b'')
+
+
+def riff_list(kind: bytes, payload: bytes) -> bytes:
+    return riff_chunk(b'LIST', kind + payload)
+
+
+def strh(kind: bytes, scale: int, rate: int) -> bytes:
+    return riff_chunk(b'strh', kind + b'\0' * 4 + struct.pack('<IHHIII', 0, 0, 0, 0, scale, rate) + b'\0' * 28)
+
+
+def avi_file(keyframes=(0, 2), frames: int = 4, scale: int = 1, rate: int = 2, absolute: bool = False,
+             with_index: bool = True):
+    """音频为流 0、视频为流 1 的 AVI，idx1 中视频帧与音频块交错
+
+    返回 (文件, 各视频帧块在文件中的偏移)。
+    """
+    hdrl = riff_list(b'hdrl', riff_chunk(b'avih', b'\0' * 56)
+                     + riff_list(b'strl', strh(b'auds', 1, 44100))
+                     + riff_list(b'strl', strh(b'vids', scale, rate)))
+    chunks = []
+    for frame in range(frames):
+        chunks.append((b'00wb', b'a' * 6, 0))
+        chunks.append((b'01dc', bytes([frame]) * 9, 0x10 if frame in keyframes else 0))
+    movi_payload = b""
+    entries = []
+    movi = 12 + len(hdrl) + 8          # 'movi' 标记的文件偏移
+    for kind, data, flags in chunks:
+        entries.append((kind, flags, 4 + len(movi_payload)))
+        movi_payload += riff_chunk(kind, data)
+    index = b"".join(struct.pack('<4sIII', kind, flags, movi + offset if absolute else offset, 0)
+                     for kind, flags, offset in entries)
+    body = b'AVI ' + hdrl + riff_list(b'movi', movi_payload)
+    if with_index:
+        body += riff_chunk(b'idx1', index)
+    offsets = [movi + offset for kind, _, offset in entries if kind == b'01dc']
+    return struct.pack('<4sI', b'RIFF', len(body)) + body, offsets
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from asynccache import AsyncLRUCache
+
+
+def test_concurrent_requests_share_one_computation():
+    calls = []
+
+    async def create():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def scenario():
+        cache = AsyncLRUCache()
+        results = await asyncio.gather(*(cache.get_or_create("k", create) for _ in range(5)))
+        return results, await cache.get_or_create("k", create), cache.stats()
+
+    results, again, stats = asyncio.run(scenario())
+    assert results == ["value"] * 5
+    assert again == "value"
+    assert len(calls) == 1
+    assert stats["misses"] == 1 and stats["entries"] == 1
+
+
+def test_failure_is_not_cached():
+    async def fail():
+        raise ValueError("bad")
+
+    async def scenario():
+        cache = AsyncLRUCache()
+        with pytest.raises(ValueError):
+            await cache.get_or_create("k", fail)
+        return cache.get("k"), cache.stats()
+
+    value, stats = asyncio.run(scenario())
+    assert value is None
+    assert stats["entries"] == stats["pending"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AsyncLRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+
+def test_expired_entry_is_dropped():
+    cache = AsyncLRUCache(ttl=-1)
+    cache.put("a", 1)
+    assert cache.get("a") is None
@@ -0,0 +1,71 @@
+import asyncio
+
+from blockcache import BlockCache, CachedReader, InflightFetch
+from metacache import FileMeta
+from shaping import CLASS_BACKGROUND, CLASS_BULK, CLASS_PLAYBACK, BandwidthScheduler, Flow
+
+BLOCK = 4096
+BLOCKS = 16
+
+
+class RecordingScheduler(BandwidthScheduler):
+    """记录每次获得额度的流类别"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.granted = []
+
+    async def acquire(self, flow, nbytes):
+        await super().acquire(flow, nbytes)
+        if flow is not None:
+            self.granted.append((flow.kind, nbytes))
+
+
+async def fetch_blocks(path, start, end, etag=""):
+    for offset in range(start, end + 1, BLOCK):
+        await asyncio.sleep(0)
+        yield bytes([offset // BLOCK]) * min(BLOCK, end + 1 - offset)
+
+
+def test_fetch_flow_is_highest_priority_subscriber():
+    meta = FileMeta(size=BLOCK * BLOCKS, etag="e")
+    fetch = InflightFetch(None, "a.mp4", meta, 0, BLOCKS - 1)
+    background = fetch.subscribe(Flow(CLASS_BACKGROUND), BLOCK)
+    assert fetch.flow.kind == CLASS_BACKGROUND
+    bulk = fetch.subscribe(Flow(CLASS_BULK), BLOCK)
+    playback = fetch.subscribe(Flow(CLASS_PLAYBACK), BLOCK)
+    fetch.subscribe(None, BLOCK)
+    assert fetch.flow is playback.flow
+    fetch.unsubscribe(playback)
+    assert fetch.flow is bulk.flow
+    fetch.unsubscribe(bulk)
+    assert fetch.flow is background.flow
+
+
+def test_waiting_fetch_is_requeued_when_playback_joins(tmp_path):
+    async def scenario():
+        cache = BlockCache(str(tmp_path), BLOCK * BLOCKS * 2, block_size=BLOCK)
+        shaper = RecordingScheduler(rate=BLOCK * 32)
+        reader = CachedReader(cache, fetch_blocks, shaper)
+        meta = FileMeta(size=BLOCK * BLOCKS, etag="e")
+
+        warm = asyncio.ensure_future(
+            reader.warm("a.mp4", meta, 0, BLOCKS - 1, shaper.open(CLASS_BACKGROUND)))
+        while not shaper.granted:
+            await asyncio.sleep(0.001)
+        # 预读正在等待带宽时播放加入同一次上游读取
+        data = b"".join([chunk async for chunk in
+                         reader.read("a.mp4", meta, 0, meta.size - 1, shaper.open(CLASS_PLAYBACK))])
+        await warm
+        await shaper.aclose()
+        cache.close()
+        return data, shaper.granted
+
+    data, granted = asyncio.run(scenario())
+    assert data == b"".join(bytes([i]) * BLOCK for i in range(BLOCKS))
+    kinds = [kind for kind, _ in granted]
+    assert kinds[0] == CLASS_BACKGROUND
+    assert kinds[-1] == CLASS_PLAYBACK
+    # 播放加入后不再按后台类别申请，重新排队的数据也不重复计入
+    assert kinds == sorted(kinds, key=lambda kind: kind != CLASS_BACKGROUND)
+    assert sum(nbytes for _, nbytes in granted) == BLOCK * BLOCKS
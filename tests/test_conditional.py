@@ -0,0 +1,113 @@
+from conditional import entity_tag, evaluate_preconditions, if_range_matches, precondition_response, validator_headers
+from metacache import FileMeta
+
+MODIFIED = "Wed, 21 Oct 2015 07:28:00 GMT"
+EARLIER = "Tue, 20 Oct 2015 07:28:00 GMT"
+LATER = "Thu, 22 Oct 2015 07:28:00 GMT"
+
+META = FileMeta(size=1000, content_type="video/mp4", etag="abc", last_modified=MODIFIED)
+WEAK = FileMeta(size=1000, content_type="video/mp4", etag="abc", last_modified=MODIFIED, weak_etag=True)
+
+
+def test_entity_tag_falls_back_to_mtime_and_size():
+    assert entity_tag(META) == '"abc"'
+    fallback = entity_tag(FileMeta(size=255, last_modified=MODIFIED))
+    assert fallback.startswith('"') and fallback.endswith('-ff"')
+    assert entity_tag(FileMeta(size=1)) == ""
+
+
+def test_weak_upstream_etag_stays_weak():
+    assert entity_tag(WEAK) == 'W/"abc"'
+    assert validator_headers(WEAK)["ETag"] == 'W/"abc"'
+
+
+def test_validator_headers():
+    assert validator_headers(META, "public") == {"ETag": '"abc"', "Last-Modified": MODIFIED, "Cache-Control": "public"}
+
+
+def test_no_conditions():
+    assert evaluate_preconditions({}, META) is None
+
+
+def test_if_match():
+    assert evaluate_preconditions({"if-match": '"abc"'}, META) is None
+    assert evaluate_preconditions({"if-match": '"x", "abc"'}, META) is None
+    assert evaluate_preconditions({"if-match": "*"}, META) is None
+    assert evaluate_preconditions({"if-match": '"x"'}, META) == 412
+    # If-Match 使用强比较，弱标签不匹配
+    assert evaluate_preconditions({"if-match": 'W/"abc"'}, META) == 412
+
+
+def test_if_match_never_matches_weak_etag():
+    assert evaluate_preconditions({"if-match": '"abc"'}, WEAK) == 412
+    assert evaluate_preconditions({"if-match": 'W/"abc"'}, WEAK) == 412
+    assert evaluate_preconditions({"if-match": "*"}, WEAK) is None
+
+
+def test_if_unmodified_since():
+    assert evaluate_preconditions({"if-unmodified-since": LATER}, META) is None
+    assert evaluate_preconditions({"if-unmodified-since": EARLIER}, META) == 412
+    # 有 If-Match 时忽略 If-Unmodified-Since
+    assert evaluate_preconditions({"if-match": '"abc"', "if-unmodified-since": EARLIER}, META) is None
+
+
+def test_if_none_match_uses_weak_comparison():
+    assert evaluate_preconditions({"if-none-match": '"abc"'}, META) == 304
+    assert evaluate_preconditions({"if-none-match": 'W/"abc"'}, META) == 304
+    assert evaluate_preconditions({"if-none-match": '"x"'}, META) is None
+    assert evaluate_preconditions({"if-none-match": "*"}, META) == 304
+    assert evaluate_preconditions({"if-none-match": '"abc"'}, META, "PUT") == 412
+
+
+def test_if_none_match_weak_etag():
+    assert evaluate_preconditions({"if-none-match": 'W/"abc"'}, WEAK) == 304
+    assert evaluate_preconditions({"if-none-match": '"abc"'}, WEAK) == 304
+    assert evaluate_preconditions({"if-none-match": 'W/"x"'}, WEAK) is None
+
+
+def test_if_none_match_takes_precedence_over_if_modified_since():
+    # ETag 不匹配时即使日期未变也必须返回完整响应
+    assert evaluate_preconditions({"if-none-match": '"x"', "if-modified-since": LATER}, META) is None
+    assert evaluate_preconditions({"if-none-match": '"abc"', "if-modified-since": EARLIER}, META) == 304
+
+
+def test_if_modified_since():
+    assert evaluate_preconditions({"if-modified-since": MODIFIED}, META) == 304
+    assert evaluate_preconditions({"if-modified-since": LATER}, META) == 304
+    assert evaluate_preconditions({"if-modified-since": EARLIER}, META) is None
+    assert evaluate_preconditions({"if-modified-since": "garbage"}, META) is None
+    # 只对 GET/HEAD 生效
+    assert evaluate_preconditions({"if-modified-since": LATER}, META, "POST") is None
+
+
+def test_if_match_failure_wins_over_if_none_match():
+    assert evaluate_preconditions({"if-match": '"x"', "if-none-match": '"abc"'}, META) == 412
+
+
+def test_if_range_strong_etag():
+    assert if_range_matches({}, META)
+    assert if_range_matches({"if-range": '"abc"'}, META)
+    assert not if_range_matches({"if-range": '"x"'}, META)
+
+
+def test_if_range_rejects_weak_etags():
+    assert not if_range_matches({"if-range": 'W/"abc"'}, META)
+
+
+def test_if_range_ignores_range_for_weak_etag():
+    # 弱 ETag 不能保证逐字节相同，If-Range 必须失败，返回完整文件
+    assert not if_range_matches({"if-range": '"abc"'}, WEAK)
+    assert not if_range_matches({"if-range": 'W/"abc"'}, WEAK)
+
+
+def test_if_range_date_must_match_exactly():
+    assert if_range_matches({"if-range": MODIFIED}, META)
+    assert not if_range_matches({"if-range": LATER}, META)
+    assert not if_range_matches({"if-range": "not a date"}, META)
+
+
+def test_precondition_response():
+    not_modified = precondition_response(304, {"ETag": '"abc"'})
+    assert not_modified.status_code == 304 and not_modified.headers["etag"] == '"abc"'
+    failed = precondition_response(412, {"ETag": '"abc"'})
+    assert failed.status_code == 412 and "etag" not in failed.headers
@@ -0,0 +1,137 @@
+import asyncio
+import struct
+
+import pytest
+
+from builders import box, full_box, mp4_file, reader, table
+from faststart import VirtualMP4, _shift_offsets, plan_faststart
+from seekindex import build_index
+
+
+def plan(data: bytes) -> VirtualMP4:
+    return asyncio.run(plan_faststart(reader(data), len(data)))
+
+
+def assemble(layout: VirtualMP4, data: bytes, start: int = 0, end: int = None) -> bytes:
+    end = layout.size - 1 if end is None else end
+    return b"".join(piece if piece is not None else data[lo:hi + 1] for piece, lo, hi in layout.pieces(start, end))
+
+
+def offsets_of(data: bytes) -> list:
+    return list(asyncio.run(build_index(reader(data), len(data))).offsets)
+
+
+def stbl_moov(*tables: bytes) -> bytearray:
+    """只含一条轨道采样表的 moov"""
+    return bytearray(box(b'moov', box(b'trak', box(b'mdia', box(b'minf', box(b'stbl', b"".join(tables)))))))
+
+
+# ---- plan_faststart ----
+
+@pytest.mark.parametrize("co64", [False, True])
+def test_relocates_moov_and_shifts_chunk_offsets(co64):
+    data = mp4_file(co64=co64, moov_at_end=True)
+    layout = plan(data)
+    assert layout.relocated
+    assert layout.size == len(data)
+    assert layout.head_end == data.index(b'mdat') - 4
+    assert layout.moov_start == data.index(b'moov') - 4
+    assert layout.moov_end == len(data)
+
+    virtual = assemble(layout, data)
+    assert len(virtual) == len(data)
+    assert virtual[layout.head_end + 4:layout.head_end + 8] == b'moov'
+    # 重排后的关键帧偏移整体后移 len(moov)，指向的内容与原文件相同
+    moved = offsets_of(virtual)
+    original = offsets_of(data)
+    assert moved == [offset + len(layout.moov) for offset in original]
+    for new, old in zip(moved, original):
+        assert virtual[new:new + 10] == data[old:old + 10]
+        assert layout.virtual_offset(old) == new
+
+
+def test_faststart_file_is_not_relocated():
+    assert not plan(mp4_file()).relocated
+
+
+def test_not_mp4_is_not_relocated():
+    assert not plan(b'\0' * 1024).relocated
+
+
+def test_truncated_moov_is_not_relocated():
+    data = mp4_file(moov_at_end=True)
+    assert not plan(data[:-10]).relocated
+
+
+# ---- _shift_offsets ----
+
+def test_shift_only_offsets_between_head_and_moov():
+    moov = stbl_moov(table(b'stco', [(50,), (100,), (150,), (400,)]))
+    assert _shift_offsets(moov, moov_start=300, head_end=100)
+    stco = moov.index(b'stco') + 4
+    assert struct.unpack_from('>4I', moov, stco + 8) == (50, 100 + len(moov), 150 + len(moov), 400)
+
+
+def test_stco_overflow_is_rejected():
+    moov = stbl_moov(table(b'stco', [(2 ** 32 - 10,)]))
+    assert not _shift_offsets(moov, moov_start=2 ** 32 + 100, head_end=0)
+
+
+def test_co64_beyond_32_bits():
+    moov = stbl_moov(table(b'co64', [(2 ** 32 - 10,)], 'Q'))
+    assert _shift_offsets(moov, moov_start=2 ** 32 + 100, head_end=0)
+    assert struct.unpack_from('>Q', moov, moov.index(b'co64') + 12)[0] == 2 ** 32 - 10 + len(moov)
+
+
+def test_fragmented_moov_is_rejected():
+    moov = bytearray(box(b'moov', box(b'mvex', b'')))
+    assert not _shift_offsets(moov, moov_start=300, head_end=100)
+
+
+def test_table_count_beyond_box_is_rejected():
+    moov = stbl_moov(table(b'stco', [(150,)]))
+    struct.pack_into('>I', moov, moov.index(b'stco') + 8, 1000)
+    assert not _shift_offsets(moov, moov_start=300, head_end=100)
+
+
+def test_short_table_box_is_rejected():
+    moov = stbl_moov(full_box(b'stco', b''))
+    assert not _shift_offsets(moov, moov_start=300, head_end=100)
+
+
+# ---- VirtualMP4 ----
+
+@pytest.fixture(scope="module")
+def relocated():
+    data = mp4_file(moov_at_end=True)
+    layout = plan(data)
+    return data, layout, assemble(layout, data)
+
+
+def test_pieces_across_segment_boundaries(relocated):
+    data, layout, virtual = relocated
+    edges = [0, layout.head_end, layout.head_end + len(layout.moov), layout.moov_end, layout.size]
+    points = sorted({p for edge in edges for p in (edge - 1, edge, edge + 1) if 0 <= p < layout.size})
+    for start in points:
+        for end in points:
+            if start <= end:
+                assert assemble(layout, data, start, end) == virtual[start:end + 1], (start, end)
+
+
+def test_virtual_offset_outside_moov_matches_pieces(relocated):
+    data, layout, virtual = relocated
+    for offset in range(layout.moov_start):
+        assert virtual[layout.virtual_offset(offset)] == data[offset]
+    moov = range(layout.moov_start, layout.moov_end)
+    assert sorted(layout.virtual_offset(offset) for offset in moov) == \
+        list(range(layout.head_end, layout.head_end + len(layout.moov)))
+
+
+def test_source_range(relocated):
+    _, layout, _ = relocated
+    moov_first = layout.head_end
+    moov_last = layout.head_end + len(layout.moov) - 1
+    assert layout.source_range(moov_first, moov_last) is None
+    # 跨过 moov 的范围：首尾上游片段的跨度
+    assert layout.source_range(0, moov_last + 10) == (0, layout.head_end + 9)
+    assert layout.source_range(moov_last + 1, layout.size - 1) == (layout.head_end, layout.moov_start - 1)
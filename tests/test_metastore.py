@@ -0,0 +1,102 @@
+import math
+import multiprocessing
+import threading
+
+import pytest
+
+from metastore import InvalidMetadata, MetadataStore, VersionConflict
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MetadataStore(str(tmp_path / "metadata.db"))
+    yield store
+    store.close()
+
+
+def test_wal_mode(store):
+    assert store._conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_put_and_upsert_bump_version(store):
+    assert store.get("a.mp4") is None
+    assert store.put("a.mp4", {"title": "A"}) == 1
+    assert store.put("a.mp4", {"title": "A2", "tags": ["x"]}) == 2
+    assert store.get("a.mp4") == ({"title": "A2", "tags": ["x"]}, 2)
+
+
+def test_expected_version(store):
+    assert store.put("a.mp4", {"title": "A"}, expected_version=0) == 1
+    with pytest.raises(VersionConflict) as info:
+        store.put("a.mp4", {"title": "B"}, expected_version=0)
+    assert info.value.conflicts == {"a.mp4": 1}
+    assert store.put("a.mp4", {"title": "B"}, expected_version=1) == 2
+
+
+def test_batch_conflict_writes_nothing(store):
+    store.put("a.mp4", {"title": "A"})
+    with pytest.raises(VersionConflict):
+        store.put_many([("b.mp4", {"title": "B"}, None), ("a.mp4", {"title": "A2"}, 5)])
+    assert store.get("b.mp4") is None
+    assert store.get("a.mp4") == ({"title": "A"}, 1)
+
+
+def test_batch_get(store):
+    versions = store.put_many([(f"{i}.mkv", {"n": i}, None) for i in range(1200)])
+    assert len(versions) == 1200 and set(versions.values()) == {1}
+    # 超过单条 SQL 的参数上限时分批查询；不存在的路径不出现在结果中
+    found = store.get_many([f"{i}.mkv" for i in range(0, 1300, 3)] + ["0.mkv"])
+    assert set(found) == {f"{i}.mkv" for i in range(0, 1200, 3)}
+    assert found["3.mkv"] == ({"n": 3}, 1)
+
+
+def test_tags_are_replaced_on_update(store):
+    store.put("a.mp4", {"tags": "Drama, drama ,Comedy"})
+    store.put("a.mp4", {"tags": ["Action"]})
+    rows = store._conn.execute("SELECT tag FROM metadata_tags WHERE path = 'a.mp4'").fetchall()
+    assert [row[0] for row in rows] == ["Action"]
+
+
+@pytest.mark.parametrize("metadata", [["not", "an", "object"], "text", {"bad": math.nan}, {"bad": math.inf},
+                                      {"bad": object()}])
+def test_invalid_metadata(store, metadata):
+    with pytest.raises(InvalidMetadata):
+        store.put("a.mp4", metadata)
+    assert store.get("a.mp4") is None
+
+
+def test_concurrent_threads(store):
+    def writer(n):
+        for _ in range(25):
+            store.put("shared.mp4", {"writer": n})
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.get("shared.mp4")[1] == 100
+
+
+def _process_writer(db_path, n, count):
+    store = MetadataStore(db_path, busy_timeout=30)
+    for i in range(count):
+        store.put("shared.mp4", {"writer": n, "i": i})
+        store.put(f"{n}-{i}.mp4", {"writer": n})
+    store.close()
+
+
+def test_concurrent_processes(tmp_path):
+    # 多个 worker 进程各自打开连接，由 SQLite 的文件锁串行化写入，版本号不丢失
+    db_path = str(tmp_path / "metadata.db")
+    MetadataStore(db_path).close()
+    processes = [multiprocessing.Process(target=_process_writer, args=(db_path, n, 30)) for n in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+    store = MetadataStore(db_path)
+    assert store.get("shared.mp4")[1] == 120
+    assert len(store.get_many(f"{n}-{i}.mp4" for n in range(4) for i in range(30))) == 120
+    store.close()
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from ranges import MAX_RANGES, ByteRange, MultipartByteranges, RangeNotSatisfiable, SpanPolicy, parse_range_header
+
+
+def spans(ranges):
+    return [(r.start, r.end) for r in ranges]
+
+
+def test_no_header_or_other_unit():
+    assert parse_range_header(None, 100) is None
+    assert parse_range_header("", 100) is None
+    assert parse_range_header("items=0-1", 100) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=", "bytes=abc", "bytes=5-2", "bytes=-", "bytes=1-2-3", "bytes=0-x"])
+def test_malformed_is_ignored(header):
+    assert parse_range_header(header, 100) is None
+
+
+def test_closed_and_open_ranges():
+    assert spans(parse_range_header("bytes=0-9", 100)) == [(0, 9)]
+    assert spans(parse_range_header("bytes=90-200", 100)) == [(90, 99)]
+    open_range = parse_range_header("bytes=50-", 100)
+    assert spans(open_range) == [(50, 99)]
+    assert open_range[0].open_ended
+
+
+def test_suffix_ranges():
+    assert spans(parse_range_header("bytes=-10", 100)) == [(90, 99)]
+    # 后缀长于文件时返回整个文件
+    assert spans(parse_range_header("bytes=-500", 100)) == [(0, 99)]
+
+
+def test_overlapping_and_adjacent_ranges_are_coalesced():
+    assert spans(parse_range_header("bytes=0-9,5-19", 100)) == [(0, 19)]
+    assert spans(parse_range_header("bytes=20-29,0-9,10-14", 100)) == [(0, 14), (20, 29)]
+    assert spans(parse_range_header("bytes=0-0,-1", 100)) == [(0, 0), (99, 99)]
+    merged = parse_range_header("bytes=10-20,15-", 100)
+    assert spans(merged) == [(10, 99)] and merged[0].open_ended
+
+
+def test_unsatisfiable_parts_are_dropped():
+    assert spans(parse_range_header("bytes=200-300,0-4", 100)) == [(0, 4)]
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=100-200", "bytes=-0", "bytes=150-,300-400"])
+def test_all_unsatisfiable_raises(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header(header, 100)
+
+
+def test_too_many_ranges_collapse_to_one():
+    header = "bytes=" + ",".join(f"{i * 3}-{i * 3}" for i in range(MAX_RANGES + 1))
+    assert spans(parse_range_header(header, 1000)) == [(0, MAX_RANGES * 3)]
+
+
+def test_span_policy_grows_on_sequential_reads_and_resets_on_seek():
+    policy = SpanPolicy(min_span=10, max_span=40)
+    first = policy.clip("k", ByteRange(0, 999, True))
+    second = policy.clip("k", ByteRange(first.end + 1, 999, True))
+    third = policy.clip("k", ByteRange(second.end + 1, 999, True))
+    assert (first.length, second.length, third.length) == (10, 20, 40)
+    assert policy.clip("k", ByteRange(500, 999, True)).length == 10
+    # 闭区间不截断
+    assert policy.clip("k", ByteRange(0, 99)).length == 100
+
+
+def test_multipart_body_matches_content_length():
+    data = bytes(range(100))
+    ranges = parse_range_header("bytes=0-4,50-59", len(data))
+    multipart = MultipartByteranges(ranges, len(data), "video/mp4")
+
+    async def read(start, end):
+        yield data[start:end + 1]
+
+    async def collect():
+        return b"".join([chunk async for chunk in multipart.iter_body(read)])
+
+    body = asyncio.run(collect())
+    assert len(body) == multipart.content_length
+    assert multipart.content_type == f"multipart/byteranges; boundary={multipart.boundary}"
+    assert b"Content-Range: bytes 0-4/100\r\n\r\n" + data[0:5] + b"\r\n" in body
+    assert b"Content-Range: bytes 50-59/100\r\n\r\n" + data[50:60] + b"\r\n" in body
+    assert body.endswith(f"--{multipart.boundary}--\r\n".encode())
@@ -0,0 +1,164 @@
+import asyncio
+import shutil
+import struct
+import subprocess
+
+import pytest
+
+from builders import avi_file, box, full_box, mkv_file, mp4_file, reader
+from seekindex import MKV_CLUSTER, SeekIndex, SeekIndexError, build_index
+
+
+def index_of(data: bytes) -> SeekIndex:
+    return asyncio.run(build_index(reader(data), len(data)))
+
+
+def mdat_body(data: bytes) -> int:
+    return data.index(b'mdat') + 4
+
+
+# ---- SeekIndex ----
+
+def test_finish_sorts_and_drops_duplicate_times():
+    index = SeekIndex("mp4")
+    for time, offset in [(2.0, 300), (0.0, 100), (1.0, 200), (1.0, 250)]:
+        index.add(time, offset)
+    index.finish()
+    assert list(index.times) == [0.0, 1.0, 2.0]
+    assert list(index.offsets) == [100, 200, 300]
+
+
+def test_lookup():
+    index = SeekIndex("mp4")
+    assert index.lookup(1.0) is None
+    for time, offset in [(0.0, 100), (1.0, 200), (2.0, 300)]:
+        index.add(time, offset)
+    assert index.lookup(0.5) == (0, 1)
+    assert index.lookup(1.0) == (1, 2)
+    assert index.lookup(9.0) == (2, 3)
+
+
+# ---- MP4 ----
+
+def test_mp4_keyframes_from_stss():
+    data = mp4_file()
+    index = index_of(data)
+    body = mdat_body(data)
+    assert index.container == "mp4"
+    assert index.duration == 3.0
+    assert list(index.times) == [0.0, 1.0]
+    # 第 3 个采样与第 1 个同块，偏移为块偏移加上前两个采样的大小
+    assert list(index.offsets) == [body + 1, body + 1 + 10 + 20]
+
+
+def test_mp4_without_stss_uses_min_interval():
+    data = mp4_file(sync=None)
+    index = index_of(data)
+    body = mdat_body(data)
+    assert list(index.times) == [0.0, 1.0, 2.0]
+    assert list(index.offsets) == [body + 1, body + 31, body + 1 + 60 + 40]
+
+
+@pytest.mark.parametrize("co64", [False, True])
+@pytest.mark.parametrize("moov_at_end", [False, True])
+def test_mp4_layouts(co64, moov_at_end):
+    data = mp4_file(co64=co64, moov_at_end=moov_at_end)
+    body = mdat_body(data)
+    assert list(index_of(data).offsets) == [body + 1, body + 31]
+
+
+def test_mp4_truncated_moov():
+    data = mp4_file(moov_at_end=True)
+    with pytest.raises(SeekIndexError):
+        index_of(data[:-10])
+
+
+def test_mp4_without_moov():
+    data = box(b'ftyp', b'isom\0\0\2\0') + box(b'mdat', b'\0' * 100)
+    with pytest.raises(SeekIndexError, match="No moov"):
+        index_of(data)
+
+
+def test_mp4_table_count_beyond_box_is_clipped():
+    data = bytearray(mp4_file())
+    # 视频轨的 stco 声称有 1000 个条目，只应读取 box 内的两个
+    stco = data.index(b'stco', data.index(b'vide'))
+    struct.pack_into('>I', data, stco + 8, 1000)
+    body = mdat_body(data)
+    assert list(index_of(bytes(data)).offsets) == [body + 1, body + 31]
+
+
+def test_mp4_short_box_is_malformed():
+    moov = box(b'moov', box(b'trak', box(b'mdia', b"".join([
+        full_box(b'hdlr', struct.pack('>I4s', 0, b'vide')),
+        box(b'minf', box(b'stbl', b'')),
+        full_box(b'mdhd', b''),
+    ]))))
+    with pytest.raises(SeekIndexError, match="Malformed"):
+        index_of(box(b'ftyp', b'isom\0\0\2\0') + moov + box(b'mdat', b'\0' * 16))
+
+
+# ---- Matroska ----
+
+def test_mkv_cues_via_seekhead():
+    data, clusters = mkv_file()
+    index = index_of(data)
+    assert index.container == "matroska"
+    assert index.duration == 3.0
+    # 音频轨的 Cue 被忽略
+    assert list(index.times) == [0.0, 2.0]
+    assert list(index.offsets) == [clusters[0], clusters[2]]
+    cluster_id = MKV_CLUSTER.to_bytes(4, 'big')
+    assert all(data[offset:offset + 4] == cluster_id for offset in index.offsets)
+
+
+def test_mkv_truncated_cues():
+    data, _ = mkv_file()
+    with pytest.raises(SeekIndexError, match="No Matroska Cues"):
+        index_of(data[:-5])
+
+
+def test_mkv_malformed_ebml():
+    with pytest.raises(SeekIndexError, match="No Matroska segment"):
+        index_of(b'\x1a\x45\xdf\xa3' + b'\0' * 32)
+
+
+# ---- AVI ----
+
+@pytest.mark.parametrize("absolute", [False, True])
+def test_avi_idx1_keyframes(absolute):
+    data, frames = avi_file(absolute=absolute)
+    index = index_of(data)
+    assert index.container == "avi"
+    assert index.duration == 2.0
+    assert list(index.times) == [0.0, 1.0]
+    assert list(index.offsets) == [frames[0], frames[2]]
+    assert all(data[offset:offset + 4] == b'01dc' for offset in index.offsets)
+
+
+def test_avi_without_idx1():
+    data, _ = avi_file(with_index=False)
+    with pytest.raises(SeekIndexError, match="idx1"):
+        index_of(data)
+
+
+def test_unsupported_container():
+    with pytest.raises(SeekIndexError, match="Unsupported"):
+        index_of(b'\0' * 64)
+
+
+# ---- ffmpeg 生成的文件 ----
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg not installed")
+@pytest.mark.parametrize("extension", ["mp4", "mkv"])
+def test_ffmpeg_keyframes(tmp_path, extension):
+    path = tmp_path / f"sample.{extension}"
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc=size=64x48:rate=10:duration=3",
+         "-c:v", "libx264", "-preset", "ultrafast", "-bf", "0", "-g", "10", "-keyint_min", "10",
+         "-sc_threshold", "0", str(path)],
+        check=True,
+    )
+    index = index_of(path.read_bytes())
+    assert [round(t, 3) for t in index.times] == [0.0, 1.0, 2.0]
+    assert list(index.offsets) == sorted(index.offsets)
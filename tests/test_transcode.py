@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from builders import box
+from transcode import TranscodeError, check_mp4_output, first_fragment
+
+
+def chunks_of(data: bytes, size: int):
+    async def output():
+        for i in range(0, len(data), size):
+            yield data[i:i + size]
+    return output()
+
+
+# ---- first_fragment ----
+
+@pytest.mark.parametrize("size", [1, 7, 1024])
+def test_first_fragment_waits_for_moof(size):
+    head = box(b'ftyp', b'isom') + box(b'moov', b'\0' * 40)
+    data = head + box(b'moof', b'\0' * 16) + box(b'mdat', b'\0' * 100)
+    prefix = asyncio.run(first_fragment(chunks_of(data, size)))
+    assert data.startswith(prefix)
+    assert len(prefix) >= len(head) + 8
+
+
+def test_output_without_moof_is_rejected():
+    # 源文件的 moov 无法读取时 ffmpeg 只输出 ftyp 和空的 moov
+    data = box(b'ftyp', b'isom') + box(b'moov', b'\0' * 40)
+    with pytest.raises(TranscodeError, match="no media"):
+        asyncio.run(first_fragment(chunks_of(data, 16)))
+
+
+# ---- check_mp4_output ----
+
+def test_mp4_output_with_media_is_accepted(tmp_path):
+    path = tmp_path / "out.mp4"
+    path.write_bytes(box(b'ftyp', b'isom') + box(b'moov', b'\0' * 40) + box(b'mdat', b'\0' * 100))
+    check_mp4_output(str(path))
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    box(b'ftyp', b'isom') + box(b'free') + box(b'mdat') + box(b'moov', b'\0' * 200),
+    box(b'ftyp', b'isom') + box(b'mdat', b'\0' * 100),
+])
+def test_mp4_output_without_media_is_rejected(tmp_path, data):
+    path = tmp_path / "out.mp4"
+    path.write_bytes(data)
+    with pytest.raises(TranscodeError, match="no media"):
+        check_mp4_output(str(path))
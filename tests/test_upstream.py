@@ -0,0 +1,210 @@
+import asyncio
+import gc
+
+import httpx
+import pytest
+
+from blockcache import file_version
+from metacache import FileMeta
+from settings import Settings
+from upstream import DAVEntry, MirrorSet, UpstreamError, WebDAVUpstream, _parse_multistatus
+
+MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+class FakeClient:
+    """按设定的延迟返回数据或抛出错误的 DAVClient 替身，记录数据流是否被关闭"""
+
+    def __init__(self, name: str, delay: float = 0.0, data: bytes = b"data", error: Exception = None):
+        self.base_url = name
+        self.delay = delay
+        self.data = data
+        self.error = error
+        self.etags = []
+        self.opened = 0
+        self.closed = 0
+
+    async def stream(self, remote_path, start=None, end=None, etag="", chunk_size=64 * 1024):
+        self.opened += 1
+        self.etags.append(etag)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.error is not None:
+                raise self.error
+            yield self.data
+        finally:
+            self.closed += 1
+
+    async def stat(self, remote_path):
+        if self.error is not None:
+            raise self.error
+        return FileMeta(size=10, etag=f"{self.base_url}-etag", last_modified=MODIFIED)
+
+    async def list(self, remote_path):
+        return [DAVEntry("a.mp4", f"{remote_path}/a.mp4", False, await self.stat(remote_path))]
+
+    async def aclose(self):
+        pass
+
+
+def run(coro_fn):
+    """运行协程，收集事件循环报告的未处理异常（例如 Task exception was never retrieved）"""
+    errors = []
+
+    async def main():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        return await coro_fn()
+
+    result = asyncio.run(main())
+    gc.collect()
+    return result, errors
+
+
+def upstream_with(*clients) -> WebDAVUpstream:
+    upstream = WebDAVUpstream(Settings())
+    upstream.mirrors = MirrorSet(list(clients), hedge_min_delay=0.01)
+    return upstream
+
+
+def warm_up(mirrors: MirrorSet, latency: float = 0.01):
+    """预置首字节时间样本，使对冲等待时间接近 latency"""
+    for mirror in mirrors.mirrors:
+        for _ in range(10):
+            mirror.record(latency)
+        mirror.expected = None
+
+
+# ---- 元数据版本 ----
+
+def test_failover_metadata_has_same_version_as_primary():
+    primary, mirror = FakeClient("primary"), FakeClient("mirror")
+
+    async def scenario():
+        upstream = upstream_with(primary, mirror)
+        from_primary = await upstream.stat("/media/a.mp4")
+        primary.error = httpx.ConnectError("down")
+        from_mirror = await upstream.stat("/media/a.mp4")
+        listed = await upstream.list("/media")
+        return from_primary, from_mirror, listed
+
+    (from_primary, from_mirror, listed), errors = run(scenario)
+    assert from_primary.etag == from_mirror.etag == ""
+    assert file_version(from_primary) == file_version(from_mirror) == f"10-{MODIFIED}"
+    assert listed[0].meta.etag == ""
+
+
+def test_single_server_keeps_etag():
+    async def scenario():
+        return await upstream_with(FakeClient("primary")).stat("/media/a.mp4")
+
+    meta, _ = run(scenario)
+    assert meta.etag == "primary-etag"
+
+
+def test_failover_stream_after_mirror_metadata_is_not_rejected():
+    primary, mirror = FakeClient("primary", data=b"primary"), FakeClient("mirror")
+
+    async def scenario():
+        upstream = upstream_with(primary, mirror)
+        primary.error = httpx.ConnectError("down")
+        meta = await upstream.stat("/media/a.mp4")
+        primary.error = None
+        return b"".join([chunk async for chunk in upstream.stream("/media/a.mp4", 0, 9, etag=meta.etag)])
+
+    data, errors = run(scenario)
+    assert data == b"primary"
+    assert primary.etags == [""]
+    assert not errors
+
+
+def test_weak_etag_is_flagged():
+    body = b"""<?xml version="1.0"?>
+<d:multistatus xmlns:d="DAV:">
+  <d:response><d:href>/media/weak.mp4</d:href><d:propstat><d:prop>
+    <d:getcontentlength>10</d:getcontentlength><d:getetag>W/"abc"</d:getetag>
+  </d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>
+  <d:response><d:href>/media/strong.mp4</d:href><d:propstat><d:prop>
+    <d:getcontentlength>10</d:getcontentlength><d:getetag>"def"</d:getetag>
+  </d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>
+</d:multistatus>"""
+    weak, strong = [entry.meta for entry in _parse_multistatus(body)]
+    assert (weak.etag, weak.weak_etag) == ("abc", True)
+    assert (strong.etag, strong.weak_etag) == ("def", False)
+
+
+# ---- 对冲请求 ----
+
+def test_hedge_loser_is_cancelled_and_closed():
+    slow, fast = FakeClient("slow", delay=5, data=b"slow"), FakeClient("fast", delay=0, data=b"fast")
+
+    async def scenario():
+        mirrors = MirrorSet([slow, fast], hedge_min_delay=0.01)
+        warm_up(mirrors)
+        data = b"".join([chunk async for chunk in mirrors.stream("/a.mp4", 0, 9)])
+        return data, [mirror.inflight for mirror in mirrors.mirrors], len(mirrors._cleanups)
+
+    (data, inflight, cleanups), errors = run(scenario)
+    assert data == b"fast"
+    assert slow.opened == slow.closed == 1
+    assert fast.opened == fast.closed == 1
+    assert inflight == [0, 0]
+    assert cleanups == 0
+    assert not errors
+
+
+def test_definite_error_closes_hedge():
+    # 原请求在对冲请求返回前得到 404：错误直接抛出，对冲请求被取消并关闭
+    failing = FakeClient("failing", delay=0.05, error=UpstreamError(404, "gone"))
+    slow = FakeClient("slow", delay=5)
+
+    async def scenario():
+        mirrors = MirrorSet([failing, slow], hedge_min_delay=0.01)
+        warm_up(mirrors)
+        with pytest.raises(UpstreamError):
+            async for _ in mirrors.stream("/a.mp4", 0, 9):
+                pass
+        return [mirror.inflight for mirror in mirrors.mirrors]
+
+    inflight, errors = run(scenario)
+    assert failing.closed == 1
+    assert slow.opened == slow.closed == 1
+    assert inflight == [0, 0]
+    assert not errors
+
+
+def test_cancelled_reader_closes_all_requests():
+    first, second = FakeClient("first", delay=5), FakeClient("second", delay=5)
+
+    async def scenario():
+        mirrors = MirrorSet([first, second], hedge_min_delay=0.01)
+        warm_up(mirrors)
+
+        async def read():
+            return [chunk async for chunk in mirrors.stream("/a.mp4", 0, 9)]
+
+        reader = asyncio.ensure_future(read())
+        await asyncio.sleep(0.1)
+        reader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await reader
+        return [mirror.inflight for mirror in mirrors.mirrors], len(mirrors._cleanups)
+
+    (inflight, cleanups), errors = run(scenario)
+    assert first.opened == first.closed == 1
+    assert second.opened == second.closed == 1
+    assert inflight == [0, 0]
+    assert cleanups == 0
+    assert not errors
+
+
+def test_retryable_error_fails_over():
+    broken, healthy = FakeClient("broken", error=UpstreamError(503, "busy")), FakeClient("healthy", data=b"ok")
+
+    async def scenario():
+        mirrors = MirrorSet([broken, healthy], hedge_percentile=0)
+        return b"".join([chunk async for chunk in mirrors.stream("/a.mp4", 0, 9)])
+
+    data, errors = run(scenario)
+    assert data == b"ok"
+    assert broken.closed == 1
+    assert not errors
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import math
+import os
+import shutil
+import tempfile
+from collections import deque
+from typing import Awaitable, Callable, Iterable, List, Tuple
+
+import ffmpeg
+
+from jobs import SchedulerBusy
+from transcode import TranscodeError, run_ffmpeg
+
+THUMBNAIL_CONTENT_TYPE = "image/jpeg"
+VTT_CONTENT_TYPE = "text/vtt"
+
+# 缩略图 ffmpeg 的调度优先级（nice），让出 CPU 给播放中的转码
+THUMBNAIL_NICE = 10
+
+# 封面取片位置：时长的 10%，最多 30 秒，避开片头黑屏
+POSTER_POSITION = 0.1
+POSTER_MAX_SECONDS = 30
+
+# 雪碧图：每行帧数与单张图的最大帧数（超长视频按比例拉大间隔）
+SPRITE_COLUMNS = 10
+SPRITE_MAX_FRAMES = 100
+
+
+def poster_time(duration: float) -> float:
+    return min(duration * POSTER_POSITION, POSTER_MAX_SECONDS)
+
+
+def scaled_size(width: int, source_width: int, source_height: int) -> Tuple[int, int]:
+    """按源画面比例计算缩略图尺寸，宽高取偶数（编码器要求）"""
+    width = max(width // 2 * 2, 2)
+    if source_width <= 0 or source_height <= 0:
+        return width, max(round(width * 9 / 16 / 2) * 2, 2)
+    return width, max(round(width * source_height / source_width / 2) * 2, 2)
+
+
+def trickplay_interval(duration: float, interval: float) -> float:
+    """帧间隔：默认 interval 秒，超长视频放大间隔使帧数不超过 SPRITE_MAX_FRAMES"""
+    return max(interval, duration / SPRITE_MAX_FRAMES)
+
+
+def trickplay_times(duration: float, interval: float) -> List[float]:
+    """每个预览帧的取片时间：各区间的中点"""
+    count = min(max(math.ceil(duration / interval), 1), SPRITE_MAX_FRAMES)
+    return [min(i * interval + interval / 2, max(duration - 0.1, 0)) for i in range(count)]
+
+
+def frame_args(input_url: str, output_path: str, at: float, width: int, height: int) -> List[str]:
+    """构建单帧截图命令
+
+    在输入端 -ss 跳转并直接取最近的关键帧（不逐帧解码到精确位置），
+    ffmpeg 只通过范围请求读取该位置附近的数据。
+    """
+    return (
+        ffmpeg
+        .input(input_url, ss=f"{at:.3f}", noaccurate_seek=None)
+        .output(
+            output_path,
+            format='mjpeg',
+            vframes=1,
+            vf=f"scale={width}:{height}",
+            threads=1,
+            loglevel='error',
+            **{'q:v': 5}
+        )
+        .overwrite_output()
+        .compile()
+    )
+
+
+def tile_args(frame_pattern: str, output_path: str, columns: int, rows: int) -> List[str]:
+    """把按序号命名的帧拼接为一张雪碧图"""
+    return (
+        ffmpeg
+        .input(frame_pattern, format='image2')
+        .output(
+            output_path,
+            format='mjpeg',
+            vframes=1,
+            vf=f"tile={columns}x{rows}",
+            threads=1,
+            loglevel='error',
+            **{'q:v': 5}
+        )
+        .overwrite_output()
+        .compile()
+    )
+
+
+def sprite_grid(count: int) -> Tuple[int, int]:
+    """雪碧图的 (列数, 行数)"""
+    columns = min(count, SPRITE_COLUMNS)
+    return columns, math.ceil(count / columns)
+
+
+def _timestamp(seconds: float) -> str:
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600 * 1000)
+    minutes, millis = divmod(millis, 60 * 1000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}.{millis:03d}"
+
+
+def build_vtt(duration: float, interval: float, width: int, height: int,
+              sprite_uri: str = "sprite.jpg") -> str:
+    """生成拖动预览的 WebVTT 索引，每条 cue 指向雪碧图中的一个区域（#xywh）"""
+    count = len(trickplay_times(duration, interval))
+    columns, _ = sprite_grid(count)
+    lines = ["WEBVTT", ""]
+    for i in range(count):
+        start = i * interval
+        end = duration if i == count - 1 else min((i + 1) * interval, duration)
+        x, y = (i % columns) * width, (i // columns) * height
+        lines.append(f"{_timestamp(start)} --> {_timestamp(end)}")
+        lines.append(f"{sprite_uri}#xywh={x},{y},{width},{height}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+async def generate_poster(input_url: str, output_path: str, at: float, width: int, height: int):
+    await run_ffmpeg(frame_args(input_url, output_path, at, width, height), nice=THUMBNAIL_NICE)
+
+
+async def generate_sprite(input_url: str, output_path: str, times: List[float], width: int, height: int):
+    """逐帧跳转截图后拼接为雪碧图
+
+    每帧由独立的 ffmpeg 进程通过范围请求读取，不需要下载或解码整个文件。
+    """
+    with tempfile.TemporaryDirectory(prefix="noediv_sprite_") as directory:
+        previous = None
+        for i, at in enumerate(times):
+            frame = os.path.join(directory, f"frame_{i:04d}.jpg")
+            try:
+                await generate_poster(input_url, frame, at, width, height)
+                if not os.path.exists(frame):
+                    raise TranscodeError(f"No frame at {at:.3f}s")
+            except TranscodeError:
+                if previous is None:
+                    raise
+                # 个别位置取帧失败（如文件尾部损坏）时重复上一帧，保持网格与 WebVTT 索引对齐
+                logging.warning(f"截取预览帧失败, 使用上一帧: {at:.1f}s")
+                shutil.copyfile(previous, frame)
+            previous = frame
+        columns, rows = sprite_grid(len(times))
+        await run_ffmpeg(
+            tile_args(os.path.join(directory, "frame_%04d.jpg"), output_path, columns, rows),
+            nice=THUMBNAIL_NICE,
+        )
+
+
+class ThumbnailPrewarmer:
+    """按目录批量预生成缩略图
+
+    待处理文件在内存队列中去重，后台任务一次只生成一个文件，
+    不会占满缩略图任务队列，交互请求始终可以插队。
+    任务队列已满时不丢弃文件，按 Retry-After 等待后重试。
+    """
+
+    def __init__(self, generate: Callable[[str], Awaitable[None]], max_pending: int = 10000):
+        self.generate = generate
+        self.max_pending = max_pending
+        self.generated = 0
+        self.failed = 0
+        self._pending = deque()
+        self._queued = set()
+        self._task = None
+
+    def enqueue(self, filenames: Iterable[str], urgent: bool = False) -> int:
+        """加入待处理队列，返回新加入的数量；urgent 为 True 时排到队首（已在队列中的也会提前）"""
+        added = 0
+        for filename in filenames:
+            if filename in self._queued:
+                if urgent and filename in self._pending:
+                    self._pending.remove(filename)
+                    self._pending.appendleft(filename)
+                continue
+            if len(self._pending) >= self.max_pending:
+                continue
+            if urgent:
+                self._pending.appendleft(filename)
+            else:
+                self._pending.append(filename)
+            self._queued.add(filename)
+            added += 1
+        if self._pending and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return added
+
+    async def _run(self):
+        while self._pending:
+            filename = self._pending.popleft()
+            try:
+                await self.generate(filename)
+                self.generated += 1
+            except SchedulerBusy as e:
+                # 交互请求占满了队列，稍后重试，文件保留在队首
+                self._pending.appendleft(filename)
+                await asyncio.sleep(e.retry_after)
+                continue
+            except asyncio.CancelledError:
+                self._queued.discard(filename)
+                raise
+            except Exception as e:
+                self.failed += 1
+                logging.warning(f"预生成缩略图失败: {filename}: {str(e)}")
+            self._queued.discard(filename)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "running": self._task is not None and not self._task.done(),
+            "generated": self.generated,
+            "failed": self.failed,
+        }
+
+    async def aclose(self):
+        self._pending.clear()
+        self._queued.clear()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
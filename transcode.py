@@ -0,0 +1,288 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+from collections import deque
+from typing import AsyncIterator, List, Optional, Tuple
+
+import ffmpeg
+
+# 分片 MP4：无需回写 moov，边转码边输出
+FRAGMENTED_MOVFLAGS = 'frag_keyframe+empty_moov+default_base_moof'
+
+# 与原有整文件转换保持一致的编码参数
+DEFAULT_ENCODE_OPTIONS = {
+    'vcodec': 'libx264',
+    'preset': 'ultrafast',
+    'crf': 23,
+    'acodec': 'aac',
+    'audio_bitrate': '128k',
+}
+
+
+# 仅复制流（重新封装），编码失败时的后备方案
+COPY_OPTIONS = {
+    'vcodec': 'copy',
+    'acodec': 'copy',
+}
+
+
+class TranscodeError(Exception):
+    """ffmpeg 进程异常退出"""
+
+
+def _with_threads(options: dict, threads: int) -> dict:
+    options = dict(options or DEFAULT_ENCODE_OPTIONS)
+    if threads > 0:
+        # 限制单个任务的编码线程数，避免少数任务占满所有核心
+        options['threads'] = threads
+    return options
+
+
+def streaming_args(options: dict = None, threads: int = 0, input_url: str = 'pipe:0') -> List[str]:
+    """构建 输入 -> stdout 的分片 MP4 转码命令
+
+    input_url 默认为 stdin；moov 位于文件末尾的 MP4/MOV 必须使用可随机访问的地址，
+    否则 ffmpeg 读不到 moov，只输出不含任何分片的空 MP4。
+    """
+    return (
+        ffmpeg
+        .input(input_url)
+        .output(
+            'pipe:1',
+            format='mp4',
+            movflags=FRAGMENTED_MOVFLAGS,
+            loglevel='error',
+            **_with_threads(options, threads)
+        )
+        .compile()
+    )
+
+
+def file_args(input_url: str, output_path: str, options: dict = None, threads: int = 0) -> List[str]:
+    """构建 输入 -> 文件 的 faststart MP4 转码命令，输出可随机访问"""
+    return (
+        ffmpeg
+        .input(input_url)
+        .output(
+            output_path,
+            format='mp4',
+            movflags='faststart',
+            loglevel='error',
+            **_with_threads(options, threads)
+        )
+        .overwrite_output()
+        .compile()
+    )
+
+
+def segment_args(input_url: str, output_path: str, start: float, duration: float,
+                 options: dict = None, threads: int = 0) -> List[str]:
+    """构建单个 HLS 分段（MPEG-TS）的转码命令
+
+    在输入端 -ss 跳转，ffmpeg 只通过范围请求读取所需部分；
+    output_ts_offset 保持各分段时间戳连续，分段可以独立、乱序生成。
+    """
+    return (
+        ffmpeg
+        .input(input_url, ss=f"{start:.3f}", t=f"{duration:.3f}")
+        .output(
+            output_path,
+            format='mpegts',
+            output_ts_offset=f"{start:.3f}",
+            loglevel='error',
+            **_with_threads(options, threads)
+        )
+        .overwrite_output()
+        .compile()
+    )
+
+
+async def transcode_to_file(input_url: str, output_path: str, options: dict = None, threads: int = 0):
+    """把 input_url 转码为本地 MP4 文件
+
+    input_url 须可随机访问（本地路径或支持范围请求的 HTTP 地址），moov 在末尾的 MP4/MOV 才能正确读取。
+    输出不含媒体数据时抛出 TranscodeError，调用方不会缓存这样的结果。
+    """
+    await run_ffmpeg(file_args(input_url, output_path, options, threads))
+    check_mp4_output(output_path)
+
+
+def check_mp4_output(path: str):
+    """确认 MP4 文件包含 moov 和非空的 mdat
+
+    ffmpeg 读不到输入的 moov 时仍可能以 0 退出，只写出几百字节的空 MP4。
+    """
+    boxes = {}
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        position = 0
+        while position + 8 <= size:
+            f.seek(position)
+            header = f.read(16)
+            length, kind = struct.unpack_from('>I4s', header)
+            if length == 1 and len(header) == 16:
+                length = struct.unpack_from('>Q', header, 8)[0]
+            elif length == 0:
+                length = size - position
+            if length < 8:
+                break
+            boxes[kind] = boxes.get(kind, 0) + length
+            position += length
+    if b'moov' not in boxes or boxes.get(b'mdat', 0) <= 8:
+        raise TranscodeError(f"File conversion produced no media ({size} bytes)")
+
+
+async def stream_transcode(source: Optional[AsyncIterator[bytes]], args: List[str],
+                           chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """把 source 通过管道送入 ffmpeg，并逐块返回 ffmpeg 的输出
+
+    写入 stdin 时等待 drain，读取 stdout 时按固定块大小读取，
+    因此内存占用只与管道缓冲区有关，与文件大小无关。
+    source 为 None 时 ffmpeg 自行读取 args 中的输入地址。
+    调用方停止迭代（如客户端断开）时会终止 ffmpeg。
+    """
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.PIPE if source is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stderr_tail = deque(maxlen=20)
+
+    async def feed():
+        if source is None:
+            return
+        try:
+            async for chunk in source:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg 已提前退出，由返回码反映错误
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except Exception:
+                pass
+
+    async def collect_stderr():
+        async for line in process.stderr:
+            stderr_tail.append(line.decode('utf-8', errors='replace').rstrip())
+
+    feeder = asyncio.create_task(feed())
+    stderr_reader = asyncio.create_task(collect_stderr())
+    try:
+        while True:
+            chunk = await process.stdout.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        returncode = await process.wait()
+        await stderr_reader
+        # 上游读取失败时优先抛出上游错误
+        await feeder
+        if returncode != 0:
+            raise TranscodeError(f"ffmpeg exited with {returncode}: {' | '.join(stderr_tail)}")
+    finally:
+        feeder.cancel()
+        stderr_reader.cancel()
+        if process.returncode is None:
+            logging.info("终止未完成的 ffmpeg 进程")
+            process.kill()
+            await process.wait()
+        # 等待写入任务退出后关闭源数据流，释放上游连接
+        await asyncio.gather(feeder, stderr_reader, return_exceptions=True)
+        if source is not None and hasattr(source, "aclose"):
+            await source.aclose()
+
+
+def _find_box(data: bytes, kind: bytes) -> Tuple[bool, bool]:
+    """在 data 的顶层 box 中查找 kind，返回 (是否找到, 是否还需要更多数据才能判断)"""
+    position = 0
+    while position + 8 <= len(data):
+        size, found = struct.unpack_from('>I4s', data, position)
+        if found == kind:
+            return True, False
+        if size == 1:
+            if position + 16 > len(data):
+                return False, True
+            size = struct.unpack_from('>Q', data, position + 8)[0]
+        if size < 8:
+            # size 为 0 表示延续到流末尾，之后不会再有顶层 box
+            return False, False
+        position += size
+    return False, True
+
+
+async def first_fragment(output: AsyncIterator[bytes]) -> bytes:
+    """读取分片 MP4 输出直到出现第一个 moof，返回已读取的数据
+
+    输入不完整或无法识别时 ffmpeg 仍可能正常退出，只输出 ftyp 和空的 moov；
+    这种输出不含任何媒体数据，抛出 TranscodeError 以便调用方改用其它方式。
+    """
+    head = b""
+    async for chunk in output:
+        head += chunk
+        found, more = _find_box(head, b'moof')
+        if found:
+            return head
+        if not more:
+            break
+    raise TranscodeError("File conversion produced no media fragments")
+
+
+async def run_ffmpeg(args: List[str], nice: int = 0):
+    """执行不需要管道输入输出的 ffmpeg 命令，失败时抛出 TranscodeError
+
+    nice 大于 0 时降低进程的调度优先级（仅 POSIX），用于后台任务。
+    """
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+        preexec_fn=(lambda: os.nice(nice)) if nice > 0 and os.name == 'posix' else None,
+    )
+    try:
+        _, stderr = await process.communicate()
+    finally:
+        if process.returncode is None:
+            logging.info("终止未完成的 ffmpeg 进程")
+            process.kill()
+            await process.wait()
+    if process.returncode != 0:
+        tail = stderr.decode('utf-8', errors='replace').strip().splitlines()[-20:]
+        raise TranscodeError(f"ffmpeg exited with {process.returncode}: {' | '.join(tail)}")
+
+
+async def probe_media(input_url: str, timeout: float = 30) -> dict:
+    """用 ffprobe 读取容器和流信息（JSON）
+
+    输入为 HTTP 地址时 ffprobe 只按需发出范围请求读取文件头、moov 或 Cues，
+    不会下载整个文件。
+    """
+    process = await asyncio.create_subprocess_exec(
+        'ffprobe', '-v', 'error',
+        '-print_format', 'json',
+        '-show_format', '-show_streams',
+        input_url,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        raise TranscodeError(f"ffprobe timed out after {timeout}s")
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    if process.returncode != 0:
+        raise TranscodeError(f"ffprobe exited with {process.returncode}: {stderr.decode('utf-8', errors='replace').strip()}")
+    try:
+        return json.loads(stdout.decode('utf-8', errors='replace'))
+    except ValueError:
+        raise TranscodeError("ffprobe returned invalid JSON")
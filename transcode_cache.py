@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+
+from blockcache import file_version
+from metacache import FileMeta
+
+PART_SUFFIX = ".part"
+
+
+def cache_key(remote_path: str, meta: FileMeta, options: dict) -> str:
+    """转码结果的缓存键：源路径 + 文件版本 + 编码参数"""
+    raw = json.dumps([remote_path, file_version(meta), options], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TranscodeCache:
+    """转码输出的磁盘缓存
+
+    - 输出先写入 .part 临时文件，完成后 os.replace 原子发布
+    - 相同键的并发请求只执行一次转码，其余请求等待同一个任务（single-flight）
+    - 总大小超过 max_bytes 时按最近访问时间（mtime）淘汰
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._inflight: Dict[str, asyncio.Task] = {}
+        os.makedirs(directory, exist_ok=True)
+        self._remove_partials()
+
+    def _remove_partials(self):
+        # 清理上次异常退出遗留的临时文件
+        for name in os.listdir(self.directory):
+            if PART_SUFFIX in name:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def path_for(self, key: str, suffix: str = ".mp4") -> str:
+        return os.path.join(self.directory, key + suffix)
+
+    def lookup(self, key: str, suffix: str = ".mp4") -> Optional[str]:
+        """命中时返回文件路径并刷新访问时间"""
+        path = self.path_for(key, suffix)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def is_pending(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def get_or_create(self, key: str, producer: Callable[[str], Awaitable[None]],
+                            suffix: str = ".mp4") -> str:
+        """返回缓存文件路径；不存在时调用 producer(临时路径) 生成
+
+        生成任务与发起请求解耦：请求被取消时任务继续执行，供其他等待者使用。
+        """
+        path = self.lookup(key, suffix)
+        if path is not None:
+            self.hits += 1
+            return path
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.get_running_loop().create_task(self._produce(key, producer, suffix))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+        else:
+            logging.info(f"等待进行中的转码任务: {key}")
+            self.hits += 1
+        return await asyncio.shield(task)
+
+    def cancel(self, key: str) -> bool:
+        """取消进行中的生成任务"""
+        task = self._inflight.get(key)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    def _finished(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        # 取出异常，避免所有等待者都已离开时出现未处理异常的警告
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"转码任务失败: {key}: {task.exception()}")
+
+    async def _produce(self, key: str, producer: Callable[[str], Awaitable[None]], suffix: str) -> str:
+        final_path = self.path_for(key, suffix)
+        part_path = f"{final_path}{PART_SUFFIX}-{uuid.uuid4().hex}"
+        started = time.monotonic()
+        try:
+            await producer(part_path)
+            os.replace(part_path, final_path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        logging.info(f"转码结果已缓存: {final_path}, 耗时 {time.monotonic() - started:.1f}s")
+        self.evict(keep=final_path)
+        return final_path
+
+    def evict(self, keep: Optional[str] = None):
+        """超出容量时删除最久未访问的文件（keep 为刚发布、即将返回的文件）"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if PART_SUFFIX in name or path == keep:
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        if keep and os.path.exists(keep):
+            total += os.path.getsize(keep)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                logging.info(f"转码缓存淘汰: {path}")
+            except OSError as e:
+                logging.warning(f"删除转码缓存失败: {path}: {str(e)}")
+
+    def clear(self) -> int:
+        removed = 0
+        for name in os.listdir(self.directory):
+            if PART_SUFFIX in name:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def stats(self) -> dict:
+        files = [n for n in os.listdir(self.directory) if PART_SUFFIX not in n]
+        size = sum(os.path.getsize(os.path.join(self.directory, n)) for n in files
+                   if os.path.exists(os.path.join(self.directory, n)))
+        return {
+            "files": len(files),
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
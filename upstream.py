@@ -0,0 +1,596 @@
+import asyncio
+import dataclasses
+import logging
+import math
+import posixpath
+import re
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+from urllib.parse import quote, unquote, urlparse
+from xml.etree import ElementTree
+
+import httpx
+
+from metacache import FileMeta, is_weak_etag, normalize_etag
+from metrics import REGISTRY, UPSTREAM_BYTES, UPSTREAM_DURATION
+from settings import Settings
+
+DAV_NS = "{DAV:}"
+
+T = TypeVar("T")
+
+# 镜像延迟统计：对冲等待时间取最近完成请求的首字节时间分位数，排序使用移动平均；
+# 超过 LATENCY_WINDOW 没有被使用的镜像统计作废，重新得到尝试的机会
+LATENCY_SAMPLES = 64
+LATENCY_WINDOW = 300.0
+LATENCY_ALPHA = 0.3
+# 错误率的半衰期（秒）
+ERROR_HALF_LIFE = 30.0
+# 每个进行中的请求计入的额外延迟（秒），避免所有请求同时涌向同一个镜像
+INFLIGHT_PENALTY = 0.01
+# 样本不足时对冲请求的等待时间（秒）
+INITIAL_HEDGE_DELAY = 1.0
+MIN_HEDGE_SAMPLES = 8
+
+HEDGED_REQUESTS = REGISTRY.counter(
+    "noediv_upstream_hedged_requests_total",
+    "Hedged range requests sent to a second mirror, by which request delivered first",
+    ("winner",),
+)
+FAILOVERS = REGISTRY.counter(
+    "noediv_upstream_failovers_total",
+    "Upstream requests retried on another mirror after an error",
+    ("method",),
+)
+
+PROPFIND_BODY = b"""<?xml version="1.0" encoding="utf-8"?>
+<d:propfind xmlns:d="DAV:">
+  <d:prop>
+    <d:resourcetype/>
+    <d:getcontentlength/>
+    <d:getcontenttype/>
+    <d:getetag/>
+    <d:getlastmodified/>
+  </d:prop>
+</d:propfind>"""
+
+
+class UpstreamError(Exception):
+    """上游服务器返回错误状态码"""
+
+    def __init__(self, status_code: int, message: str = ""):
+        super().__init__(message or f"Upstream returned {status_code}")
+        self.status_code = status_code
+
+
+@dataclass(frozen=True)
+class DAVEntry:
+    """PROPFIND 返回的单个资源"""
+    name: str
+    path: str          # 服务器上的完整路径（已解码）
+    is_dir: bool
+    meta: FileMeta
+
+
+def _parse_multistatus(content: bytes) -> List[DAVEntry]:
+    """解析 207 Multi-Status 响应"""
+    root = ElementTree.fromstring(content)
+    entries = []
+    for response in root.iter(f"{DAV_NS}response"):
+        href = response.findtext(f"{DAV_NS}href") or ""
+        path = unquote(urlparse(href).path)
+        prop = None
+        # 只取状态为 200 的 propstat
+        for propstat in response.findall(f"{DAV_NS}propstat"):
+            status = propstat.findtext(f"{DAV_NS}status") or ""
+            if " 200 " in status or not status:
+                prop = propstat.find(f"{DAV_NS}prop")
+                break
+        if prop is None:
+            continue
+        resourcetype = prop.find(f"{DAV_NS}resourcetype")
+        is_dir = resourcetype is not None and resourcetype.find(f"{DAV_NS}collection") is not None
+        size = (prop.findtext(f"{DAV_NS}getcontentlength") or "0").strip()
+        etag = prop.findtext(f"{DAV_NS}getetag") or ""
+        entries.append(DAVEntry(
+            name=posixpath.basename(path.rstrip('/')),
+            path=path,
+            is_dir=is_dir,
+            meta=FileMeta(
+                size=int(size) if size.isdigit() else 0,
+                content_type=prop.findtext(f"{DAV_NS}getcontenttype") or "application/octet-stream",
+                etag=normalize_etag(etag),
+                last_modified=prop.findtext(f"{DAV_NS}getlastmodified") or "",
+                weak_etag=is_weak_etag(etag),
+            ),
+        ))
+    return entries
+
+
+_CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+def check_content_range(value: str, start: int, end: Optional[int]) -> int:
+    """校验 206 响应的 Content-Range 与请求的范围一致，返回实际的终点
+
+    终点只允许因文件末尾而提前；起点不同或范围超出请求时抛出 502。
+    """
+    match = _CONTENT_RANGE.fullmatch(value.strip())
+    if match is None:
+        raise UpstreamError(502, f"Invalid Content-Range: {value!r}")
+    first, last = int(match.group(1)), int(match.group(2))
+    total = int(match.group(3)) if match.group(3) != '*' else None
+    if first != start or last < first:
+        raise UpstreamError(502, f"Content-Range {value!r} does not start at {start}")
+    if end is not None and last != end and (last > end or total is None or last != total - 1):
+        raise UpstreamError(502, f"Content-Range {value!r} does not match {start}-{end}")
+    return last
+
+
+class DAVClient:
+    """单个 WebDAV 服务器的异步客户端，内部维护 keep-alive 连接池"""
+
+    def __init__(self, base_url: str, username: str, password: str, settings: Settings):
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        self.http = httpx.AsyncClient(
+            auth=(username, password) if username else None,
+            verify=settings.webdav_verify_tls,
+            timeout=httpx.Timeout(settings.webdav_timeout),
+            limits=httpx.Limits(
+                max_connections=settings.upstream_pool_maxsize,
+                max_keepalive_connections=settings.upstream_pool_maxsize,
+            ),
+            transport=httpx.AsyncHTTPTransport(retries=settings.upstream_max_retries),
+        )
+        # 进行中的请求数；被淘汰的客户端等所有请求结束后才关闭连接池
+        self.active = 0
+        self.retired = False
+        self._closing: Optional[asyncio.Task] = None
+
+    def _acquire(self):
+        self.active += 1
+
+    def _release(self):
+        self.active -= 1
+        if self.retired and not self.active:
+            self._close_later()
+
+    def _close_later(self):
+        if self._closing is None:
+            self._closing = asyncio.get_running_loop().create_task(self.http.aclose())
+
+    def retire(self):
+        """不再分配新请求；空闲时立即关闭，否则在最后一个请求结束时关闭"""
+        self.retired = True
+        if not self.active:
+            self._close_later()
+
+    def url(self, remote_path: str) -> str:
+        """构建远程文件的完整URL"""
+        return f"{self.base_url}{quote(remote_path.lstrip('/'))}"
+
+    async def propfind(self, remote_path: str, depth: int = 0) -> Optional[List[DAVEntry]]:
+        """发送 PROPFIND 请求，资源不存在时返回 None"""
+        started = time.monotonic()
+        self._acquire()
+        try:
+            response = await self.http.request(
+                "PROPFIND",
+                self.url(remote_path),
+                content=PROPFIND_BODY,
+                headers={"Depth": str(depth), "Content-Type": "application/xml"},
+            )
+        except httpx.HTTPError:
+            UPSTREAM_DURATION.observe(time.monotonic() - started, protocol="webdav", method="PROPFIND", status="error")
+            raise
+        finally:
+            self._release()
+        UPSTREAM_DURATION.observe(time.monotonic() - started, protocol="webdav", method="PROPFIND",
+                                  status=str(response.status_code))
+        if response.status_code == 404:
+            return None
+        if response.status_code >= 400:
+            raise UpstreamError(response.status_code, f"PROPFIND {remote_path} failed: {response.status_code}")
+        return _parse_multistatus(response.content)
+
+    async def stat(self, remote_path: str) -> Optional[FileMeta]:
+        """获取文件元数据，文件不存在时返回 None"""
+        entries = await self.propfind(remote_path, depth=0)
+        if not entries:
+            return None
+        return entries[0].meta
+
+    async def list(self, remote_path: str) -> List[DAVEntry]:
+        """列出目录下的直接子项（不含目录本身）"""
+        entries = await self.propfind(remote_path.rstrip('/') + '/', depth=1)
+        if entries is None:
+            raise UpstreamError(404, f"Directory not found: {remote_path}")
+        self_path = unquote(urlparse(self.url(remote_path)).path).rstrip('/')
+        return [e for e in entries if e.path.rstrip('/') != self_path]
+
+    async def stream(self, remote_path: str, start: Optional[int] = None, end: Optional[int] = None,
+                     etag: str = "", chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        """流式读取文件的 [start, end] 字节范围（闭区间），保持原始字节
+
+        传入 etag 时会与响应的 ETag 比较，文件已变化则抛出 412 错误，避免拼接出新旧混合的数据。
+        范围请求要求 206 且 Content-Range 与请求一致；忽略 Range 返回 200 的服务器（或代理）
+        由本地跳过 start 之前的字节并在 end 处截断，保证返回的总是所请求的字节。
+        """
+        headers = {"Accept-Encoding": "identity"}
+        if start is not None:
+            headers["Range"] = f"bytes={start}-{'' if end is None else end}"
+        started = time.monotonic()
+        headers_received = False
+        self._acquire()
+        try:
+            async with self.http.stream("GET", self.url(remote_path), headers=headers) as response:
+                # GET 只统计到收到响应头为止（上游首字节时间），数据量另计
+                headers_received = True
+                UPSTREAM_DURATION.observe(time.monotonic() - started, protocol="webdav", method="GET",
+                                          status=str(response.status_code))
+                if response.status_code >= 400:
+                    raise UpstreamError(response.status_code, f"GET {remote_path} failed: {response.status_code}")
+                response_etag = normalize_etag(response.headers.get("ETag", ""))
+                if etag and response_etag and response_etag != etag:
+                    raise UpstreamError(412, f"ETag changed for {remote_path}")
+                # 需要丢弃的前导字节数和最多返回的字节数
+                skip, remaining = 0, None
+                if start is not None:
+                    if response.status_code == 206:
+                        check_content_range(response.headers.get("Content-Range", ""), start, end)
+                    elif response.status_code == 200:
+                        logging.warning(f"上游忽略了 Range 请求，本地截取 {start}-{end}: {remote_path}")
+                        skip = start
+                    else:
+                        raise UpstreamError(502, f"GET {remote_path} returned {response.status_code} for a range")
+                    if end is not None:
+                        remaining = end - start + 1
+                async for chunk in response.aiter_raw(chunk_size):
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        UPSTREAM_BYTES.inc(dropped, protocol="webdav")
+                        chunk = chunk[dropped:]
+                        skip -= dropped
+                    if remaining is not None:
+                        chunk = chunk[:remaining]
+                        remaining -= len(chunk)
+                    if chunk:
+                        UPSTREAM_BYTES.inc(len(chunk), protocol="webdav")
+                        yield chunk
+                    if remaining == 0:
+                        break
+        except httpx.HTTPError:
+            if not headers_received:
+                UPSTREAM_DURATION.observe(time.monotonic() - started, protocol="webdav", method="GET", status="error")
+            raise
+        finally:
+            self._release()
+
+    async def aclose(self):
+        if self._closing is not None:
+            await self._closing
+        else:
+            await self.http.aclose()
+
+
+class Mirror:
+    """一个镜像服务器及其滚动统计"""
+
+    def __init__(self, client: DAVClient, primary: bool = False):
+        self.client = client
+        self.primary = primary          # 主服务器（WEBDAV_SERVER）的 ETag 才与元数据一致
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)     # (记录时间, 首字节时间)，只含完成的请求
+        self.expected: Optional[float] = None              # 首字节时间的指数移动平均，用于排序
+        self.updated = 0.0
+        self.inflight = 0
+        self.requests = 0
+        self.errors = 0
+        self._error_rate = 0.0
+        self._error_updated = time.monotonic()
+
+    @property
+    def error_rate(self) -> float:
+        """按时间衰减的错误率（0~1）"""
+        now = time.monotonic()
+        self._error_rate *= 0.5 ** ((now - self._error_updated) / ERROR_HALF_LIFE)
+        self._error_updated = now
+        return self._error_rate
+
+    def samples(self) -> List[float]:
+        cutoff = time.monotonic() - LATENCY_WINDOW
+        while self.latencies and self.latencies[0][0] < cutoff:
+            self.latencies.popleft()
+        return sorted(latency for _, latency in self.latencies)
+
+    def percentile(self, p: float) -> Optional[float]:
+        samples = self.samples()
+        if not samples:
+            return None
+        return samples[max(min(int(math.ceil(p / 100 * len(samples))) - 1, len(samples) - 1), 0)]
+
+    def _update_expected(self, latency: float):
+        now = time.monotonic()
+        if self.expected is None or now - self.updated > LATENCY_WINDOW:
+            self.expected = latency
+        else:
+            self.expected += LATENCY_ALPHA * (latency - self.expected)
+        self.updated = now
+
+    def record(self, latency: float):
+        """完成的请求：首字节时间计入分位数和移动平均"""
+        self.requests += 1
+        self.latencies.append((time.monotonic(), latency))
+        self._update_expected(latency)
+        self._error_rate = self.error_rate * 0.9
+
+    def abandon(self, waited: float):
+        """被取消的请求：已等待的时间是首字节时间的下限，只计入移动平均，不影响对冲的分位数"""
+        self.requests += 1
+        self._update_expected(waited)
+
+    def fail(self):
+        self.requests += 1
+        self.errors += 1
+        self._error_rate = self.error_rate * 0.9 + 0.1
+
+    def score(self) -> float:
+        """预计的首字节时间，越小越好；近期没有请求的镜像为 0，优先被尝试"""
+        expected = self.expected if self.expected is not None and time.monotonic() - self.updated <= LATENCY_WINDOW else 0.0
+        return (expected + self.inflight * INFLIGHT_PENALTY) / max(1 - self.error_rate, 0.05)
+
+    def stats(self) -> dict:
+        return {
+            "url": self.client.base_url,
+            "primary": self.primary,
+            "expected_ms": round((self.expected or 0) * 1000, 1),
+            "p50_ms": round((self.percentile(50) or 0) * 1000, 1),
+            "p99_ms": round((self.percentile(99) or 0) * 1000, 1),
+            "samples": len(self.latencies),
+            "error_rate": round(self.error_rate, 3),
+            "inflight": self.inflight,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+def _consume_exception(task: asyncio.Task):
+    # 落后请求的异常无人关心，在这里取出，避免 "Task exception was never retrieved"
+    if not task.cancelled():
+        task.exception()
+
+
+def _retryable(error: Exception) -> bool:
+    """连接错误和 5xx 换镜像重试；4xx（文件不存在、ETag 已变化）是确定的结果"""
+    return isinstance(error, httpx.HTTPError) or (isinstance(error, UpstreamError) and error.status_code >= 500)
+
+
+class MirrorSet:
+    """同一 MEDIA_ROOT 的多个 WebDAV 镜像
+
+    - 范围读取发往预计首字节时间最短的镜像（首字节时间的移动平均，按错误率和进行中的请求加权）
+    - 首个镜像在其首字节时间的 hedge_percentile 分位内仍未返回数据时，向次优镜像发出对冲请求，
+      先返回数据的一方继续传输，另一方被取消
+    - 连接错误和 5xx 时换下一个镜像重试；元数据按配置顺序查询主服务器，失败时才使用镜像
+    镜像需要提供相同的文件（例如 rsync -a 同步，保留修改时间）。各服务器的 ETag 通常不同，
+    有多个镜像时元数据去掉 ETag，文件版本统一按大小+修改时间识别，与元数据来自哪台服务器无关。
+    """
+
+    def __init__(self, clients: List[DAVClient], hedge_percentile: float = 95, hedge_min_delay: float = 0.05):
+        self.mirrors = [Mirror(client, primary=i == 0) for i, client in enumerate(clients)]
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self._cleanups = set()      # 关闭落后请求的后台任务
+
+    def normalize(self, meta: Optional[FileMeta]) -> Optional[FileMeta]:
+        """有多个镜像时去掉 ETag，版本退化为大小+修改时间，切换镜像后缓存键和校验不变"""
+        if meta is None or not meta.etag or len(self.mirrors) == 1:
+            return meta
+        return dataclasses.replace(meta, etag="", weak_etag=False)
+
+    def ranked(self) -> List[Mirror]:
+        return sorted(self.mirrors, key=Mirror.score)
+
+    def hedge_delay(self, mirror: Mirror) -> float:
+        """对冲前的等待时间：该镜像近期首字节时间的分位数，样本不足时使用所有镜像的样本"""
+        samples = mirror.samples()
+        if len(samples) < MIN_HEDGE_SAMPLES:
+            samples = sorted(latency for m in self.mirrors for latency in m.samples())
+        if len(samples) < MIN_HEDGE_SAMPLES:
+            return max(INITIAL_HEDGE_DELAY, self.hedge_min_delay)
+        index = min(int(math.ceil(self.hedge_percentile / 100 * len(samples))) - 1, len(samples) - 1)
+        return max(samples[max(index, 0)], self.hedge_min_delay)
+
+    async def metadata(self, method: str, call: Callable[[DAVClient], Awaitable[T]]) -> T:
+        """PROPFIND 按配置顺序执行，近期错误较多的镜像排在后面"""
+        last_error = None
+        for n, mirror in enumerate(sorted(self.mirrors, key=lambda m: m.error_rate > 0.5)):
+            if n:
+                FAILOVERS.inc(method=method)
+            try:
+                return await call(mirror.client)
+            except Exception as e:
+                if not _retryable(e) or len(self.mirrors) == 1:
+                    raise
+                logging.warning(f"镜像 {mirror.client.base_url} {method} 失败: {e}")
+                mirror.fail()
+                last_error = e
+        raise last_error
+
+    async def stream(self, remote_path: str, start: Optional[int] = None, end: Optional[int] = None,
+                     etag: str = "", chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        candidates = iter(self.ranked())
+        # 进行中的请求：等待首个数据块的任务 -> (镜像, 数据流, 开始时间)
+        pending: Dict[asyncio.Task, Tuple[Mirror, AsyncIterator[bytes], float]] = {}
+        hedged = False
+        hedge = None        # 对冲请求发往的镜像
+        winner = None
+        last_error = None
+
+        def launch() -> bool:
+            mirror = next(candidates, None)
+            if mirror is None:
+                return False
+            body = mirror.client.stream(remote_path, start, end, etag if mirror.primary else "", chunk_size)
+            task = asyncio.ensure_future(body.__anext__())
+            task.add_done_callback(_consume_exception)
+            pending[task] = (mirror, body, time.monotonic())
+            mirror.inflight += 1
+            return True
+
+        launch()
+        try:
+            while pending and winner is None:
+                timeout = None
+                if not hedged and len(self.mirrors) > 1 and self.hedge_percentile > 0:
+                    mirror, _, started = next(iter(pending.values()))
+                    timeout = max(self.hedge_delay(mirror) - (time.monotonic() - started), 0)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    if launch():
+                        hedge = list(pending.values())[-1][0]
+                    continue
+                for task in done:
+                    mirror, body, started = pending.pop(task)
+                    mirror.inflight -= 1
+                    try:
+                        first = task.result()
+                    except StopAsyncIteration:
+                        first = b""
+                    except Exception as e:
+                        await body.aclose()
+                        if not _retryable(e):
+                            raise
+                        logging.warning(f"镜像 {mirror.client.base_url} 读取失败: {e}")
+                        mirror.fail()
+                        last_error = e
+                        if not pending and launch():
+                            FAILOVERS.inc(method="GET")
+                        continue
+                    if winner is not None:
+                        await body.aclose()
+                        continue
+                    mirror.record(time.monotonic() - started)
+                    winner = mirror, body, first
+                    if hedge is not None:
+                        HEDGED_REQUESTS.inc(winner="hedge" if mirror is hedge else "primary")
+            if winner is None:
+                raise last_error or UpstreamError(502, f"No mirror available for {remote_path}")
+        finally:
+            # 取消落后的请求，已等待的时间作为其首字节时间的下限计入统计
+            for task, (mirror, body, started) in pending.items():
+                task.cancel()
+                mirror.inflight -= 1
+                mirror.abandon(time.monotonic() - started)
+            if pending:
+                await self._discard([(task, body) for task, (_, body, _) in pending.items()])
+
+        mirror, body, first = winner
+        try:
+            if first:
+                yield first
+            async for chunk in body:
+                yield chunk
+        except Exception as e:
+            if _retryable(e):
+                mirror.fail()
+            raise
+        finally:
+            await body.aclose()
+
+    async def _discard(self, requests: List[Tuple[asyncio.Task, AsyncIterator[bytes]]]):
+        """等待已取消的请求结束并关闭其数据流；调用方再次被取消时清理在后台完成"""
+        async def close():
+            await asyncio.gather(*(task for task, _ in requests), return_exceptions=True)
+            for _, body in requests:
+                try:
+                    await body.aclose()
+                except Exception as e:
+                    logging.debug(f"关闭落后的镜像请求失败: {e}")
+
+        cleanup = asyncio.ensure_future(close())
+        self._cleanups.add(cleanup)
+        cleanup.add_done_callback(self._cleanups.discard)
+        await asyncio.shield(cleanup)
+
+    def stats(self) -> dict:
+        return {
+            "hedge_percentile": self.hedge_percentile,
+            "mirrors": [dict(mirror.stats(), hedge_delay_ms=round(self.hedge_delay(mirror) * 1000, 1))
+                        for mirror in self.mirrors],
+        }
+
+    async def aclose(self):
+        if self._cleanups:
+            await asyncio.gather(*self._cleanups, return_exceptions=True)
+        for mirror in self.mirrors:
+            await mirror.client.aclose()
+
+
+class WebDAVUpstream:
+    """应用级共享的 WebDAV 上游
+
+    默认服务器与用户自定义服务器各自持有一个异步连接池，所有 I/O 都不阻塞事件循环。
+    配置了 WEBDAV_MIRRORS 时，默认服务器和各镜像组成 MirrorSet，读取按延迟选择镜像并对冲。
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.default = DAVClient(
+            settings.webdav_server, settings.webdav_username, settings.webdav_password, settings
+        )
+        mirrors = [
+            DAVClient(url.strip(), settings.webdav_username, settings.webdav_password, settings)
+            for url in settings.webdav_mirrors.split(",") if url.strip()
+        ]
+        self.mirrors = MirrorSet([self.default] + mirrors, settings.upstream_hedge_percentile,
+                                 settings.upstream_hedge_min_delay)
+        # 用户自定义服务器的客户端，按 (url, 用户名, 密码) 缓存，超出数量时淘汰最久未用的；
+        # 被淘汰的客户端在其进行中的请求结束后关闭
+        self._clients = OrderedDict()
+        self._retired: List[DAVClient] = []
+
+    def client_for(self, url: str, username: str = "", password: str = "") -> DAVClient:
+        """获取指定服务器的客户端（同一服务器复用连接池）"""
+        key = (url, username, password)
+        client = self._clients.get(key)
+        if client is None:
+            client = DAVClient(url, username, password, self.settings)
+            self._clients[key] = client
+            while len(self._clients) > self.settings.upstream_custom_clients:
+                _, stale = self._clients.popitem(last=False)
+                stale.retire()
+                self._retired.append(stale)
+            self._retired = [c for c in self._retired if c._closing is None or not c._closing.done()]
+        else:
+            self._clients.move_to_end(key)
+        return client
+
+    def remote_path(self, filename: str) -> str:
+        """根据 MEDIA_ROOT 构建远程路径（未编码）"""
+        media_root = self.settings.media_root
+        return f"{media_root}/{filename}" if media_root else filename
+
+    def file_url(self, remote_path: str) -> str:
+        return self.default.url(remote_path)
+
+    async def stat(self, remote_path: str) -> Optional[FileMeta]:
+        return self.mirrors.normalize(await self.mirrors.metadata("PROPFIND", lambda client: client.stat(remote_path)))
+
+    async def list(self, remote_path: str) -> List[DAVEntry]:
+        entries = await self.mirrors.metadata("PROPFIND", lambda client: client.list(remote_path))
+        return [dataclasses.replace(entry, meta=self.mirrors.normalize(entry.meta)) for entry in entries]
+
+    def stream(self, remote_path: str, start: Optional[int] = None, end: Optional[int] = None,
+               etag: str = "", chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        return self.mirrors.stream(remote_path, start, end, etag, chunk_size)
+
+    async def aclose(self):
+        logging.info("关闭上游连接池")
+        await self.mirrors.aclose()
+        for client in list(self._clients.values()) + self._retired:
+            await client.aclose()
+        self._clients.clear()
+        self._retired.clear()